@@ -0,0 +1,73 @@
+'''Response decoding benchmark: the old path (requests' Response.json(), i.e. stdlib json, then indexing into the
+subtree) against ResponseDecoder on every installed JSON backend, with and without a field projection.  Uses a
+synthetic OrdersResponse page, so it needs neither credentials nor network.
+
+    python benchmarks/decode.py --orders 100 --repeat 200
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import etrader
+
+
+def orders_page(num_orders):
+    '''JSON body of an OrdersResponse page shaped like the API's, num_orders orders of one instrument each'''
+    orders = []
+    for i in range(num_orders):
+        instrument = {'Product': {'symbol': f'SYM{i % 500}', 'securityType': 'EQ'},
+                      'symbolDescription': f'SYMBOL {i % 500} INC COM', 'orderAction': 'SELL' if i % 3 else 'BUY',
+                      'quantityType': 'QUANTITY', 'orderedQuantity': 10 + i % 90, 'filledQuantity': 0,
+                      'averageExecutionPrice': 0, 'estimatedCommission': 0, 'estimatedFees': 0}
+        detail = {'placedTime': 1700000000000 + i, 'orderValue': 1234.56, 'status': 'OPEN', 'orderTerm': 'GOOD_FOR_DAY',
+                  'priceType': 'LIMIT', 'limitPrice': 12.34, 'stopPrice': 0, 'marketSession': 'REGULAR',
+                  'allOrNone': False, 'netPrice': 0, 'netBid': 0, 'netAsk': 0, 'gcd': 0, 'ratio': '',
+                  'Instrument': [instrument]}
+        orders.append({'orderId': 1000 + i, 'details': f'https://api.etrade.com/v1/accounts/x/orders/{1000 + i}',
+                       'orderType': 'EQ', 'OrderDetail': [detail]})
+    return json.dumps({'OrdersResponse': {'marker': 'abc', 'next': 'https://api.etrade.com/next', 'Order': orders}}).encode()
+
+
+def time_decode(decode, content, repeat):
+    '''Seconds per call of decode(content), one sample per run'''
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(content)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=100, help='orders in the page (the API returns at most 100)')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    content = orders_page(args.orders)
+    path = etrader.Etrader.RESPONSE_PATHS['orders_list']
+    cases = [('Response.json() + index', lambda body: json.loads(body)['OrdersResponse']['Order'])]
+    for backend in etrader.ResponseDecoder.BACKENDS:
+        try:
+            decoder = etrader.ResponseDecoder(backend)
+        except ValueError:
+            print(f'{backend}: not installed')
+            continue
+        cases.append((f'{backend}', lambda body, d=decoder: d.decode(body, path)))
+        cases.append((f'{backend} + OpenOrderBook.FIELDS', lambda body, d=decoder: d.decode(body, path, etrader.OpenOrderBook.FIELDS)))
+
+    print(f'{len(content) / 1024:.0f} KiB body, {args.orders} orders, {args.repeat} runs')
+    baseline = None
+    for name, decode in cases:
+        median = statistics.median(time_decode(decode, content, args.repeat))
+        baseline = baseline or median
+        print(f'{name:<40} median {median * 1e6:9.1f} us  {baseline / median:5.2f}x')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''Startup benchmark: how long `import etrader` takes in a fresh interpreter and how long it takes to get the first
+quote.  Import timing needs no credentials; --quote authorizes with secret.py (or the cached session) and hits the API.
+
+    python benchmarks/startup.py --repeat 10
+    python benchmarks/startup.py --quote AAPL
+'''
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = '''
+import sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import etrader
+print(time.perf_counter() - start)
+print(','.join(m for m in ('selenium', 'undetected_chromedriver', 'jxmlease', 'secret', 'aiohttp', 'asyncio', 'numpy') if m in sys.modules))
+''' % REPO_DIR
+
+
+def time_import(repeat):
+    '''Seconds to import etrader in a fresh interpreter, one sample per run, plus the heavy modules it loaded'''
+    samples, loaded = [], ''
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', IMPORT_PROBE], capture_output=True, text=True, check=True).stdout.split('\n')
+        samples.append(float(out[0]))
+        loaded = out[1]
+    return samples, loaded
+
+
+def time_first_quote(symbol, production, defer_connect):
+    '''Seconds spent constructing Etrader and then getting the first quote'''
+    sys.path.insert(0, REPO_DIR)
+    import etrader
+    start = time.perf_counter()
+    client = etrader.Etrader(production=production, defer_connect=defer_connect)
+    constructed = time.perf_counter()
+    client.get_quote(symbol)
+    quoted = time.perf_counter()
+    client.close()
+    return constructed - start, quoted - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh-interpreter import samples')
+    parser.add_argument('--quote', metavar='SYMBOL', help='also measure time to first quote for SYMBOL (needs credentials)')
+    parser.add_argument('--production', action='store_true')
+    args = parser.parse_args()
+
+    samples, loaded = time_import(args.repeat)
+    print(f'import etrader: median {statistics.median(samples) * 1000:.1f} ms, min {min(samples) * 1000:.1f} ms over {len(samples)} runs')
+    print(f'heavy modules loaded at import: {loaded or "none"}')
+    if args.quote:
+        constructed, quoted = time_first_quote(args.quote, args.production, defer_connect=True)
+        print(f'Etrader(defer_connect=True): constructed in {constructed * 1000:.1f} ms, first quote after {quoted * 1000:.1f} ms')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,540 @@
+'''In-process E*TRADE API stub for benchmarks.  Serves account list, balance, portfolio, quote, lookup, option expiry
+and chain, transaction and order payloads shaped like the v1 API (JSON), accepts order preview/place/cancel XML, and can add latency, server
+errors and throttling.  Payload sizes and failure rates are plain attributes that may be changed while it runs.
+
+    with StubServer(latency_sec=0.02) as stub:
+        client = etrader.Etrader(base_url=stub.url, credentials=stub.credentials, defer_connect=True)
+
+An in-process stub shares the GIL with the client it serves, so for timing use StubProcess, the same stub in a
+child process whose settings are changed over HTTP (POST /_stub/config) but read and written like StubServer's:
+
+    with StubProcess(latency_sec=0.02) as stub:
+        stub.accounts = 32
+
+or standalone, to point a client or curl at it:
+
+    python benchmarks/stub_server.py --port 8080 --latency-ms 20
+'''
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import multiprocessing
+import urllib.request
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CREDENTIALS = {'consumer_key': 'stub-consumer-key', 'consumer_secret': 'stub-consumer-secret',
+               'access_token': 'stub-access-token', 'access_token_secret': 'stub-access-token-secret'}
+
+
+SETTINGS = ('latency_sec', 'jitter_sec', 'failure_rate', 'throttle_rate', 'retry_after_sec', 'accounts', 'positions', 'orders',
+            'transactions', 'expiries', 'strikes', 'fill_after_sec')  # attributes /_stub/config can read and change
+
+
+class StubServer(object):
+    '''Threaded HTTP server on 127.0.0.1.  Prices random-walk on every quote, placed orders show up as OPEN orders
+    of their account until cancelled or, with fill_after_sec, filled.  Like the API, a clientOrderId already used by a
+    placed order of the account is rejected on preview and place'''
+    def __init__(self, port=0, latency_sec=0.0, jitter_sec=0.0, failure_rate=0.0, throttle_rate=0.0, retry_after_sec=0,
+                 accounts=4, positions=20, orders=50, transactions=200, expiries=8, strikes=40, fill_after_sec=None, seed=0):
+        self.latency_sec = latency_sec  # added to every response
+        self.jitter_sec = jitter_sec  # plus uniform(0, jitter_sec)
+        self.failure_rate = failure_rate  # fraction answered 500
+        self.throttle_rate = throttle_rate  # fraction answered 429 with Retry-After: retry_after_sec
+        self.retry_after_sec = retry_after_sec
+        self.accounts = accounts
+        self.positions = positions  # per account
+        self.orders = orders  # historical orders per account
+        self.transactions = transactions  # per account
+        self.expiries = expiries  # option expiration dates per underlying, weekly from next Friday
+        self.strikes = strikes  # strikes per option chain
+        self.fill_after_sec = fill_after_sec  # placed orders are half filled after half of it and EXECUTED after it; None keeps them OPEN
+        self.requests = 0
+        self.__random = random.Random(seed)
+        self.__prices = {}
+        self.__placed = {}  # accountIdKey -> {orderId: order}
+        self.__client_order_ids = {}  # accountIdKey -> clientOrderIds of placed orders
+        self.__order_ids = iter(range(900000, sys.maxsize))
+        self.__lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def do_GET(self):
+                stub.handle(self, 'GET')
+
+            def do_POST(self):
+                stub.handle(self, 'POST')
+
+            def do_PUT(self):
+                stub.handle(self, 'PUT')
+
+            def log_message(self, format, *args):
+                return
+
+        self.__server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.__server.server_address[1]
+
+    @property
+    def credentials(self):
+        return dict(CREDENTIALS)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name='etrade-stub', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        return
+
+    def reset_orders(self):
+        '''Forget orders placed so far'''
+        with self.__lock:
+            self.__placed = {}
+            self.__client_order_ids = {}
+        return
+
+    def handle(self, handler, method):
+        if handler.path.startswith('/_stub/'):  # control requests skip counting, latency and failure injection
+            body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0)).decode()
+            return self.__send(handler, *self.control(method, urlsplit(handler.path).path, body))
+        with self.__lock:
+            self.requests += 1
+            roll = self.__random.random()
+            delay = self.latency_sec + (self.__random.uniform(0, self.jitter_sec) if self.jitter_sec else 0)
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0)).decode()
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            return self.__send(handler, 429, {'Error': {'code': 429, 'message': 'Too many requests'}}, {'Retry-After': str(self.retry_after_sec)})
+        if roll < self.throttle_rate + self.failure_rate:
+            return self.__send(handler, 500, {'Error': {'code': 500, 'message': 'Stub failure'}})
+        parts = urlsplit(handler.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        try:
+            status, payload = self.route(method, parts.path, params, body)
+        except KeyError as e:
+            status, payload = 400, {'Error': {'code': 400, 'message': f'Bad request: {e}'}}
+        return self.__send(handler, status, payload)
+
+    @staticmethod
+    def __send(handler, status, payload, headers=None):
+        content = b'' if payload is None else payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(content)
+        return
+
+    def control(self, method, path, body):
+        '''(status, payload) of a /_stub/ request: GET or POST config reads or updates SETTINGS, POST reset_orders'''
+        if path == '/_stub/config':
+            settings = json.loads(body) if method == 'POST' and body else {}
+            unknown = set(settings) - set(SETTINGS)
+            if unknown:
+                return 400, {'Error': {'code': 400, 'message': f'Unknown settings: {sorted(unknown)}'}}
+            for name, value in settings.items():
+                setattr(self, name, value)
+            return 200, dict({name: getattr(self, name) for name in SETTINGS}, requests=self.requests)
+        if path == '/_stub/reset_orders' and method == 'POST':
+            self.reset_orders()
+            return 200, {}
+        return 404, {'Error': {'code': 404, 'message': f'No such resource {path}'}}
+
+    def route(self, method, path, params, body):
+        '''(status, payload) for a request; payload None is sent as an empty body'''
+        if path.startswith('/oauth/'):
+            return 200, b'Access Token has been renewed' if 'renew' in path else b'Revoked Access Token'
+        if path == '/v1/accounts/list.json':
+            return 200, {'AccountListResponse': {'Accounts': {'Account': [self.account(i) for i in range(self.accounts)]}}}
+        match = re.match(r'^/v1/market/quote/([^/]+)\.json$', path)
+        if match:
+            return 200, self.quote_response(match.group(1).split(','))
+        match = re.match(r'^/v1/market/lookup/([^/]+)\.json$', path)
+        if match:
+            search = match.group(1).upper()
+            return 200, {'LookupResponse': {'Data': [{'symbol': search + suffix, 'description': f'{search}{suffix} INC COM', 'type': 'EQUITY'} for suffix in ('', 'A', 'B')]}}
+        if path == '/v1/market/optionexpiredate.json':
+            return 200, {'OptionExpireDateResponse': {'ExpirationDate': [dict(self.expiry(e), expiryType='WEEKLY') for e in range(self.expiries)]}}
+        if path == '/v1/market/optionchains.json':
+            return 200, self.option_chain(params)
+        match = re.match(r'^/v1/accounts/([^/]+)/(.+)$', path)
+        if match is None:
+            return 404, {'Error': {'code': 404, 'message': f'No such resource {path}'}}
+        key, resource = match.groups()
+        index = int(key[1:])
+        if resource == 'balance.json':
+            return 200, self.balance(index)
+        if resource == 'portfolio.json':
+            return 200, {'PortfolioResponse': {'AccountPortfolio': [{'accountId': str(10000 + index), 'Position': [self.position(index, p) for p in range(self.positions)]}]}}
+        if resource == 'transactions.json':
+            return self.page('TransactionListResponse', 'Transaction', self.transactions, lambda t: self.transaction(index, t), params, 50,
+                             lambda page, more: {'moreTransactions': more, 'transactionCount': len(page), 'totalCount': self.transactions})
+        match = re.match(r'^transactions/(\d+)\.json$', resource)
+        if match:
+            return 200, {'TransactionDetailsResponse': dict(self.transaction(index, int(match.group(1)) % max(self.transactions, 1)), Category={'categoryId': '0', 'parentId': '0'})}
+        if resource == 'orders.json':
+            orders = self.order_list(key, index, params)
+            return self.page('OrdersResponse', 'Order', len(orders), orders.__getitem__, params, 100, lambda page, more: {})
+        if resource == 'orders/preview.json' and method == 'POST':
+            if self.duplicate_client_order_id(key, body, claim=False):
+                return 400, self.duplicate_error(body)
+            return 200, {'PreviewOrderResponse': self.previewed_order(index, body)}
+        if resource == 'orders/place.json' and method == 'POST':
+            if self.duplicate_client_order_id(key, body, claim=True):
+                return 400, self.duplicate_error(body)
+            return 200, {'PlaceOrderResponse': self.placed_order(key, index, body)}
+        if resource == 'orders/cancel.json' and method == 'PUT':
+            order_id = int(re.search(r'<orderId>(\d+)</orderId>', body).group(1))
+            with self.__lock:
+                order = self.__placed.get(key, {}).get(order_id)
+                if order is not None:  # listed as CANCELLED from now on, like the API does
+                    self.__placed[key][order_id] = dict(order, OrderDetail=[dict(order['OrderDetail'][0], status='CANCELLED')])
+            return 200, {'CancelOrderResponse': {'accountId': str(10000 + index), 'orderId': order_id, 'cancelTime': int(time.time() * 1000),
+                                                 'Messages': {'Message': [{'code': 5011, 'description': f'Your request to cancel your order {order_id} is being processed.', 'type': 'WARNING'}]}}}
+        return 404, {'Error': {'code': 404, 'message': f'No such resource {path}'}}
+
+    @staticmethod
+    def page(response_key, record_key, total, record, params, max_count, extra):
+        '''One marker-paginated page of total records built by record(i), 204 with no body when there are none'''
+        if not total:
+            return 204, None
+        start = int(params.get('marker') or 0)
+        count = min(int(params.get('count') or max_count), max_count)
+        page = [record(i) for i in range(start, min(start + count, total))]
+        more = start + count < total
+        response = dict(extra(page, more), **{record_key: page})
+        if more:
+            response['marker'] = str(start + count)
+            response['next'] = f'/next?marker={start + count}'
+        return 200, {response_key: response}
+
+    @staticmethod
+    def symbol(index):
+        return 'SYM%d' % index
+
+    @staticmethod
+    def account(index):
+        return {'accountId': str(10000 + index), 'accountIdKey': 'k%d' % index, 'accountMode': 'MARGIN',
+                'accountDesc': 'INDIVIDUAL', 'accountName': f'Stub account {index}', 'accountType': 'INDIVIDUAL',
+                'institutionType': 'BROKERAGE', 'accountStatus': 'ACTIVE', 'closedDate': 0}
+
+    def balance(self, index):
+        cash = 1000000.0 + index
+        return {'BalanceResponse': {'accountId': str(10000 + index), 'institutionType': 'BROKERAGE', 'asOfDate': int(time.time() * 1000),
+                                    'accountType': 'MARGIN', 'optionLevel': 'LEVEL_2', 'accountDescription': 'INDIVIDUAL',
+                                    'quoteMode': 6, 'dayTraderStatus': 'NO_PDT', 'accountMode': 'MARGIN',
+                                    'Cash': {'fundsForOpenOrdersCash': 0.0, 'moneyMktBalance': 0.0},
+                                    'Computed': {'cashAvailableForInvestment': cash, 'cashAvailableForWithdrawal': cash,
+                                                 'totalAvailableForWithdrawal': cash, 'netCash': cash, 'cashBalance': cash,
+                                                 'settledCashForInvestment': cash, 'unSettledCashForInvestment': 0.0,
+                                                 'fundsWithheldFromPurchasePower': 0.0, 'fundsWithheldFromWithdrawal': 0.0,
+                                                 'marginBuyingPower': cash * 2, 'cashBuyingPower': cash, 'dtMarginBuyingPower': cash * 4,
+                                                 'dtCashBuyingPower': cash, 'shortAdjustBalance': 0.0, 'regtEquity': cash, 'regtEquityPercent': 100.0,
+                                                 'accountBalance': cash,
+                                                 'OpenCalls': {'minEquityCall': 0.0, 'fedCall': 0.0, 'cashCall': 0.0, 'houseCall': 0.0},
+                                                 'RealTimeValues': {'totalAccountValue': cash + self.positions * 1000.0,
+                                                                    'netMv': self.positions * 1000.0, 'netMvLong': self.positions * 1000.0,
+                                                                    'netMvShort': 0.0, 'totalLongValue': self.positions * 1000.0}}}}
+
+    def price(self, symbol):
+        '''Last price of symbol after one random-walk step'''
+        with self.__lock:
+            price = self.__prices.get(symbol) or 10.0 + (sum(map(ord, symbol)) % 490)
+            price = round(max(price * (1 + self.__random.gauss(0, 0.001)), 0.01), 2)
+            self.__prices[symbol] = price
+        return price
+
+    def position(self, index, p):
+        symbol = self.symbol((index * 7 + p) % 5000)
+        price, quantity = self.price(symbol), 10 + p % 90
+        return {'positionId': index * 100000 + p, 'accountId': str(10000 + index), 'Product': {'symbol': symbol, 'securityType': 'EQ'},
+                'osiKey': '', 'symbolDescription': symbol, 'dateAcquired': 1600000000000 + p * 86400000, 'pricePaid': price * 0.9,
+                'commissions': 0.0, 'otherFees': 0.0, 'quantity': quantity, 'positionIndicator': 'TYPE2', 'positionType': 'LONG',
+                'daysGain': 1.5, 'daysGainPct': 0.15, 'marketValue': price * quantity, 'totalCost': price * 0.9 * quantity,
+                'totalGain': price * 0.1 * quantity, 'totalGainPct': 11.1, 'pctOfPortfolio': 100.0 / max(self.positions, 1),
+                'costPerShare': price * 0.9, 'todayCommissions': 0.0, 'todayFees': 0.0, 'todayPricePaid': 0.0, 'todayQuantity': 0,
+                'adjPrevClose': price, 'lotsDetails': f'https://api.etrade.com/v1/accounts/k{index}/portfolio/{p}',
+                'quoteDetails': f'https://api.etrade.com/v1/market/quote/{symbol}',
+                'Quick': {'change': 0.1, 'changePct': 0.1, 'lastTrade': price, 'lastTradeTime': int(time.time()),
+                          'quoteStatus': 'REALTIME', 'volume': 100000}}
+
+    def quote_response(self, symbols):
+        data, messages = [], []
+        for symbol in symbols:
+            if symbol.upper().startswith('BAD'):
+                messages.append({'description': f'{symbol} is not a valid symbol.', 'code': 10033, 'type': 'WARNING'})
+                continue
+            data.append(self.quote(symbol.upper()))
+        response = {'QuoteData': data}
+        if messages:
+            response['Messages'] = {'Message': messages}
+        return {'QuoteResponse': response}
+
+    def quote(self, symbol):
+        last, now = self.price(symbol), int(time.time())
+        return {'dateTime': time.strftime('%H:%M:%S EDT %m-%d-%Y'), 'dateTimeUTC': now, 'quoteStatus': 'REALTIME', 'ahFlag': 'false',
+                'Product': {'symbol': symbol, 'securityType': 'EQ'},
+                'All': {'adjustedFlag': False, 'ask': round(last + 0.01, 2), 'askSize': 100, 'askTime': time.strftime('%H:%M:%S EDT %m-%d-%Y'),
+                        'bid': round(last - 0.01, 2), 'bidExchange': '', 'bidSize': 200, 'bidTime': time.strftime('%H:%M:%S EDT %m-%d-%Y'),
+                        'changeClose': 0.12, 'changeClosePercentage': 0.5, 'companyName': f'{symbol} INC COM', 'daysToExpiration': 0,
+                        'dirLast': '1', 'dividend': 0.1, 'eps': 1.2, 'estEarnings': 1.3, 'exDividendDate': 1600000000,
+                        'high': round(last * 1.02, 2), 'high52': round(last * 1.4, 2), 'lastTrade': last, 'low': round(last * 0.98, 2),
+                        'low52': round(last * 0.6, 2), 'open': round(last * 0.99, 2), 'openInterest': 0, 'optionStyle': '',
+                        'optionUnderlier': '', 'previousClose': round(last * 0.995, 2), 'previousDayVolume': 1200000,
+                        'primaryExchange': 'NSDQ', 'symbolDescription': f'{symbol} INC COM', 'totalVolume': 1000000 + now % 1000,
+                        'upc': 0, 'cashDeliverable': 0, 'marketCap': last * 1e9, 'sharesOutstanding': 1e9,
+                        'nextEarningDate': '', 'beta': 1.1, 'yield': 0.8, 'declaredDividend': 0.1, 'dividendPayableDate': 1600000000,
+                        'pe': 25.0, 'week52LowDate': 1580000000, 'week52HiDate': 1590000000, 'intrinsicValue': 0.0,
+                        'timePremium': 0.0, 'optionMultiplier': 0.0, 'contractSize': 0.0, 'expirationDate': 0,
+                        'timeOfLastTrade': now, 'averageVolume': 1100000}}
+
+    @staticmethod
+    def expiry(e):
+        '''year, month and day of the e-th weekly expiration'''
+        now = time.time()
+        friday = time.localtime(now + ((4 - time.localtime(now).tm_wday) % 7 or 7) * 86400 + e * 7 * 86400)
+        return {'year': friday.tm_year, 'month': friday.tm_mon, 'day': friday.tm_mday}
+
+    def option_chain(self, params):
+        symbol = params['symbol'].upper()
+        year, month, day = int(params['expiryYear']), int(params['expiryMonth']), int(params['expiryDay'])
+        near = float(params.get('strikePriceNear') or self.price(symbol))
+        count = min(int(params.get('noOfStrikes') or self.strikes), self.strikes)
+        step = 1.0 if near < 50 else 5.0
+        first = max(step, round(near / step) * step - (count // 2) * step)
+        pairs = []
+        for s in range(count):
+            strike = first + s * step
+            pair = {}
+            for side, flag in (('Call', 'C'), ('Put', 'P')):
+                if params.get('chainType', 'CALLPUT') not in ('CALLPUT', side.upper()):
+                    continue
+                intrinsic = max(near - strike, 0) if flag == 'C' else max(strike - near, 0)
+                premium = round(intrinsic + 0.25 + 2.0 / (1 + abs(near - strike) / step), 2)  # time value falls off away from the money
+                osi_key = '%s%02d%02d%02d%s%08d' % (symbol.ljust(6, '-'), year % 100, month, day, flag, int(strike * 1000))
+                pair[side] = {'optionCategory': 'STANDARD', 'optionRootSymbol': symbol, 'timeStamp': int(time.time()),
+                              'adjustedFlag': False, 'displaySymbol': f"{symbol} {month}/{day}/{year} ${strike:g} {side}",
+                              'optionType': side.upper(), 'strikePrice': strike, 'symbol': symbol, 'bid': premium - 0.05,
+                              'ask': premium + 0.05, 'bidSize': 10, 'askSize': 12, 'inTheMoney': 'y' if intrinsic > 0 else 'n',
+                              'volume': 100 + s, 'openInterest': 1000 + s * 10, 'netChange': 0.05, 'lastPrice': premium,
+                              'quoteDetail': f'https://api.etrade.com/v1/market/quote/{symbol}:{year}:{month}:{day}:{side.upper()}:{strike:g}',
+                              'osiKey': osi_key,
+                              'OptionGreeks': {'rho': 0.01, 'vega': 0.1, 'theta': -0.05, 'delta': 0.5 if flag == 'C' else -0.5,
+                                               'gamma': 0.02, 'iv': 0.3, 'currentValue': False}}
+            pairs.append(pair)
+        return {'OptionChainResponse': {'OptionPair': pairs, 'timeStamp': int(time.time()), 'quoteType': 'DELAYED',
+                                        'nearPrice': near, 'SelectedED': {'month': month, 'year': year, 'day': day}}}
+
+    def transaction(self, index, t):
+        symbol = self.symbol((index * 13 + t) % 5000)
+        quantity, price = 10 + t % 40, 10.0 + t % 200
+        action = 'Bought' if t % 2 else 'Sold'
+        date = 1700000000000 - t * 3600000
+        return {'transactionId': str(index * 10000000 + t), 'accountId': str(10000 + index), 'transactionDate': date,
+                'postDate': date, 'amount': (-1 if action == 'Bought' else 1) * quantity * price,
+                'description': f'{action.upper()} {symbol} INC COM', 'transactionType': action, 'memo': '', 'imageFlag': False,
+                'instType': 'BROKERAGE', 'detailsURI': f'https://api.etrade.com/v1/accounts/k{index}/transactions/{t}',
+                'Brokerage': {'Product': {'symbol': symbol, 'securityType': 'EQ'}, 'quantity': quantity, 'price': price,
+                              'settlementCurrency': 'USD', 'paymentCurrency': 'USD', 'fee': 0.0, 'displaySymbol': symbol,
+                              'settlementDate': date + 2 * 86400000}}
+
+    def order(self, index, order_id, symbol, action, quantity, price_type, limit_price, status, placed_time):
+        instrument = {'Product': {'symbol': symbol, 'securityType': 'EQ'}, 'symbolDescription': f'{symbol} INC COM',
+                      'orderAction': action, 'quantityType': 'QUANTITY', 'orderedQuantity': quantity,
+                      'filledQuantity': quantity if status == 'EXECUTED' else 0, 'averageExecutionPrice': limit_price if status == 'EXECUTED' else 0,
+                      'estimatedCommission': 0.0, 'estimatedFees': 0.0}
+        detail = {'placedTime': placed_time, 'executedTime': placed_time + 1000 if status == 'EXECUTED' else None,
+                  'orderValue': quantity * (limit_price or 10.0), 'status': status, 'orderTerm': 'GOOD_FOR_DAY', 'priceType': price_type,
+                  'limitPrice': limit_price, 'stopPrice': 0, 'marketSession': 'REGULAR', 'allOrNone': False, 'netPrice': 0,
+                  'netBid': 0, 'netAsk': 0, 'gcd': 0, 'ratio': '', 'Instrument': [instrument]}
+        return {'orderId': order_id, 'details': f'https://api.etrade.com/v1/accounts/k{index}/orders/{order_id}', 'orderType': 'EQ',
+                'OrderDetail': [detail]}
+
+    def order_list(self, key, index, params):
+        statuses = ('EXECUTED', 'CANCELLED', 'OPEN', 'EXECUTED', 'EXPIRED')
+        orders = [self.order(index, 1000 + o, self.symbol((index * 3 + o) % 5000), 'BUY' if o % 2 else 'SELL', 10 + o % 50,
+                             'LIMIT', 10.0 + o % 100, statuses[o % len(statuses)], 1700000000000 - o * 600000)
+                  for o in range(self.orders)]
+        with self.__lock:
+            orders = [self.fill(o) for o in self.__placed.get(key, {}).values()][::-1] + orders
+        if 'status' in params:
+            orders = [o for o in orders if o['OrderDetail'][0]['status'] == params['status']]
+        if 'symbol' in params:
+            symbols = set(params['symbol'].split(','))
+            orders = [o for o in orders if o['OrderDetail'][0]['Instrument'][0]['Product']['symbol'] in symbols]
+        return orders
+
+    def fill(self, order):
+        '''A placed order as it stands fill_after_sec after placement'''
+        detail = order['OrderDetail'][0]
+        age = time.time() - detail['placedTime'] / 1000
+        if self.fill_after_sec is None or age < self.fill_after_sec / 2 or detail['status'] != 'OPEN':
+            return order
+        instrument = dict(detail['Instrument'][0])
+        filled = age >= self.fill_after_sec
+        instrument['filledQuantity'] = instrument['orderedQuantity'] if filled else instrument['orderedQuantity'] // 2
+        instrument['averageExecutionPrice'] = detail['limitPrice'] or 10.0
+        detail = dict(detail, status='EXECUTED' if filled else 'PARTIAL', Instrument=[instrument],
+                      executedTime=detail['placedTime'] + int(self.fill_after_sec * 1000) if filled else None)
+        return dict(order, OrderDetail=[detail])
+
+    @staticmethod
+    def __xml(body, tag, default=None):
+        match = re.search(r'<%s>([^<]*)</%s>' % (tag, tag), body)
+        return match.group(1) if match else default
+
+    def duplicate_client_order_id(self, key, body, claim):
+        '''True if the clientOrderId of an order body was already placed in the account.  claim=True records it'''
+        client_order_id = self.__xml(body, 'clientOrderId')
+        with self.__lock:
+            used = self.__client_order_ids.setdefault(key, set())
+            if client_order_id in used:
+                return True
+            if claim:
+                used.add(client_order_id)
+        return False
+
+    def duplicate_error(self, body):
+        return {'Error': {'code': 1015, 'message': f'Client order id {self.__xml(body, "clientOrderId")} has already been used'}}
+
+    def previewed_order(self, index, body):
+        symbol, action = self.__xml(body, 'symbol'), self.__xml(body, 'orderAction')
+        quantity, price_type = int(float(self.__xml(body, 'quantity', 0))), self.__xml(body, 'priceType', 'MARKET')
+        limit_price = float(self.__xml(body, 'limitPrice') or 0)
+        price = limit_price or self.price(symbol)
+        order = {'orderTerm': self.__xml(body, 'orderTerm', 'GOOD_FOR_DAY'), 'priceType': price_type, 'limitPrice': limit_price,
+                 'stopPrice': 0, 'marketSession': self.__xml(body, 'marketSession', 'REGULAR'), 'allOrNone': False,
+                 'messages': {'Message': [{'description': 'Stub preview', 'code': 1042, 'type': 'WARNING'}]},
+                 'egQual': 'EG_QUAL_NOT_A_MARKET_ORDER', 'estimatedCommission': 0.0, 'estimatedTotalAmount': round(price * quantity, 2),
+                 'Instrument': [{'Product': {'symbol': symbol, 'securityType': 'EQ'}, 'symbolDescription': f'{symbol} INC COM',
+                                 'orderAction': action, 'quantityType': 'QUANTITY', 'quantity': quantity, 'cancelQuantity': 0,
+                                 'reserveOrder': True, 'reserveQuantity': 0}]}
+        return {'orderType': 'EQ', 'totalOrderValue': order['estimatedTotalAmount'], 'totalCommission': 0.0, 'Order': [order],
+                'PreviewIds': [{'previewId': next(self.__order_ids)}], 'previewTime': int(time.time() * 1000), 'dstFlag': True,
+                'accountId': str(10000 + index), 'optionLevelCd': 2, 'marginLevelCd': 'MARGIN_TRADING_ALLOWED'}
+
+    def placed_order(self, key, index, body):
+        response = self.previewed_order(index, body)
+        order_id = response.pop('PreviewIds')[0]['previewId']
+        response['OrderIds'] = [{'orderId': order_id}]
+        response['placedTime'] = int(time.time() * 1000)
+        order = response['Order'][0]
+        instrument = order['Instrument'][0]
+        with self.__lock:
+            self.__placed.setdefault(key, {})[order_id] = self.order(index, order_id, instrument['Product']['symbol'], instrument['orderAction'],
+                                                                     instrument['quantity'], order['priceType'], order['limitPrice'],
+                                                                     'OPEN', response['placedTime'])
+        return response
+
+
+def _serve(urls, kwargs):
+    stub = StubServer(**kwargs).start()
+    urls.put(stub.url)
+    threading.Event().wait()
+
+
+class StubProcess(object):
+    '''StubServer in a child process, so it does not compete with the client for the GIL.  SETTINGS attributes,
+    requests and reset_orders() are forwarded to it over HTTP'''
+    def __init__(self, **kwargs):
+        object.__setattr__(self, '_kwargs', kwargs)
+        object.__setattr__(self, '_process', None)
+        object.__setattr__(self, 'url', None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        urls = context.Queue()
+        process = context.Process(target=_serve, args=(urls, self._kwargs), name='etrade-stub', daemon=True)
+        process.start()
+        object.__setattr__(self, '_process', process)
+        object.__setattr__(self, 'url', urls.get(timeout=30))
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+            object.__setattr__(self, '_process', None)
+        return
+
+    @property
+    def credentials(self):
+        return dict(CREDENTIALS)
+
+    @staticmethod
+    def symbol(index):
+        return StubServer.symbol(index)
+
+    def __control(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        with urllib.request.urlopen(urllib.request.Request(self.url + path, data=data, method='POST' if data is not None else 'GET')) as response:
+            return json.loads(response.read() or b'{}')
+
+    def __getattr__(self, name):  # only called for names not set on the proxy itself
+        if name in SETTINGS or name == 'requests':
+            return self.__control('/_stub/config')[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name not in SETTINGS:
+            raise AttributeError(f'{name} is not a stub setting')
+        self.__control('/_stub/config', {name: value})
+        return
+
+    def reset_orders(self):
+        self.__control('/_stub/reset_orders', {})
+        return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubServer(args.port, args.latency_ms / 1000, args.jitter_ms / 1000, args.failure_rate, args.throttle_rate).start()
+    print(f'E*TRADE stub at {stub.url}, credentials {json.dumps(stub.credentials)}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
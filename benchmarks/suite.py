@@ -0,0 +1,200 @@
+'''Benchmark suite against the E*TRADE stub (benchmarks/stub_server.py).  Measures throughput and tail
+latency of quote fan-out, option chains, account hydration, batched order placement and history walks at several client
+concurrency levels (max_workers) and payload sizes.  Needs no credentials or network: Etrader is pointed at the stub
+with base_url and token credentials, which bypasses the browser login.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --latency-ms 50 --concurrency 1,8,32 --json results.json
+    python benchmarks/suite.py --baseline results.json --tolerance 0.15   # exit status 1 on regressions
+
+The client's rate limiter is off unless --rate-limits is given, so results show the client's own overhead.  The stub
+runs in a child process; --in-process serves it from a thread of the benchmark instead, which is quicker to start but
+makes the stub compete with the client for the GIL and so understates the client's concurrency.  The report's
+stub_mode records which was used.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+import etrader
+from stub_server import StubServer, StubProcess
+
+
+def percentile(samples, fraction):
+    '''Nearest-rank percentile of a non-empty sample list'''
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def client(stub, concurrency, rate_limits, **kwargs):
+    return etrader.Etrader(base_url=stub.url, credentials=stub.credentials, defer_connect=True, max_workers=concurrency,
+                           rate_limits=etrader.RateLimiter.DEFAULT_LIMITS if rate_limits else None, **kwargs)
+
+
+def quote_fanout(stub, size, concurrency, rate_limits):
+    '''One get_quote call for size symbols'''
+    symbols = [StubServer.symbol(i) for i in range(size)]
+    trader = client(stub, concurrency, rate_limits)
+    trader.session  # authorize only, no account loading
+    return trader, lambda: trader.get_quote(symbols), size
+
+
+def option_chain(stub, size, concurrency, rate_limits):
+    '''A full option chain of size expiries, expiry dates cached, chains always fetched'''
+    stub.expiries = size
+    trader = client(stub, concurrency, rate_limits)
+    trader.session
+    trader.get_option_expiry_dates('SYM1')
+
+    def __chain():
+        chain = trader.get_option_chain('SYM1', max_age_sec=0)
+        if chain.missing:
+            raise RuntimeError(f'{len(chain.missing)} expiries missing')
+    return trader, __chain, size
+
+
+def account_hydration(stub, size, concurrency, rate_limits):
+    '''Listing size accounts and fetching every balance and portfolio'''
+    stub.accounts = size
+    trader = client(stub, concurrency, rate_limits)
+    trader.session
+    return trader, lambda: trader.get_list_of_accounts(lazy=False), size
+
+
+def order_placement(stub, size, concurrency, rate_limits):
+    '''A place_orders batch of size limit buys: preview and place of each order'''
+    stub.accounts = 1
+    trader = client(stub, concurrency, rate_limits)
+    trader.account_list
+    intents = [{'symbol': StubServer.symbol(i), 'action': 'BUY', 'num_shares': 1, 'limit_price': 10.0} for i in range(size)]
+
+    def __place():
+        results = trader.place_orders(intents)
+        errors = [r['error'] for r in results if r['error']]
+        if errors:
+            raise RuntimeError(errors[0])
+        stub.reset_orders()
+    return trader, __place, size
+
+
+def history_walk(stub, size, concurrency, rate_limits):
+    '''Walking all size transactions of every account, accounts walked concurrently'''
+    stub.accounts, stub.transactions = concurrency, size
+    trader = client(stub, concurrency, rate_limits)
+    account_ids = [account['accountId'] for account in trader.get_list_of_accounts(lazy=True)]
+
+    def __walk():
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            walked = sum(pool.map(lambda account_id: sum(1 for _ in trader.iter_transactions(account_id=account_id)), account_ids))
+        if walked != size * len(account_ids):
+            raise RuntimeError(f'walked {walked} transactions, expected {size * len(account_ids)}')
+    return trader, __walk, size * len(account_ids)
+
+
+SCENARIOS = {'quote_fanout': (quote_fanout, 'symbols', (50, 500, 2000)),
+             'option_chain': (option_chain, 'expiries', (8, 32)),
+             'account_hydration': (account_hydration, 'accounts', (4, 32)),
+             'order_placement': (order_placement, 'orders', (10, 50)),
+             'history_walk': (history_walk, 'transactions', (200, 2000))}
+
+
+def run(name, stub, size, concurrency, repeat, rate_limits):
+    '''Time repeat calls of one scenario after a warm-up call'''
+    setup, unit, _ = SCENARIOS[name]
+    failure_rate, throttle_rate = stub.failure_rate, stub.throttle_rate
+    stub.failure_rate = stub.throttle_rate = 0.0  # failures are injected into the timed runs only
+    trader, operation, items = setup(stub, size, concurrency, rate_limits)
+    try:
+        operation()  # warm-up: connections, caches, first-use imports
+        stub.failure_rate, stub.throttle_rate = failure_rate, throttle_rate
+        samples, errors = [], 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            op_start = time.perf_counter()
+            try:
+                operation()
+            except Exception:
+                errors += 1
+            samples.append(time.perf_counter() - op_start)
+        elapsed = time.perf_counter() - start
+    finally:
+        stub.failure_rate, stub.throttle_rate = failure_rate, throttle_rate
+        trader.close()
+    return {'scenario': name, 'size': size, 'unit': unit, 'concurrency': concurrency, 'runs': repeat, 'errors': errors,
+            'ops_per_sec': repeat / elapsed, 'items_per_sec': repeat * items / elapsed,
+            'p50_ms': percentile(samples, 0.5) * 1000, 'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000, 'max_ms': max(samples) * 1000}
+
+
+def compare(results, baseline, tolerance):
+    '''Results whose throughput fell or p95 latency rose by more than tolerance against a baseline run'''
+    previous = {(r['scenario'], r['size'], r['concurrency']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['size'], result['concurrency']))
+        if before is None:
+            continue
+        if result['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance):
+            regressions.append((result, 'ops_per_sec', before['ops_per_sec'], result['ops_per_sec']))
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append((result, 'p95_ms', before['p95_ms'], result['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,4,16', help='client max_workers levels')
+    parser.add_argument('--sizes', help='payload sizes for every scenario, default per scenario')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per case')
+    parser.add_argument('--latency-ms', type=float, default=10.0, help='stub latency per response')
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of stub responses that are 500s')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of stub responses that are 429s')
+    parser.add_argument('--rate-limits', action='store_true', help="keep the client's default rate limits")
+    parser.add_argument('--in-process', action='store_true', help='serve the stub from this process (shares the GIL)')
+    parser.add_argument('--json', metavar='PATH', help='write results to PATH')
+    parser.add_argument('--baseline', metavar='PATH', help='compare with results written by an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown before a regression is reported')
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(',')]
+    results = []
+    print(f'{"scenario":<18} {"size":>6} {"conc":>4} {"ops/s":>9} {"items/s":>10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>6}')
+    stub_class = StubServer if args.in_process else StubProcess
+    with stub_class(latency_sec=args.latency_ms / 1000, jitter_sec=args.jitter_ms / 1000, failure_rate=args.failure_rate,
+                    throttle_rate=args.throttle_rate) as stub:
+        for name in args.scenarios.split(','):
+            sizes = [int(s) for s in args.sizes.split(',')] if args.sizes else SCENARIOS[name][2]
+            for size in sizes:
+                for concurrency in levels:
+                    result = run(name, stub, size, concurrency, args.repeat, args.rate_limits)
+                    results.append(result)
+                    print(f'{name:<18} {size:>6} {concurrency:>4} {result["ops_per_sec"]:>9.2f} {result["items_per_sec"]:>10.1f} '
+                          f'{result["p50_ms"]:>8.1f} {result["p95_ms"]:>8.1f} {result["p99_ms"]:>8.1f} {result["errors"]:>6}')
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'settings': vars(args),
+              'stub_mode': 'in-process (shares the GIL with the client)' if args.in_process else 'subprocess', 'results': results}
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+    if args.baseline:
+        with open(args.baseline) as infile:
+            regressions = compare(results, json.load(infile), args.tolerance)
+        for result, metric, before, after in regressions:
+            print(f'REGRESSION {result["scenario"]} size={result["size"]} concurrency={result["concurrency"]}: {metric} {before:.2f} -> {after:.2f}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.tolerance:.0%} against {args.baseline}')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,2179 @@
 # Work in progress for wrapping e-trade API: https://apisb.etrade.com/docs/api/market/api-quote-v1.html
+# Heavy or optional dependencies (selenium, undetected_chromedriver, jxmlease, secret, sqlite3, asyncio, aiohttp,
+# numpy and the simdjson/orjson/ujson JSON backends) are imported where they are first needed, so importing this module stays cheap.
 import os
 import json
 from rauth import OAuth1Service
 from rauth.session import OAuth1Session
-import undetected_chromedriver.v2 as uc
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.by import By
 from datetime import datetime
 from datetime import timedelta
+from datetime import date
 import time
-import secret
-from threading import *
+from threading import Condition, Event, Lock, RLock, Thread, current_thread, get_ident, local
 import msgpack
 import math
-import jxmlease
+from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import islice, accumulate
+from collections import OrderedDict, deque
+import requests
+from requests.adapters import HTTPAdapter
+import base64
+import hashlib
+import hmac
+import uuid
+import heapq
+import random
+from itertools import count as sequence
+import queue
+import importlib
+import bisect
+import re
+import zlib
+import tempfile
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
+
+def _client_order_id(unique_id=None):
+    '''clientOrderId of an order: unique_id, or a fresh random one (at most 20 characters, unique per account).  Pass
+    the same id to both preview and place'''
+    return unique_id if unique_id is not None else uuid.uuid4().hex[:20]
+
+
+def _preview_order_xml(symbol, order_action, num_shares, price_type, limit_price, stop_price, market_session, order_term, all_or_none, unique_id):
+    '''Build the XML body of a PreviewOrderRequest for an equity order'''
+    instrument = {'Product': {'securityType': 'EQ', 'symbol':symbol},
+                 'orderAction': order_action,
+                 'quantityType': 'QUANTITY',
+                 'quantity': num_shares
+                  }
+    order = {'allOrNone': str(all_or_none).lower(),
+             'priceType': price_type,
+             'orderTerm': order_term,
+             'marketSession': market_session,
+             'stopPrice': stop_price,
+             'limitPrice': limit_price,
+             'Instrument': instrument
+             }
+    payload = {'PreviewOrderRequest': {'orderType': 'EQ',
+                                       'clientOrderId': _client_order_id(unique_id),
+                                       'Order': order}}
+    import jxmlease
+    return jxmlease.emit_xml(payload)
+
+
+def _place_order_xml(order_obj, unique_id=None):
+    '''Build the XML body of a PlaceOrderRequest from a PreviewOrderResponse'''
+    payload = {'PlaceOrderRequest': order_obj}
+    payload['PlaceOrderRequest']['Order'] = payload['PlaceOrderRequest']['Order'][0]
+    payload['PlaceOrderRequest']['clientOrderId'] = _client_order_id(unique_id)
+    import jxmlease
+    return jxmlease.emit_xml(payload)
+
+
+def _cancel_order_xml(order_number):
+    '''Build the XML body of a CancelOrderRequest'''
+    import jxmlease
+    return jxmlease.emit_xml({"CancelOrderRequest": {"orderId": order_number}})
+
+
+def _placed_order(place_response):
+    '''Flatten a PlaceOrderResponse to its order dict with the new orderId attached'''
+    order = place_response['PlaceOrderResponse']['Order'][0]
+    order['orderId'] = place_response['PlaceOrderResponse']['OrderIds'][0]['orderId']
+    return order
+
+
+def _merge_quote_response(quotes, chunk, quote_response):
+    '''Key QuoteData of one quote call by the requested symbols, recording an error for symbols with no quote'''
+    requested = {symbol.upper(): symbol for symbol in chunk}
+    for quote in quote_response.get('QuoteData', []):
+        returned = quote['Product']['symbol']
+        quotes[requested.get(returned.upper(), returned)] = quote
+    messages = quote_response.get('Messages', {}).get('Message', [])
+    reason = '; '.join(m['description'] for m in messages if 'description' in m) or 'No quote returned'
+    quotes.update({symbol: {'error': reason} for symbol in chunk if symbol not in quotes})
+    return quotes
+
+
+class ResponseDecoder(object):
+    '''Decodes JSON response bodies with the fastest installed backend and keeps only the part a caller needs.
+    A fields spec projects the decoded value: None keeps it whole, a tuple of keys keeps those keys, a dict maps
+    keys to nested specs, and lists are projected element by element.  With simdjson only the selected subtree is
+    ever turned into Python objects; other backends decode the whole body first, so there projecting costs extra
+    time and only pays off in the memory the smaller result keeps'''
+    BACKENDS = ('simdjson', 'orjson', 'ujson', 'json')  # in order of preference
+    WHOLE = object()  # fields of a caller that wants the whole value, whatever the endpoint's response_fields
+
+    def __init__(self, backend=None):
+        candidates = self.BACKENDS if backend is None else (backend,)
+        for name in candidates:
+            try:
+                self.__module = importlib.import_module(name)
+            except ImportError:
+                continue
+            self.backend = name
+            break
+        else:
+            raise ValueError(f'JSON backend {backend} is not installed')
+        self.__parsers = local()  # simdjson parsers are not thread-safe
+
+    def reader_fields(self, fields):
+        '''fields for a caller that only reads those keys of the value: the spec itself with simdjson, where it spares
+        decoding the rest, else WHOLE, since the body is already decoded and projecting it would only add work'''
+        return fields if self.backend == 'simdjson' else self.WHOLE
+
+    def decode(self, content, path=(), fields=None, default=None):
+        '''Value at path (keys and list indexes) of a JSON body, projected onto fields.  default for an empty body'''
+        if not content:
+            return default
+        fields = self.normalize(fields)
+        if self.backend != 'simdjson':
+            node = self.__module.loads(content)
+            for key in path:
+                node = node[key]
+            return node if fields is None else self.project(node, fields)
+        node = self.__parse(content)
+        for key in path:
+            node = node[key]
+        return self.project(node, fields)
+
+    def __parse(self, content):
+        parser = getattr(self.__parsers, 'parser', None)
+        if parser is None:
+            parser = self.__parsers.parser = self.__module.Parser()
+        try:
+            return parser.parse(content)
+        except RuntimeError:  # a document of this parser is still referenced, e.g. by a traceback
+            self.__parsers.parser = self.__module.Parser()
+            return self.__parsers.parser.parse(content)
+
+    @classmethod
+    def normalize(cls, fields):
+        '''Spec with every tuple of keys expanded to a dict, so projecting each record does no conversion'''
+        if fields is None:
+            return None
+        if not isinstance(fields, dict):
+            return dict.fromkeys(fields)
+        return {key: cls.normalize(sub) for key, sub in fields.items()}
+
+    @classmethod
+    def project(cls, node, fields):
+        '''Plain Python copy of node restricted to a normalized fields spec'''
+        if fields is None:
+            return cls.__plain(node)
+        if type(node) is list or hasattr(node, 'as_list'):
+            return [cls.project(item, fields) for item in node]
+        if type(node) is dict:
+            return {key: node[key] if sub is None else cls.project(node[key], sub) for key, sub in fields.items() if key in node}
+        if not hasattr(node, 'as_dict'):
+            return node
+        projected = {}
+        for key, sub in fields.items():
+            try:
+                value = node[key]
+            except KeyError:
+                continue
+            projected[key] = cls.project(value, sub)
+        return projected
+
+    @staticmethod
+    def __plain(node):
+        if hasattr(node, 'as_dict'):
+            return node.as_dict()
+        if hasattr(node, 'as_list'):
+            return node.as_list()
+        return node
+
+
+class TTLCache(object):
+    '''Thread-safe LRU cache where each read names its own maximum age.  Concurrent misses for the same key are
+    coalesced so only one caller loads it while the others wait for that result'''
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.__entries = OrderedDict()  # key -> (monotonic timestamp, value)
+        self.__in_flight = {}  # key -> Future resolved by the loading caller
+        self.__lock = Lock()
+
+    def get_many(self, keys, loader, max_age):
+        '''Return {key: value} for keys.  Entries older than max_age seconds are loaded with one loader(missing_keys)
+        call, which must return a dict.  Values for which store(value) is False are returned but not cached'''
+        now = time.monotonic()
+        result, waiting, owned = {}, {}, {}
+        with self.__lock:
+            for key in keys:
+                entry = self.__entries.get(key)
+                if entry is not None and now - entry[0] <= max_age:
+                    self.__entries.move_to_end(key)
+                    result[key] = entry[1]
+                    self.hits += 1
+                elif key in self.__in_flight:
+                    waiting[key] = self.__in_flight[key]
+                    self.coalesced += 1
+                else:
+                    owned[key] = self.__in_flight[key] = Future()
+                    self.misses += 1
+        if owned:
+            try:
+                loaded = loader(list(owned))
+            except Exception as e:
+                with self.__lock:
+                    for key in owned:
+                        del self.__in_flight[key]
+                for future in owned.values():
+                    future.set_exception(e)
+                raise
+            with self.__lock:
+                stamp = time.monotonic()
+                for key in owned:
+                    del self.__in_flight[key]
+                    if key in loaded and self.store(loaded[key]):
+                        self.__entries[key] = (stamp, loaded[key])
+                        self.__entries.move_to_end(key)
+                while len(self.__entries) > self.max_size:
+                    self.__entries.popitem(last=False)
+            for key, future in owned.items():
+                future.set_result(loaded.get(key))
+                result[key] = loaded.get(key)
+        for key, future in waiting.items():
+            result[key] = future.result()
+        return result
+
+    def get(self, key, loader, max_age):
+        '''Single key form of get_many, loader(key) returns the value'''
+        return self.get_many([key], lambda keys: {keys[0]: loader(keys[0])}, max_age)[key]
+
+    @staticmethod
+    def store(value):
+        '''Decide whether a loaded value may be cached'''
+        return not (isinstance(value, dict) and 'error' in value)
+
+    def invalidate(self, key=None):
+        '''Drop one key, or every entry when key is None'''
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+        return
+
+    def invalidate_matching(self, predicate):
+        '''Drop every entry whose key satisfies predicate(key)'''
+        with self.__lock:
+            for key in [key for key in self.__entries if predicate(key)]:
+                del self.__entries[key]
+        return
+
+    def stats(self):
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'size': len(self.__entries), 'max_size': self.max_size}
+
+
+class OpenOrderBook(object):
+    '''Open orders of one account indexed by order id and symbol, so shares committed to open sells are O(1) lookups'''
+    SELL_ACTIONS = ('SELL', 'SELL_SHORT')
+    FIELDS = {'orderId': None,  # the only parts of each order load() reads, see ResponseDecoder
+              'OrderDetail': {'Instrument': {'Product': ('symbol',), 'orderAction': None, 'orderedQuantity': None}}}
+
+    def __init__(self):
+        self.refreshed_at = None  # monotonic time of the last full load, None until first loaded
+        self.refreshing = False
+        self.__orders = {}  # int orderId -> (symbol, order action, quantity)
+        self.__sell_shares = {}  # symbol -> shares committed to open sell orders
+        self.__lock = Lock()
+
+    def load(self, orders):
+        '''Replace the book with an OrdersResponse['Order'] list of open orders'''
+        entries = {}
+        for order in orders:
+            instrument = order['OrderDetail'][0]['Instrument'][0]
+            entries[order['orderId']] = (instrument['Product']['symbol'], instrument.get('orderAction'), instrument['orderedQuantity'])
+        with self.__lock:
+            self.__orders = {}
+            self.__sell_shares = {}
+            for order_id, entry in entries.items():
+                self.__add(order_id, entry)
+            self.refreshed_at = time.monotonic()
+        return
+
+    def add_placed_order(self, order):
+        '''Record an order returned by a place request'''
+        instrument = order['Instrument'][0]
+        with self.__lock:
+            self.__add(order['orderId'], (instrument['Product']['symbol'], instrument.get('orderAction'), instrument['quantity']))
+        return
+
+    def remove(self, order_id):
+        '''Drop an order, given its id as an int or a string'''
+        with self.__lock:
+            symbol, action, quantity = self.__orders.pop(int(order_id), (None, None, 0))
+            if action in self.SELL_ACTIONS:
+                self.__sell_shares[symbol] -= quantity
+        return
+
+    def sell_shares(self, symbol):
+        return self.__sell_shares.get(symbol, 0)
+
+    def is_stale(self, max_age_sec):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at > max_age_sec
+
+    def __add(self, order_id, entry):
+        order_id = int(order_id)  # ids arrive as ints from the API and as strings from callers
+        if order_id in self.__orders:
+            return
+        self.__orders[order_id] = entry
+        symbol, action, quantity = entry
+        if action in self.SELL_ACTIONS:
+            self.__sell_shares[symbol] = self.__sell_shares.get(symbol, 0) + quantity
+        return
+
+
+class HistoryStore(object):
+    '''Local SQLite copy of transaction and order history, indexed by account, symbol, date and id, so history is
+    downloaded once and queried locally.  Fill it with Etrader.sync_transaction_history / sync_order_history'''
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.row_factory = sqlite3.Row
+        self.__lock = Lock()
+        with self.__lock, self.__db:
+            self.__db.executescript('''
+                CREATE TABLE IF NOT EXISTS transactions (
+                    transaction_id TEXT PRIMARY KEY,
+                    account_id TEXT NOT NULL,
+                    transaction_date INTEGER,
+                    symbol TEXT,
+                    transaction_type TEXT,
+                    amount REAL,
+                    record TEXT NOT NULL,
+                    details TEXT);
+                CREATE INDEX IF NOT EXISTS transactions_account_date ON transactions (account_id, transaction_date);
+                CREATE INDEX IF NOT EXISTS transactions_symbol_date ON transactions (symbol, transaction_date);
+                CREATE INDEX IF NOT EXISTS transactions_date ON transactions (transaction_date);
+                CREATE TABLE IF NOT EXISTS orders (
+                    account_id TEXT NOT NULL,
+                    order_id TEXT NOT NULL,
+                    placed_time INTEGER,
+                    symbol TEXT,
+                    status TEXT,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (account_id, order_id));
+                CREATE INDEX IF NOT EXISTS orders_account_time ON orders (account_id, placed_time);
+                CREATE INDEX IF NOT EXISTS orders_symbol_time ON orders (symbol, placed_time);
+            ''')
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+        return
+
+    def latest_transaction_date(self, account_id):
+        '''Epoch milliseconds of the newest stored transaction of an account, None if none are stored'''
+        return self.__scalar('SELECT MAX(transaction_date) FROM transactions WHERE account_id = ?', (str(account_id),))
+
+    def order_sync_start(self, account_id):
+        '''Epoch milliseconds from which orders must be re-downloaded: the oldest stored order that may still change
+        status, else the most recently placed stored order.  None if no orders are stored'''
+        return self.__scalar('''SELECT COALESCE(
+            (SELECT MIN(placed_time) FROM orders WHERE account_id = ? AND status IN ('OPEN', 'PARTIAL', 'CANCEL_REQUESTED')),
+            (SELECT MAX(placed_time) FROM orders WHERE account_id = ?))''', (str(account_id), str(account_id)))
+
+    def has_transaction(self, transaction_id):
+        return self.__scalar('SELECT 1 FROM transactions WHERE transaction_id = ?', (str(transaction_id),)) is not None
+
+    def add_transactions(self, account_id, transactions):
+        '''Insert transactions not stored yet, returns how many were new'''
+        rows = [(str(t['transactionId']), str(account_id), t.get('transactionDate'), Etrader.transaction_symbol(t),
+                 t.get('transactionType'), t.get('amount'), json.dumps(t)) for t in transactions]
+        with self.__lock, self.__db:
+            before = self.__db.total_changes
+            self.__db.executemany('''INSERT OR IGNORE INTO transactions
+                (transaction_id, account_id, transaction_date, symbol, transaction_type, amount, record)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+            return self.__db.total_changes - before
+
+    def transactions_missing_details(self, account_id):
+        with self.__lock:
+            rows = self.__db.execute('SELECT transaction_id FROM transactions WHERE account_id = ? AND details IS NULL',
+                                     (str(account_id),)).fetchall()
+        return [row[0] for row in rows]
+
+    def set_transaction_details(self, transaction_id, details):
+        with self.__lock, self.__db:
+            self.__db.execute('UPDATE transactions SET details = ? WHERE transaction_id = ?', (json.dumps(details), str(transaction_id)))
+        return
+
+    def add_orders(self, account_id, orders):
+        '''Insert orders, replacing stored copies so status changes are kept'''
+        rows = []
+        for order in orders:
+            detail = order.get('OrderDetail', [{}])[0]
+            symbol = detail.get('Instrument', [{}])[0].get('Product', {}).get('symbol')
+            rows.append((str(account_id), str(order['orderId']), detail.get('placedTime'), symbol, detail.get('status'), json.dumps(order)))
+        with self.__lock, self.__db:
+            self.__db.executemany('''INSERT OR REPLACE INTO orders (account_id, order_id, placed_time, symbol, status, record)
+                VALUES (?, ?, ?, ?, ?, ?)''', rows)
+        return len(rows)
+
+    def transactions(self, account_id=None, symbol=None, start=None, end=None, transaction_type=None):
+        '''Stored transactions, newest first, each with its details under 'details' when they were fetched.  start
+        and end are datetimes or epoch milliseconds, inclusive'''
+        clauses, args = self.__filters(account_id, symbol, start, end, 'transaction_date')
+        if transaction_type is not None:
+            clauses.append('transaction_type = ?')
+            args.append(transaction_type)
+        rows = self.__select('SELECT record, details FROM transactions', clauses, args, 'transaction_date DESC')
+        transactions = []
+        for row in rows:
+            transaction = json.loads(row['record'])
+            if row['details'] is not None:
+                transaction['details'] = json.loads(row['details'])
+            transactions.append(transaction)
+        return transactions
+
+    def orders(self, account_id=None, symbol=None, start=None, end=None, status=None):
+        '''Stored orders, most recently placed first'''
+        clauses, args = self.__filters(account_id, symbol, start, end, 'placed_time')
+        if status is not None:
+            clauses.append('status = ?')
+            args.append(status)
+        return [json.loads(row['record']) for row in self.__select('SELECT record FROM orders', clauses, args, 'placed_time DESC')]
+
+    @staticmethod
+    def __filters(account_id, symbol, start, end, date_column):
+        def __epoch_ms(value):
+            return int(value.timestamp() * 1000) if hasattr(value, 'timestamp') else int(value)
+
+        clauses, args = [], []
+        if account_id is not None:
+            clauses.append('account_id = ?')
+            args.append(str(account_id))
+        if symbol is not None:
+            clauses.append('symbol = ?')
+            args.append(symbol)
+        if start is not None:
+            clauses.append(f'{date_column} >= ?')
+            args.append(__epoch_ms(start))
+        if end is not None:
+            clauses.append(f'{date_column} <= ?')
+            args.append(__epoch_ms(end))
+        return clauses, args
+
+    def __select(self, query, clauses, args, order_by):
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        with self.__lock:
+            return self.__db.execute(query + ' ORDER BY ' + order_by, args).fetchall()
+
+    def __scalar(self, query, args):
+        with self.__lock:
+            row = self.__db.execute(query, args).fetchone()
+        return row[0] if row is not None else None
+
+
+class SessionStore(object):
+    '''Session cache file shared by every process of a user.  Writes go to a temporary file that atomically replaces
+    the cache, so readers never see a partial file, and lock() takes an exclusive advisory lock (fcntl, or msvcrt on
+    Windows) on a side file so only one process at a time logs in, renews or re-authorizes while the others wait and
+    then reuse its result.  lock() is re-entrant within a thread and also serializes threads of one process'''
+    def __init__(self, path, fresh_sec=300):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.fresh_sec = fresh_sec  # a cache written this recently is used without testing it first
+        self.__thread_lock = RLock()
+        self.__depth = 0
+        self.__lock_file = None
+
+    @contextmanager
+    def lock(self):
+        with self.__thread_lock:
+            if self.__depth == 0:
+                lock_file = open(self.lock_path, 'a+b')
+                try:
+                    self.__acquire(lock_file)
+                except BaseException:
+                    lock_file.close()
+                    raise
+                self.__lock_file = lock_file
+            self.__depth += 1
+            try:
+                yield self
+            finally:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.__release(self.__lock_file)
+                    self.__lock_file.close()
+                    self.__lock_file = None
+
+    @staticmethod
+    def __acquire(lock_file):
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    return
+                except OSError:  # LK_LOCK gives up after about 10 seconds, keep waiting
+                    continue
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return
+
+    @staticmethod
+    def __release(lock_file):
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        return
+
+    def read(self):
+        '''Cached session parameters, None if there are none or the file is unreadable'''
+        try:
+            with open(self.path, 'rb') as cache_data:
+                return msgpack.unpackb(cache_data.read())
+        except Exception:
+            return None
+
+    def write(self, con_data):
+        '''Atomically replace the cache with con_data stamped with written_at (epoch seconds)'''
+        con_data = dict(con_data, written_at=time.time())
+        fd, temp_path = tempfile.mkstemp(prefix='.cache-', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(msgpack.packb(con_data))
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return con_data
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        return
+
+    @staticmethod
+    def written_at(con_data):
+        '''datetime of the last write of cached data, None for caches written before stamps were kept'''
+        return datetime.fromtimestamp(con_data['written_at']) if con_data and 'written_at' in con_data else None
+
+    def is_fresh(self, con_data):
+        written_at = self.written_at(con_data)
+        return written_at is not None and (datetime.now() - written_at).total_seconds() < self.fresh_sec
+
+
+class SessionManager(object):
+    '''Owns the OAuth session shared by every caller thread.  Callers read the current session without locking.  A
+    cancellable scheduler thread renews the access token ahead of E*TRADE's two hour idle expiry and re-authorizes
+    after its midnight US Eastern expiry or a failed renewal.  Replacement sessions are built off to the side and
+    swapped in atomically, so in-flight requests finish on the session they started with and nobody waits on a
+    re-authorization'''
+    def __init__(self, renew, reauthorize, renew_every_sec=5400):
+        self.renew_every_sec = renew_every_sec
+        self.__renew = renew  # renew() -> True if the current access token was renewed, recorded with mark_renewed()
+        self.__reauthorize = reauthorize  # reauthorize() obtains new credentials and hands them to swap()
+        self.__session = None
+        self.__session_start_time = None  # time of the last authorization or successful renewal
+        self.__swap_lock = Lock()  # keeps session and its start time consistent
+        self.__upkeep_lock = Lock()  # one renewal or re-authorization at a time
+        self.__stop = Event()
+        self.__thread = None
+
+    @property
+    def session(self):
+        return self.__session
+
+    @property
+    def session_start_time(self):
+        return self.__session_start_time
+
+    def swap(self, session):
+        '''Install a newly authorized session; the replaced one stays usable by requests already holding it'''
+        with self.__swap_lock:
+            self.__session = session
+            self.__session_start_time = datetime.now()
+        return
+
+    def mark_renewed(self, at=None):
+        '''Record a renewal at time at (default: now), e.g. one done by another process'''
+        with self.__swap_lock:
+            self.__session_start_time = at or datetime.now()
+        return
+
+    def start(self):
+        '''Start the background upkeep scheduler if it is not running'''
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name='etrader-session-upkeep', daemon=True)
+        self.__thread.start()
+        return
+
+    def stop(self, timeout=5):
+        '''Cancel the scheduler; returns once it has exited or timeout seconds passed'''
+        self.__stop.set()
+        if self.__thread is not None and self.__thread is not current_thread():
+            self.__thread.join(timeout)
+        self.__thread = None
+        return
+
+    def check(self, force=False):
+        '''Renew the token when it is due (or when forced) and re-authorize if renewal fails.  Returns without doing
+        anything if another thread is already doing upkeep'''
+        if not self.__upkeep_lock.acquire(blocking=False):
+            return
+        try:
+            if not force and self.__session_start_time is not None and \
+                    (datetime.now() - self.__session_start_time).total_seconds() < self.renew_every_sec:
+                return
+            try:
+                renewed = self.__renew()
+            except Exception as e:  # e.g. ConnectionError where remote host forcibly closes connection
+                print(f'Access token renewal failed: {e}')
+                renewed = False
+            if not renewed:
+                self.__reauthorize()
+        finally:
+            self.__upkeep_lock.release()
+        return
+
+    def seconds_until_due(self):
+        '''Seconds until the next renewal, capped at shortly after the next midnight US Eastern token expiry'''
+        started = self.__session_start_time or datetime.now()
+        due = self.renew_every_sec - (datetime.now() - started).total_seconds()
+        midnight = self.__seconds_until_midnight_et()
+        if midnight is not None:
+            due = min(due, midnight + 60)
+        return max(due, 0)
+
+    @staticmethod
+    def __seconds_until_midnight_et():
+        try:
+            from zoneinfo import ZoneInfo
+            now = datetime.now(ZoneInfo('America/New_York'))
+        except Exception:  # no tz database available, rely on renewal failures instead
+            return None
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return (midnight - now).total_seconds()
+
+    def __run(self):
+        while not self.__stop.wait(self.seconds_until_due()):
+            try:
+                self.check(force=True)
+            except Exception as e:
+                print(f'Session upkeep failed: {e}')
+                self.__stop.wait(60)  # retry after a pause rather than spinning
+        return
+
+
+class ReservationLedger(object):
+    '''Cash and shares still free to commit per account while a batch of orders is submitted.  Reservations are
+    taken atomically so concurrent submissions cannot over-commit'''
+    def __init__(self):
+        self.__cash = {}  # accountIdKey -> uncommitted cash
+        self.__shares = {}  # (accountIdKey, symbol) -> uncommitted shares
+        self.__lock = Lock()
+
+    def set_cash(self, account_key, amount):
+        with self.__lock:
+            self.__cash[account_key] = amount
+        return
+
+    def set_shares(self, account_key, symbol, shares):
+        with self.__lock:
+            self.__shares[(account_key, symbol)] = shares
+        return
+
+    def cash(self, account_key):
+        return self.__cash.get(account_key, 0)
+
+    def shares(self, account_key, symbol):
+        return self.__shares.get((account_key, symbol), 0)
+
+    def reserve_cash(self, account_key, price, num_shares=None, dollar_amount=None):
+        '''Reserve cash for as many shares at price as both the request and the remaining cash allow.  Returns the
+        number of shares reserved'''
+        with self.__lock:
+            budget = self.__cash.get(account_key, 0)
+            if dollar_amount is not None:
+                budget = min(budget, dollar_amount)
+            shares = math.floor(budget / price) if price > 0 else 0
+            if num_shares is not None:
+                shares = min(shares, num_shares)
+            shares = max(shares, 0)
+            self.__cash[account_key] = self.__cash.get(account_key, 0) - shares * price
+            return shares
+
+    def reserve_shares(self, account_key, symbol, num_shares):
+        '''Reserve up to num_shares of symbol, returns the number reserved'''
+        with self.__lock:
+            shares = max(min(num_shares, self.__shares.get((account_key, symbol), 0)), 0)
+            self.__shares[(account_key, symbol)] = self.__shares.get((account_key, symbol), 0) - shares
+            return shares
+
+
+class RateLimiter(object):
+    '''Token bucket per endpoint class (market data, account, order).  Waiting requests are admitted in priority
+    order (lower first, FIFO within a priority), so order placement and cancellation go ahead of bulk quote, history
+    and order-status traffic queued on the same bucket.  Throttled responses pause the bucket for Retry-After (or an
+    exponential backoff with jitter) and halve its rate, which then recovers gradually with each success'''
+    DEFAULT_LIMITS = {'market': (10.0, 20), 'account': (5.0, 10), 'order': (4.0, 8)}  # class -> (requests/sec, burst)
+    THROTTLE_STATUS = (429, 503)
+
+    def __init__(self, limits=None, backoff_base_sec=0.5, backoff_max_sec=30.0, min_rate_fraction=0.1, recovery_fraction=0.05):
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.min_rate_fraction = min_rate_fraction
+        self.recovery_fraction = recovery_fraction
+        self.__buckets = {name: self.__Bucket(rate, burst) for name, (rate, burst) in (limits or self.DEFAULT_LIMITS).items()}
+        self.__sequence = sequence()
+        self.__condition = Condition()
+
+    class __Bucket(object):
+        def __init__(self, rate, burst):
+            self.configured_rate = rate
+            self.rate = rate
+            self.burst = burst
+            self.tokens = burst
+            self.updated = time.monotonic()
+            self.blocked_until = 0.0
+            self.waiters = []  # heap of (priority, sequence)
+
+        def refill(self, now):
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            return
+
+    def acquire(self, endpoint_class, priority=1):
+        '''Block until a request of endpoint_class may be sent.  Returns seconds waited'''
+        bucket = self.__buckets.get(endpoint_class)
+        if bucket is None:  # unlimited class
+            return 0.0
+        start = time.monotonic()
+        with self.__condition:
+            ticket = (priority, next(self.__sequence))
+            heapq.heappush(bucket.waiters, ticket)
+            while True:
+                now = time.monotonic()
+                bucket.refill(now)
+                if bucket.waiters[0] == ticket and now >= bucket.blocked_until and bucket.tokens >= 1:
+                    heapq.heappop(bucket.waiters)
+                    bucket.tokens -= 1
+                    self.__condition.notify_all()  # next waiter in line re-checks
+                    return now - start
+                if bucket.waiters[0] != ticket:
+                    self.__condition.wait()
+                else:
+                    self.__condition.wait(max(bucket.blocked_until - now, (1 - bucket.tokens) / bucket.rate, 0.001))
+
+    def succeeded(self, endpoint_class):
+        '''Additively recover a reduced rate after an unthrottled response'''
+        bucket = self.__buckets.get(endpoint_class)
+        if bucket is not None and bucket.rate < bucket.configured_rate:
+            with self.__condition:
+                bucket.rate = min(bucket.configured_rate, bucket.rate + bucket.configured_rate * self.recovery_fraction)
+        return
+
+    def throttled(self, endpoint_class, retry_after=None, attempt=0):
+        '''Record a throttled response: pause the bucket and halve its rate.  Returns the pause in seconds'''
+        delay = self.parse_retry_after(retry_after)
+        if delay is None:
+            delay = min(self.backoff_max_sec, self.backoff_base_sec * 2 ** attempt)
+        delay += random.uniform(0, self.backoff_base_sec)  # jitter so waiting clients do not retry in lockstep
+        bucket = self.__buckets.get(endpoint_class)
+        if bucket is not None:
+            with self.__condition:
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+                bucket.rate = max(bucket.configured_rate * self.min_rate_fraction, bucket.rate / 2)
+                bucket.tokens = min(bucket.tokens, 0)
+                self.__condition.notify_all()
+        return delay
+
+    def is_throttled(self, response):
+        return response.status_code in self.THROTTLE_STATUS
+
+    @staticmethod
+    def parse_retry_after(value):
+        '''Seconds from a Retry-After header given as delta-seconds or an HTTP date, None if absent or invalid'''
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(parsedate_to_datetime(value).tzinfo)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self):
+        with self.__condition:
+            return {name: {'rate': bucket.rate, 'configured_rate': bucket.configured_rate, 'tokens': bucket.tokens,
+                           'waiting': len(bucket.waiters), 'blocked_for_sec': max(bucket.blocked_until - time.monotonic(), 0)}
+                    for name, bucket in self.__buckets.items()}
+
+
+class RequestMetrics(object):
+    '''Per-endpoint request instrumentation: call, error and retry counts, bytes sent and received, a histogram of
+    HTTP round-trip times, and time spent waiting on the rate limiter and on authorization before a request could be
+    sent.  Hooks are called with the sample of every finished call, in the calling thread.  Export with snapshot(),
+    to_json() or to_prometheus()'''
+    LATENCY_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    COUNTERS = ('requests', 'errors', 'retries', 'bytes_sent', 'bytes_received', 'rate_limit_wait_sec', 'token_wait_sec', 'total_sec')
+
+    def __init__(self, latency_buckets_sec=LATENCY_BUCKETS_SEC):
+        self.latency_buckets_sec = tuple(sorted(latency_buckets_sec))
+        self.__endpoints = {}  # endpoint name -> counters and latency histogram
+        self.__hooks = []
+        self.__lock = Lock()
+
+    def add_hook(self, hook):
+        '''Call hook(sample) after every request.  A sample is a dict with endpoint, method, status, error, attempts,
+        latency_sec (sum of the HTTP round trips listed in round_trips), rate_limit_wait_sec, token_wait_sec, bytes_sent, bytes_received and
+        total_sec'''
+        with self.__lock:
+            self.__hooks = self.__hooks + [hook]
+        return
+
+    def remove_hook(self, hook):
+        with self.__lock:
+            self.__hooks = [h for h in self.__hooks if h != hook]  # bound methods are equal, not identical, across lookups
+        return
+
+    def reset(self):
+        with self.__lock:
+            self.__endpoints = {}
+        return
+
+    @staticmethod
+    def begin(endpoint, method):
+        '''New sample for one call; attempt() and finish() fill it in'''
+        return {'endpoint': endpoint, 'method': method, 'status': None, 'error': None, 'attempts': 0,
+                'latency_sec': 0.0, 'rate_limit_wait_sec': 0.0, 'token_wait_sec': 0.0, 'bytes_sent': 0,
+                'bytes_received': 0, 'started': time.perf_counter(), 'total_sec': 0.0, 'round_trips': []}
+
+    @staticmethod
+    def attempt(sample, response, rate_limit_wait_sec, token_wait_sec, latency_sec):
+        '''Add one HTTP attempt of a call to its sample'''
+        body = response.request.body if response.request is not None else None
+        sample['attempts'] += 1
+        sample['status'] = response.status_code
+        sample['rate_limit_wait_sec'] += rate_limit_wait_sec
+        sample['token_wait_sec'] += token_wait_sec
+        sample['latency_sec'] += latency_sec
+        sample['round_trips'].append(latency_sec)
+        sample['bytes_sent'] += len(body) if body else 0
+        sample['bytes_received'] += len(response.content or b'')
+        return
+
+    def finish(self, sample, error=None):
+        '''Record a finished call.  A call is an error when it raised or its last response had an HTTP error status'''
+        sample['total_sec'] = time.perf_counter() - sample['started']
+        sample['error'] = error
+        failed = error is not None or (sample['status'] or 0) >= 400
+        with self.__lock:
+            stats = self.__endpoints.get(sample['endpoint'])
+            if stats is None:
+                stats = self.__endpoints[sample['endpoint']] = dict.fromkeys(self.COUNTERS, 0)
+                stats.update(latency_counts=[0] * (len(self.latency_buckets_sec) + 1), latency_sum_sec=0.0, latency_max_sec=0.0)
+            stats['requests'] += 1
+            stats['errors'] += failed
+            stats['retries'] += max(sample['attempts'] - 1, 0)
+            for key in ('bytes_sent', 'bytes_received', 'rate_limit_wait_sec', 'token_wait_sec', 'total_sec'):
+                stats[key] += sample[key]
+            for latency in sample['round_trips']:
+                stats['latency_counts'][bisect.bisect_left(self.latency_buckets_sec, latency)] += 1
+                stats['latency_sum_sec'] += latency
+                stats['latency_max_sec'] = max(stats['latency_max_sec'], latency)
+            hooks = self.__hooks
+        for hook in hooks:
+            try:
+                hook(sample)
+            except Exception as e:
+                print(f'Request metrics hook {hook} failed: {e}')
+        return
+
+    def snapshot(self):
+        '''Counters per endpoint, with cumulative latency buckets keyed by upper bound and p50/p95/p99 estimates taken
+        from the bucket bounds'''
+        with self.__lock:
+            endpoints = {name: dict(stats, latency_counts=list(stats['latency_counts'])) for name, stats in self.__endpoints.items()}
+        bounds = self.latency_buckets_sec + (math.inf,)
+        result = {}
+        for name, stats in endpoints.items():
+            counts = stats.pop('latency_counts')
+            cumulative = list(accumulate(counts))
+            stats['round_trips'] = cumulative[-1]
+            stats['latency_buckets'] = {('+Inf' if bound == math.inf else bound): total for bound, total in zip(bounds, cumulative)}
+            for quantile in (0.5, 0.95, 0.99):
+                rank = quantile * cumulative[-1]
+                bound = next((b for b, total in zip(bounds, cumulative) if total >= rank and total > 0), None)
+                stats[f'latency_p{round(quantile * 100)}_sec'] = min(bound, stats['latency_max_sec']) if bound is not None else None
+            result[name] = stats
+        return result
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix='etrader'):
+        '''Snapshot in the Prometheus text exposition format'''
+        snapshot = self.snapshot()
+        counters = [('requests', 'requests_total', 'Calls made'),
+                    ('errors', 'request_errors_total', 'Calls that raised or ended in an HTTP error status'),
+                    ('retries', 'request_retries_total', 'Attempts repeated after a throttled response'),
+                    ('bytes_sent', 'request_sent_bytes_total', 'Request body bytes sent'),
+                    ('bytes_received', 'response_received_bytes_total', 'Response body bytes received'),
+                    ('rate_limit_wait_sec', 'rate_limit_wait_seconds_total', 'Time spent queued in the rate limiter'),
+                    ('token_wait_sec', 'token_wait_seconds_total', 'Time spent waiting for authorization before sending'),
+                    ('total_sec', 'request_seconds_total', 'Wall time of calls including waits and retries')]
+        lines = []
+        for key, metric, description in counters:
+            lines += [f'# HELP {prefix}_{metric} {description}', f'# TYPE {prefix}_{metric} counter']
+            lines += [f'{prefix}_{metric}{{endpoint="{name}"}} {stats[key]}' for name, stats in sorted(snapshot.items())]
+        metric = f'{prefix}_request_duration_seconds'
+        lines += [f'# HELP {metric} HTTP round-trip time of each attempt', f'# TYPE {metric} histogram']
+        for name, stats in sorted(snapshot.items()):
+            lines += [f'{metric}_bucket{{endpoint="{name}",le="{bound}"}} {total}' for bound, total in stats['latency_buckets'].items()]
+            lines += [f'{metric}_sum{{endpoint="{name}"}} {stats["latency_sum_sec"]}', f'{metric}_count{{endpoint="{name}"}} {stats["round_trips"]}']
+        return '\n'.join(lines) + '\n'
+
+
+class QuoteSubscription(object):
+    '''A subscriber of a QuoteStreamer.  Changes arrive as (symbol, changed_fields, quote) through the callback, or by
+    iterating the subscription with `for` or `async for`.  Leaving the loop closes the subscription'''
+    __END = object()
+
+    def __init__(self, streamer, symbols, callback=None):
+        self.streamer = streamer
+        self.symbols = set(symbols)
+        self.callback = callback
+        self.__queue = None
+        self.__async_queue = None
+        self.__loop = None
+        self.__pending = []  # updates that arrived before iteration started
+        self.__deliver_lock = Lock()
+        self.closed = False
+
+    def add_symbols(self, symbols):
+        self.streamer.add_symbols(symbols, self)
+        return
+
+    def remove_symbols(self, symbols):
+        self.streamer.remove_symbols(symbols, self)
+        return
+
+    def close(self):
+        '''Stop receiving updates and end any iteration'''
+        if not self.closed:
+            self.streamer.unsubscribe(self)
+        return
+
+    def deliver(self, update):
+        '''Called from the polling thread with (symbol, changed_fields, quote), or the end marker'''
+        if self.callback is not None and update is not self.__END:
+            try:
+                self.callback(*update)
+            except Exception as e:
+                print(f'Quote subscriber callback failed: {e}')
+        orphaned = False
+        with self.__deliver_lock:
+            if self.__queue is None and self.__async_queue is None:
+                if self.callback is None or update is self.__END:
+                    self.__pending.append(update)
+                return
+            if self.__queue is not None:
+                self.__queue.put(update)
+            if self.__async_queue is not None:
+                try:
+                    self.__loop.call_soon_threadsafe(self.__async_queue.put_nowait, update)
+                except RuntimeError:  # its event loop is closed, so nobody is iterating any more
+                    self.__async_queue = self.__loop = None
+                    orphaned = True
+        if orphaned and update is not self.__END:
+            self.close()
+        return
+
+    def end(self):
+        self.closed = True
+        self.deliver(self.__END)
+        return
+
+    def __iter__(self):
+        with self.__deliver_lock:
+            if self.__queue is None:
+                self.__queue = queue.Queue()
+                for update in self.__pending:
+                    self.__queue.put(update)
+                self.__pending = []
+        try:
+            while True:
+                update = self.__queue.get()
+                if update is self.__END:
+                    return
+                yield update
+        finally:  # also on break, so the streamer stops queueing updates nobody reads
+            self.close()
+
+    def __aiter__(self):
+        return self.__async_updates()
+
+    async def __async_updates(self):
+        import asyncio
+        with self.__deliver_lock:
+            if self.__async_queue is None:
+                self.__loop = asyncio.get_running_loop()
+                self.__async_queue = asyncio.Queue()
+                for update in self.__pending:
+                    self.__async_queue.put_nowait(update)
+                self.__pending = []
+        try:
+            while True:
+                update = await self.__async_queue.get()
+                if update is self.__END:
+                    return
+                yield update
+        finally:  # also on break, before the event loop the updates are posted to goes away
+            self.close()
+
+
+class QuoteStreamer(object):
+    '''Polls one shared watchlist through Etrader.get_quote at a fixed cadence on a background thread, diffs every
+    snapshot against the previous one and delivers only the changed fields to the subscribers watching each symbol.
+    Symbols can be added and removed while it runs; stats() reports how far polls lag their schedule'''
+    def __init__(self, client, interval_sec=1.0):
+        self.client = client
+        self.interval_sec = interval_sec
+        self.__subscriptions = []
+        self.__watch_counts = {}  # symbol -> number of subscriptions watching it
+        self.__last = {}  # symbol -> last flattened quote
+        self.__lock = Lock()
+        self.__stop = Event()
+        self.__thread = None
+        self.polls = 0
+        self.skipped_polls = 0
+        self.last_lag_sec = 0.0
+        self.max_lag_sec = 0.0
+        self.last_poll_sec = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return
+
+    def subscribe(self, symbols=(), callback=None):
+        '''Watch symbols; the latest known quote of already watched symbols is delivered right away'''
+        subscription = QuoteSubscription(self, (), callback)
+        with self.__lock:
+            self.__subscriptions.append(subscription)
+        self.add_symbols(symbols, subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.__lock:
+            if subscription in self.__subscriptions:
+                self.__subscriptions.remove(subscription)
+                self.__unwatch(subscription.symbols)
+                subscription.symbols = set()
+        subscription.end()
+        return
+
+    def add_symbols(self, symbols, subscription):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        with self.__lock:
+            added = [s for s in symbols if s not in subscription.symbols]
+            subscription.symbols.update(added)
+            for symbol in added:
+                self.__watch_counts[symbol] = self.__watch_counts.get(symbol, 0) + 1
+            known = [(s, dict(self.__last[s])) for s in added if s in self.__last]
+        for symbol, fields in known:
+            subscription.deliver((symbol, fields, fields))
+        return
+
+    def remove_symbols(self, symbols, subscription):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        with self.__lock:
+            removed = [s for s in symbols if s in subscription.symbols]
+            subscription.symbols.difference_update(removed)
+            self.__unwatch(removed)
+        return
+
+    def __unwatch(self, symbols):
+        for symbol in symbols:
+            self.__watch_counts[symbol] -= 1
+            if self.__watch_counts[symbol] <= 0:
+                del self.__watch_counts[symbol]
+                self.__last.pop(symbol, None)
+        return
+
+    def watchlist(self):
+        with self.__lock:
+            return list(self.__watch_counts)
+
+    def start(self):
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name='etrader-quote-streamer', daemon=True)
+        self.__thread.start()
+        return
+
+    def stop(self, timeout=5):
+        '''Stop polling and end every subscription'''
+        self.__stop.set()
+        if self.__thread is not None and self.__thread is not current_thread():
+            self.__thread.join(timeout)
+        self.__thread = None
+        with self.__lock:
+            subscriptions, self.__subscriptions = self.__subscriptions, []
+            self.__watch_counts.clear()
+        for subscription in subscriptions:
+            subscription.symbols = set()
+            subscription.end()
+        return
+
+    def stats(self):
+        return {'polls': self.polls, 'skipped_polls': self.skipped_polls, 'symbols': len(self.__watch_counts),
+                'subscribers': len(self.__subscriptions), 'interval_sec': self.interval_sec,
+                'last_lag_sec': self.last_lag_sec, 'max_lag_sec': self.max_lag_sec, 'last_poll_sec': self.last_poll_sec}
+
+    @staticmethod
+    def flatten(quote):
+        '''Scalar fields of a QuoteData entry: everything directly under 'All' plus the quote timestamp and status'''
+        fields = {k: v for k, v in quote.get('All', {}).items() if not isinstance(v, (dict, list))}
+        fields['dateTimeUTC'] = quote.get('dateTimeUTC')
+        fields['quoteStatus'] = quote.get('quoteStatus')
+        return fields
+
+    def poll(self):
+        '''Fetch the watchlist once and deliver changes'''
+        symbols = self.watchlist()
+        if not symbols:
+            return
+        quotes = self.client.get_quote(symbols, max_age_sec=0)
+        updates = []
+        with self.__lock:
+            for symbol, quote in quotes.items():
+                if 'error' in quote or symbol not in self.__watch_counts:
+                    continue
+                fields = self.flatten(quote)
+                previous = self.__last.get(symbol, {})
+                changes = {k: v for k, v in fields.items() if previous.get(k, self) != v}
+                self.__last[symbol] = fields
+                if changes:
+                    updates.append((symbol, changes, fields))
+            subscriptions = list(self.__subscriptions)
+        for symbol, changes, fields in updates:
+            for subscription in subscriptions:
+                if symbol in subscription.symbols:
+                    subscription.deliver((symbol, changes, fields))
+        return
+
+    def __run(self):
+        next_poll = time.monotonic()
+        while not self.__stop.is_set():
+            started = time.monotonic()
+            self.last_lag_sec = max(started - next_poll, 0.0)
+            self.max_lag_sec = max(self.max_lag_sec, self.last_lag_sec)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f'Quote poll failed: {e}')
+            self.polls += 1
+            self.last_poll_sec = time.monotonic() - started
+            next_poll += self.interval_sec
+            now = time.monotonic()
+            if now > next_poll:  # fell behind; skip missed ticks instead of bursting
+                missed = math.ceil((now - next_poll) / self.interval_sec)
+                self.skipped_polls += missed
+                next_poll += missed * self.interval_sec
+            self.__stop.wait(max(next_poll - time.monotonic(), 0))
+        return
+
+
+class OrderWatcher(object):
+    '''Watches placed orders across accounts until they fill, are cancelled or are rejected.  A background thread
+    polls every account with watched orders through one orders list request covering all of them.  Each order asks
+    to be polled again after age_fraction of the time since it was watched or last changed, bounded by
+    min_interval_sec and max_interval_sec, so young orders are polled fast and quiet ones back off.  watch() returns
+    a Future resolved with the final order state; callbacks also see every 'partial' fill before the final 'fill',
+    'cancel' or 'reject' event'''
+    FILLED = ('EXECUTED', 'DONE_TRADE_EXECUTED')
+    CANCELLED = ('CANCELLED', 'EXPIRED')
+    REJECTED = ('REJECTED',)
+    FIELDS = {'orderId': None,  # the parts of each listed order state() reads, see ResponseDecoder
+              'OrderDetail': {'status': None, 'placedTime': None, 'executedTime': None,
+                              'Instrument': {'Product': ('symbol',), 'orderAction': None, 'orderedQuantity': None,
+                                             'filledQuantity': None, 'averageExecutionPrice': None}}}
+
+    def __init__(self, client, min_interval_sec=0.5, max_interval_sec=30.0, age_fraction=0.1):
+        self.client = client
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max_interval_sec
+        self.age_fraction = age_fraction
+        self.__watched = {}  # accountId -> {orderId: entry}
+        self.__due = {}  # accountId -> monotonic time of its next poll
+        self.__lock = Lock()
+        self.__wake = Event()
+        self.__stop = Event()
+        self.__thread = None
+        self.polls = 0
+        self.requests = 0
+        self.errors = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return
+
+    def watch(self, order_id, account_id, callback=None, placed_at=None):
+        '''Watch order_id of account_id (accountId).  callback(event, state) is called from the polling thread.
+        placed_at (datetime, default now) bounds the orders list request.  Returns a Future of the final state'''
+        now = time.monotonic()
+        with self.__lock:
+            orders = self.__watched.setdefault(account_id, {})
+            entry = orders.get(order_id)
+            if entry is None:
+                entry = orders[order_id] = {'future': Future(), 'callbacks': [], 'changed': now, 'state': None,
+                                            'placed': placed_at or datetime.now()}
+            if callback is not None:
+                entry['callbacks'].append(callback)
+            self.__due[account_id] = min(self.__due.get(account_id, math.inf), now + self.min_interval_sec)
+        self.__wake.set()
+        return entry['future']
+
+    def unwatch(self, order_id, account_id=None):
+        '''Stop watching an order and cancel its Future'''
+        with self.__lock:
+            for watched_account_id, orders in list(self.__watched.items()):
+                if account_id not in (None, watched_account_id) or order_id not in orders:
+                    continue
+                orders.pop(order_id)['future'].cancel()
+                if not orders:
+                    del self.__watched[watched_account_id]
+                    self.__due.pop(watched_account_id, None)
+        return
+
+    def watched(self):
+        '''{accountId: [orderId, ...]} of the orders being watched'''
+        with self.__lock:
+            return {account_id: list(orders) for account_id, orders in self.__watched.items()}
+
+    def start(self):
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name='etrader-order-watcher', daemon=True)
+        self.__thread.start()
+        return
+
+    def stop(self, timeout=5):
+        '''Stop polling and cancel the Futures of every order still watched'''
+        self.__stop.set()
+        self.__wake.set()
+        if self.__thread is not None and self.__thread is not current_thread():
+            self.__thread.join(timeout)
+        self.__thread = None
+        with self.__lock:
+            watched, self.__watched = self.__watched, {}
+            self.__due.clear()
+        for orders in watched.values():
+            for entry in orders.values():
+                entry['future'].cancel()
+        return
+
+    def stats(self):
+        with self.__lock:
+            return {'polls': self.polls, 'requests': self.requests, 'errors': self.errors, 'accounts': len(self.__watched),
+                    'orders': sum(len(orders) for orders in self.__watched.values())}
+
+    @classmethod
+    def state(cls, order, account_id=None):
+        '''Status, fill quantities and average price of a listed order'''
+        detail = order.get('OrderDetail', [{}])[0]
+        instruments = detail.get('Instrument', [])
+        return {'orderId': order.get('orderId'), 'account_id': account_id, 'status': detail.get('status'),
+                'symbol': instruments[0].get('Product', {}).get('symbol') if instruments else None,
+                'filled_quantity': sum(i.get('filledQuantity') or 0 for i in instruments),
+                'ordered_quantity': sum(i.get('orderedQuantity') or 0 for i in instruments),
+                'average_price': instruments[0].get('averageExecutionPrice') if instruments else None,
+                'executed_time': detail.get('executedTime'), 'order': order}
+
+    @classmethod
+    def event(cls, previous, state):
+        '''Event of the change from the previous state (None before the first poll) to state, None if nothing happened'''
+        if state['status'] in cls.FILLED:
+            return 'fill'
+        if state['status'] in cls.CANCELLED:
+            return 'cancel'
+        if state['status'] in cls.REJECTED:
+            return 'reject'
+        if state['filled_quantity'] > (previous['filled_quantity'] if previous else 0):
+            return 'partial'
+        return None
+
+    def poll(self, account_ids=None):
+        '''Poll accounts (default: every account with watched orders) once, concurrently, and deliver their events'''
+        with self.__lock:
+            account_ids = list(self.__watched) if account_ids is None else list(account_ids)
+        if len(account_ids) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(account_ids), self.client.max_workers)) as pool:
+                list(pool.map(self.__poll_account, account_ids))
+        else:
+            for account_id in account_ids:
+                self.__poll_account(account_id)
+        self.polls += 1
+        return
+
+    def __poll_account(self, account_id):
+        with self.__lock:
+            watched = dict(self.__watched.get(account_id, {}))
+        if not watched:
+            return
+        states, remaining = {}, set(watched)
+        try:
+            since = min(entry['placed'] for entry in watched.values()) - timedelta(days=1)  # API dates are US Eastern
+            listed = self.client.iter_orders(account_id=account_id, from_date=since, prefetch=False,
+                                             fields=self.client.decoder.reader_fields(self.FIELDS))
+            for order in listed:  # newest first, so the walk usually ends on the first page
+                if order.get('orderId') in remaining:
+                    states[order['orderId']] = self.state(order, account_id)
+                    remaining.discard(order['orderId'])
+                    if not remaining:
+                        break
+            listed.close()
+        except Exception as e:
+            print(f'Order poll of account {account_id} failed: {e}')
+            with self.__lock:
+                self.errors += 1
+        events = []
+        now = time.monotonic()
+        with self.__lock:
+            self.requests += 1
+            orders = self.__watched.get(account_id, {})
+            for order_id, state in states.items():
+                entry = orders.get(order_id)
+                if entry is None:
+                    continue
+                event = self.event(entry['state'], state)
+                entry['state'] = state
+                if event is None:
+                    continue
+                entry['changed'] = now
+                if event != 'partial':
+                    del orders[order_id]
+                events.append((entry, event, state))
+            if orders:
+                self.__due[account_id] = now + min(self.__interval(entry, now) for entry in orders.values())
+            else:
+                self.__watched.pop(account_id, None)
+                self.__due.pop(account_id, None)
+        for entry, event, state in events:
+            for callback in entry['callbacks']:
+                try:
+                    callback(event, state)
+                except Exception as e:
+                    print(f'Order watcher callback failed: {e}')
+            if event != 'partial' and not entry['future'].done():
+                entry['future'].set_result(state)
+        return
+
+    def __interval(self, entry, now):
+        return min(max(self.age_fraction * (now - entry['changed']), self.min_interval_sec), self.max_interval_sec)
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.__wake.clear()
+            now = time.monotonic()
+            with self.__lock:
+                due = [account_id for account_id, at in self.__due.items() if at <= now]
+                next_due = min(self.__due.values(), default=None)
+            if due:
+                try:
+                    self.poll(due)
+                except Exception as e:
+                    print(f'Order poll failed: {e}')
+                continue
+            self.__wake.wait(None if next_due is None else next_due - now)
+        return
+
+
+class QuoteSnapshot(object):
+    '''Columnar quotes for a watchlist: one NumPy array per field with a symbol -> row index, so screens can be
+    vectorized.  Built by QuoteSnapshot.parser straight from the raw quote JSON without materializing QuoteData dicts'''
+    FLOAT_FIELDS = (('bid', 'bid'), ('ask', 'ask'), ('last', 'lastTrade'), ('open', 'open'), ('high', 'high'),
+                    ('low', 'low'), ('previous_close', 'previousClose'), ('change', 'changeClose'),
+                    ('change_pct', 'changeClosePercentage'), ('high_52', 'high52'), ('low_52', 'low52'))
+    INT_FIELDS = (('volume', 'totalVolume'), ('bid_size', 'bidSize'), ('ask_size', 'askSize'))  # plus 'timestamp' from dateTimeUTC
+    __ALL_INDEX = {source: i for i, (_, source) in enumerate(FLOAT_FIELDS + INT_FIELDS)}
+
+    def __init__(self, symbols, columns, missing=()):
+        import numpy as np
+        self.symbols = list(symbols)
+        self.index = {symbol: row for row, symbol in enumerate(self.symbols)}
+        self.missing = list(missing)  # requested symbols the endpoint returned no quote for
+        for i, (name, _) in enumerate(self.FLOAT_FIELDS):
+            setattr(self, name, np.array([np.nan if v is None else v for v in columns[i]], dtype=np.float64))
+        for i, (name, _) in enumerate(self.INT_FIELDS, len(self.FLOAT_FIELDS)):
+            setattr(self, name, np.array([0 if v is None else v for v in columns[i]], dtype=np.int64))
+        self.timestamp = np.array([0 if v is None else v for v in columns[-1]], dtype=np.int64)
+
+    @classmethod
+    def field_names(cls):
+        return [name for name, _ in cls.FLOAT_FIELDS + cls.INT_FIELDS] + ['timestamp']
+
+    @classmethod
+    def parser(cls):
+        '''Return (object_pairs_hook, symbols, columns) for json.loads.  The hook appends each quote straight into the
+        column lists and returns lightweight placeholders instead of building dicts'''
+        width = len(cls.FLOAT_FIELDS) + len(cls.INT_FIELDS)
+        symbols = []
+        columns = [[] for _ in range(width + 1)]
+        all_index = cls.__ALL_INDEX
+
+        def __hook(pairs):
+            row = quote_row = symbol = timestamp = None
+            is_product = False
+            for key, value in pairs:
+                column = all_index.get(key)
+                if column is not None:
+                    if row is None:
+                        row = [None] * width
+                    row[column] = value
+                elif key == 'All':
+                    quote_row = value
+                elif key == 'Product':
+                    symbol = value
+                elif key == 'symbol':
+                    symbol, is_product = value, True
+                elif key == 'dateTimeUTC':
+                    timestamp = value
+            if quote_row is not None:  # a QuoteData entry; nested All and Product were already reduced
+                symbols.append(symbol)
+                for column, value in enumerate(quote_row if isinstance(quote_row, list) else [None] * width):
+                    columns[column].append(value)
+                columns[width].append(timestamp)
+                return None
+            if is_product:
+                return symbol
+            return row
+
+        return __hook, symbols, columns
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def row(self, symbol):
+        '''All fields of one symbol as a dict'''
+        i = self.index[symbol]
+        return {name: getattr(self, name)[i].item() for name in self.field_names()}
+
+    def to_structured(self):
+        '''The snapshot as a NumPy structured array with a 'symbol' column'''
+        import numpy as np
+        names = self.field_names()
+        width = max([len(s) for s in self.symbols] + [1])
+        dtype = [('symbol', f'U{width}')] + [(name, getattr(self, name).dtype) for name in names]
+        table = np.empty(len(self.symbols), dtype=dtype)
+        table['symbol'] = self.symbols
+        for name in names:
+            table[name] = getattr(self, name)
+        return table
+
+
+class PortfolioTable(object):
+    '''Positions of many accounts as NumPy columns, one row per position, with the account and symbol of each row
+    encoded as indexes into accounts and symbols.  Quantities and cost are summed per symbol and per (account, symbol)
+    pair once when the table is built, so revalue() only replaces one price per symbol and every exposure, P&L and
+    weight is derived from symbol-sized arrays, however many lots the book holds.  Short positions carry negative
+    quantities and cost'''
+    def __init__(self, accounts):
+        '''accounts: account dicts with 'accountId' and loaded 'positions' (see Etrader.get_list_of_accounts)'''
+        import numpy as np
+        self.accounts = [account['accountId'] for account in accounts]
+        self.symbols = []
+        self.symbol_index = {}
+        account_rows, symbol_rows, quantities, costs, prices = [], [], [], [], {}
+        for account_row, account in enumerate(accounts):
+            for position in account.get('positions') or []:
+                symbol = position['symbolDescription']  # as in Etrader's sharesBySymbol index
+                symbol_row = self.symbol_index.get(symbol)
+                if symbol_row is None:
+                    symbol_row = self.symbol_index[symbol] = len(self.symbols)
+                    self.symbols.append(symbol)
+                quantity = float(position.get('quantity') or 0)
+                if position.get('positionType') == 'SHORT':
+                    quantity = -abs(quantity)
+                cost = position.get('totalCost')
+                cost = abs(float(cost if cost is not None else (position.get('pricePaid') or 0) * quantity))
+                account_rows.append(account_row)
+                symbol_rows.append(symbol_row)
+                quantities.append(quantity)
+                costs.append(math.copysign(cost, quantity))
+                prices.setdefault(symbol_row, self.__position_price(position, quantity))
+        self.account_row = np.array(account_rows, dtype=np.int64)
+        self.symbol_row = np.array(symbol_rows, dtype=np.int64)
+        self.quantity = np.array(quantities, dtype=np.float64)
+        self.cost = np.array(costs, dtype=np.float64)
+        n_symbols = len(self.symbols)
+        self.symbol_price = np.array([prices[i] for i in range(n_symbols)], dtype=np.float64)
+        self.symbol_quantity = np.bincount(self.symbol_row, weights=self.quantity, minlength=n_symbols)
+        self.symbol_gross_quantity = np.bincount(self.symbol_row, weights=np.abs(self.quantity), minlength=n_symbols)
+        self.symbol_cost = np.bincount(self.symbol_row, weights=self.cost, minlength=n_symbols)
+        pairs, pair_rows = np.unique(self.account_row * max(n_symbols, 1) + self.symbol_row, return_inverse=True)
+        self.__pair_account = pairs // max(n_symbols, 1)
+        self.__pair_symbol = pairs % max(n_symbols, 1)
+        self.__pair_quantity = np.bincount(pair_rows, weights=self.quantity, minlength=len(pairs))
+        self.__pair_cost = np.bincount(pair_rows, weights=self.cost, minlength=len(pairs))
+        self.__snapshot_symbols = None  # symbols of the last QuoteSnapshot revalued from and their rows in it
+        self.__snapshot_rows = None
+
+    @staticmethod
+    def __position_price(position, quantity):
+        last = (position.get('Quick') or {}).get('lastTrade')
+        if last:
+            return float(last)
+        if position.get('marketValue') is not None and quantity:
+            return abs(float(position['marketValue']) / quantity)
+        return float(position.get('pricePaid') or math.nan)
+
+    def __len__(self):
+        return len(self.quantity)
+
+    def revalue(self, prices, field='last'):
+        '''Reprice the book in place and return it.  prices: a QuoteSnapshot, a get_quote result, a {symbol: price}
+        dict or an array aligned with symbols.  field names the QuoteSnapshot field (bid, ask, last, ...) to price
+        at.  Symbols with no price keep their previous one'''
+        import numpy as np
+        if isinstance(prices, QuoteSnapshot):
+            symbol_prices = self.__snapshot_prices(prices, field)
+        elif isinstance(prices, dict):
+            symbol_prices = self.__dict_prices(prices, field)
+        else:
+            symbol_prices = np.asarray(prices, dtype=np.float64)
+        np.copyto(self.symbol_price, symbol_prices, where=~np.isnan(symbol_prices))
+        return self
+
+    def __snapshot_prices(self, snapshot, field):
+        import numpy as np
+        if snapshot.symbols != self.__snapshot_symbols:  # the row mapping is reused while the watchlist is unchanged
+            self.__snapshot_symbols = list(snapshot.symbols)
+            self.__snapshot_rows = np.array([snapshot.index.get(symbol, len(snapshot)) for symbol in self.symbols], dtype=np.int64)
+        column = getattr(snapshot, field)
+        return np.append(column, np.nan)[self.__snapshot_rows]  # the appended NaN prices symbols missing from it
+
+    def __dict_prices(self, prices, field):
+        import numpy as np
+        source = dict(QuoteSnapshot.FLOAT_FIELDS).get(field, field)
+        values = []
+        for symbol in self.symbols:
+            value = prices.get(symbol)
+            if isinstance(value, dict):  # QuoteData of get_quote, or {'error': ...}
+                value = value.get('All', {}).get(source)
+            values.append(math.nan if value is None else value)
+        return np.array(values, dtype=np.float64)
+
+    @property
+    def price(self):
+        '''Current price of every row'''
+        return self.symbol_price[self.symbol_row]
+
+    @property
+    def market_value(self):
+        '''Signed market value of every row'''
+        return self.quantity * self.price
+
+    @property
+    def unrealized_pnl(self):
+        '''Unrealized P&L of every row'''
+        return self.market_value - self.cost
+
+    @property
+    def exposure(self):
+        '''Net market value per symbol'''
+        return self.symbol_quantity * self.symbol_price
+
+    @property
+    def gross_exposure(self):
+        '''Long plus short market value per symbol'''
+        return self.symbol_gross_quantity * self.symbol_price
+
+    @property
+    def cost_basis(self):
+        '''Net cost per symbol'''
+        return self.symbol_cost
+
+    @property
+    def pnl(self):
+        '''Unrealized P&L per symbol'''
+        return self.exposure - self.symbol_cost
+
+    @property
+    def weights(self):
+        '''Net exposure per symbol as a share of the gross exposure of the whole book'''
+        gross = self.gross_exposure
+        total = gross.sum()
+        return self.exposure / total if total else gross * 0.0
+
+    def totals(self):
+        '''Exposure, gross exposure, cost basis and unrealized P&L of the whole book'''
+        exposure = float(self.exposure.sum())
+        cost_basis = float(self.symbol_cost.sum())
+        return {'exposure': exposure, 'gross_exposure': float(self.gross_exposure.sum()), 'cost_basis': cost_basis,
+                'unrealized_pnl': exposure - cost_basis}
+
+    def by_account(self):
+        '''{accountId: totals of that account}'''
+        import numpy as np
+        n_accounts = len(self.accounts)
+        pair_price = self.symbol_price[self.__pair_symbol]
+        exposure = np.bincount(self.__pair_account, weights=self.__pair_quantity * pair_price, minlength=n_accounts)
+        gross = np.bincount(self.__pair_account, weights=np.abs(self.__pair_quantity) * pair_price, minlength=n_accounts)
+        cost = np.bincount(self.__pair_account, weights=self.__pair_cost, minlength=n_accounts)
+        return {account_id: {'exposure': float(exposure[i]), 'gross_exposure': float(gross[i]), 'cost_basis': float(cost[i]),
+                             'unrealized_pnl': float(exposure[i] - cost[i])} for i, account_id in enumerate(self.accounts)}
+
+    def symbol(self, symbol):
+        '''Quantity, price, exposure, cost basis, P&L and weight of one symbol across accounts'''
+        i = self.symbol_index[symbol]
+        return {'quantity': float(self.symbol_quantity[i]), 'price': float(self.symbol_price[i]), 'exposure': float(self.exposure[i]),
+                'cost_basis': float(self.symbol_cost[i]), 'unrealized_pnl': float(self.pnl[i]), 'weight': float(self.weights[i])}
+
+    def to_structured(self):
+        '''Per-symbol analytics as a NumPy structured array with a 'symbol' column'''
+        import numpy as np
+        width = max([len(s) for s in self.symbols] + [1])
+        columns = (('quantity', self.symbol_quantity), ('price', self.symbol_price), ('exposure', self.exposure),
+                   ('gross_exposure', self.gross_exposure), ('cost_basis', self.symbol_cost), ('unrealized_pnl', self.pnl),
+                   ('weight', self.weights))
+        table = np.empty(len(self.symbols), dtype=[('symbol', f'U{width}')] + [(name, np.float64) for name, _ in columns])
+        table['symbol'] = self.symbols
+        for name, column in columns:
+            table[name] = column
+        return table
+
+
+class OptionChain(object):
+    '''Option chain of one underlying across expiries: one row per contract in NumPy columns, rows of each expiry
+    contiguous and ordered calls first, then puts, each by strike.  Chains of single expiries are built from the
+    optionchains response by from_response and joined with concat, so cached expiries are reused as they are'''
+    FLOAT_FIELDS = (('strike', 'strikePrice'), ('bid', 'bid'), ('ask', 'ask'), ('last', 'lastPrice'), ('change', 'netChange'))
+    GREEK_FIELDS = (('iv', 'iv'), ('delta', 'delta'), ('gamma', 'gamma'), ('theta', 'theta'), ('vega', 'vega'), ('rho', 'rho'))
+    INT_FIELDS = (('bid_size', 'bidSize'), ('ask_size', 'askSize'), ('volume', 'volume'), ('open_interest', 'openInterest'))
+    CONTRACT_FIELDS = dict.fromkeys([source for _, source in FLOAT_FIELDS + INT_FIELDS] + ['osiKey', 'displaySymbol', 'inTheMoney'])
+    CONTRACT_FIELDS['OptionGreeks'] = dict.fromkeys(source for _, source in GREEK_FIELDS)
+    FIELDS = {'nearPrice': None, 'OptionPair': {'Call': CONTRACT_FIELDS, 'Put': CONTRACT_FIELDS}}  # see ResponseDecoder
+
+    def __init__(self, underlying, expiries, columns, near_prices=None, missing=()):
+        '''columns maps every name of field_names() plus 'symbol' to an array or list, rows grouped by expiry in the
+        order of expiries'''
+        import numpy as np
+        self.underlying = underlying
+        self.expiries = list(expiries)
+        self.near_prices = dict(near_prices or {})  # expiry -> underlying price the chain was centered on
+        self.missing = list(missing)  # requested expiries that could not be fetched
+        self.symbols = list(columns['symbol'])
+        self.index = {symbol: row for row, symbol in enumerate(self.symbols)}
+        for name, _ in self.FLOAT_FIELDS + self.GREEK_FIELDS:
+            setattr(self, name, np.asarray(columns[name], dtype=np.float64))
+        for name, _ in self.INT_FIELDS:
+            setattr(self, name, np.asarray(columns[name], dtype=np.int64))
+        self.is_call = np.asarray(columns['is_call'], dtype=bool)
+        self.in_the_money = np.asarray(columns['in_the_money'], dtype=bool)
+        self.expiry = np.asarray(columns['expiry'], dtype='datetime64[D]')
+        expiries = np.array(self.expiries, dtype='datetime64[D]')
+        starts = np.searchsorted(self.expiry, expiries, side='left')
+        stops = np.searchsorted(self.expiry, expiries, side='right')
+        self.__bounds = {expiry: (int(start), int(stop)) for expiry, start, stop in zip(self.expiries, starts, stops)}  # expiry -> row range
+
+    @classmethod
+    def field_names(cls):
+        return [name for name, _ in cls.FLOAT_FIELDS + cls.GREEK_FIELDS + cls.INT_FIELDS] + ['is_call', 'in_the_money', 'expiry']
+
+    @classmethod
+    def from_response(cls, underlying, expiry, response):
+        '''Chain of one expiry from a decoded OptionChainResponse'''
+        def __number(value, default):
+            return default if value is None or value == '' else value
+
+        contracts = {'Call': [], 'Put': []}
+        for pair in response.get('OptionPair', []) if response else []:
+            for side, side_contracts in contracts.items():
+                if pair.get(side):
+                    side_contracts.append(pair[side])
+        rows = sorted(contracts['Call'], key=lambda c: c.get('strikePrice') or 0) + \
+            sorted(contracts['Put'], key=lambda c: c.get('strikePrice') or 0)
+        columns = {'symbol': [c.get('osiKey') or c.get('displaySymbol') for c in rows],
+                   'is_call': [True] * len(contracts['Call']) + [False] * len(contracts['Put']),
+                   'in_the_money': [str(c.get('inTheMoney', '')).lower() in ('y', 'true') for c in rows],
+                   'expiry': [expiry] * len(rows)}
+        for name, source in cls.FLOAT_FIELDS:
+            columns[name] = [__number(c.get(source), math.nan) for c in rows]
+        for name, source in cls.GREEK_FIELDS:
+            columns[name] = [__number((c.get('OptionGreeks') or {}).get(source), math.nan) for c in rows]
+        for name, source in cls.INT_FIELDS:
+            columns[name] = [__number(c.get(source), 0) for c in rows]
+        near_price = response.get('nearPrice') if response else None
+        return cls(underlying, [expiry], columns, {expiry: near_price} if near_price is not None else {})
+
+    @classmethod
+    def concat(cls, underlying, chains, missing=()):
+        '''One chain from single or multi expiry chains of the same underlying, ordered by expiry'''
+        import numpy as np
+        chains = sorted(chains, key=lambda chain: chain.expiries[0] if chain.expiries else date.max)
+        columns = {'symbol': [symbol for chain in chains for symbol in chain.symbols]}
+        for name in cls.field_names():
+            columns[name] = np.concatenate([getattr(chain, name) for chain in chains]) if chains else []
+        near_prices = {}
+        for chain in chains:
+            near_prices.update(chain.near_prices)
+        return cls(underlying, [expiry for chain in chains for expiry in chain.expiries], columns, near_prices, missing)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def expiry_rows(self, expiry):
+        '''slice of the rows of one expiry'''
+        return slice(*self.__bounds[expiry])
+
+    def for_expiry(self, expiry):
+        '''Chain of one expiry; its columns are views of this chain's'''
+        rows = self.expiry_rows(expiry)
+        columns = {name: getattr(self, name)[rows] for name in self.field_names()}
+        columns['symbol'] = self.symbols[rows]
+        near_prices = {expiry: self.near_prices[expiry]} if expiry in self.near_prices else {}
+        return OptionChain(self.underlying, [expiry], columns, near_prices)
+
+    def row(self, symbol):
+        '''All fields of one contract as a dict'''
+        i = self.index[symbol]
+        return {name: getattr(self, name)[i].item() for name in self.field_names()}
+
+    def to_structured(self):
+        '''The chain as a NumPy structured array with a 'symbol' column'''
+        import numpy as np
+        names = self.field_names()
+        width = max([len(s) for s in self.symbols if s] + [1])
+        dtype = [('symbol', f'U{width}')] + [(name, getattr(self, name).dtype) for name in names]
+        table = np.empty(len(self.symbols), dtype=dtype)
+        table['symbol'] = [s or '' for s in self.symbols]
+        for name in names:
+            table[name] = getattr(self, name)
+        return table
+
+
+class Cassette(object):
+    '''Recorded HTTP interactions of an Etrader session, stored as zlib-compressed msgpack.  Replayed requests are
+    matched on method, URL path, query parameters and body (with the per-order clientOrderId ignored), falling back
+    to method, path and parameters, and are served in recorded order per match, so concurrent requests replay
+    correctly whatever order they arrive in.  Once a match is used up its last response is repeated, or, when strict,
+    a ValueError is raised'''
+    VERSION = 1
+    VOLATILE_BODY = re.compile(rb'<clientOrderId>[^<]*</clientOrderId>')
+
+    def __init__(self, path=None, strict=False):
+        self.path = path
+        self.strict = strict
+        self.interactions = []  # dicts of method, url, params, body, status, headers, content, elapsed_sec, offset_sec
+        self.__started = time.monotonic()
+        self.__lock = Lock()
+        self.__queues = None  # match key -> indexes of not yet replayed interactions, built on first replay
+        self.__used = set()
+        self.__last = {}  # loose match key -> last interaction served
+
+    @classmethod
+    def load(cls, path, strict=False):
+        cassette = cls(path, strict)
+        with open(path, 'rb') as cassette_file:
+            data = msgpack.unpackb(zlib.decompress(cassette_file.read()), raw=False)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f'Unsupported cassette version {data.get("version")} in {path}')
+        cassette.interactions = data['interactions']
+        return cassette
+
+    def save(self, path=None):
+        '''Write the cassette atomically to path (default: the path it was created with)'''
+        path = path or self.path
+        if path is None:
+            raise ValueError('Cassette has no path; pass one to save() or Cassette()')
+        with self.__lock:
+            payload = msgpack.packb({'version': self.VERSION, 'interactions': list(self.interactions)}, use_bin_type=True)
+        with open(path + '.tmp', 'wb') as cassette_file:
+            cassette_file.write(zlib.compress(payload))
+        os.replace(path + '.tmp', path)
+        return
+
+    @staticmethod
+    def __body(data):
+        if data is None:
+            return b''
+        return data.encode() if isinstance(data, str) else bytes(data)
+
+    @classmethod
+    def __keys(cls, method, url, params, body):
+        parts = urlsplit(url)
+        loose = (method.upper(), parts.path, parts.query, tuple(sorted((str(k), str(v)) for k, v in (params or {}).items())))
+        return loose + (cls.VOLATILE_BODY.sub(b'', body),), loose
+
+    def record(self, method, url, params, data, response, elapsed_sec):
+        interaction = {'method': method.upper(), 'url': url, 'params': {str(k): str(v) for k, v in (params or {}).items()},
+                       'body': self.__body(data), 'status': response.status_code, 'headers': dict(response.headers),
+                       'content': response.content or b'', 'elapsed_sec': elapsed_sec,
+                       'offset_sec': time.monotonic() - self.__started - elapsed_sec}
+        with self.__lock:
+            self.interactions.append(interaction)
+        return
+
+    def match(self, method, url, params, data):
+        '''Next recorded interaction for a request'''
+        exact, loose = self.__keys(method, url, params, self.__body(data))
+        with self.__lock:
+            if self.__queues is None:
+                self.__queues = {}
+                for index, interaction in enumerate(self.interactions):
+                    for key in self.__keys(interaction['method'], interaction['url'], interaction['params'], interaction['body']):
+                        self.__queues.setdefault(key, deque()).append(index)
+            for key in (exact, loose):
+                pending = self.__queues.get(key, ())
+                while pending and pending[0] in self.__used:
+                    pending.popleft()
+                if pending:
+                    index = pending.popleft()
+                    self.__used.add(index)
+                    self.__last[loose] = self.interactions[index]
+                    return self.interactions[index]
+            if loose in self.__last and not self.strict:
+                return self.__last[loose]
+        raise ValueError(f'No recorded response for {method.upper()} {url} {params or ""}')
+
+
+class RecordingSession(object):
+    '''Wraps a live session and records every response it receives into a Cassette'''
+    def __init__(self, session, cassette):
+        self.session = session
+        self.cassette = cassette
+
+    def __getattr__(self, name):  # consumer_key, access_token, headers, mount, ... of the live session
+        return getattr(self.session, name)
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        res = self.session.request(method, url, **kwargs)
+        self.cassette.record(method, url, kwargs.get('params'), kwargs.get('data'), res, time.perf_counter() - start)
+        return res
+
+
+class ReplaySession(object):
+    '''Serves requests from a Cassette without network or OAuth.  speed=1.0 reproduces the recorded timing: no
+    response is served before its recorded offset from the start of the session, then it takes its recorded latency.
+    2.0 halves both, 0 or None answers as fast as possible'''
+    def __init__(self, cassette, speed=None):
+        self.cassette = cassette
+        self.speed = speed
+        self.headers = {}
+        self.__started = None  # monotonic time of the first replayed request
+        self.__origin = 0.0  # offset_sec of the first recorded interaction
+        self.__lock = Lock()
+
+    def mount(self, prefix, adapter):
+        return
+
+    def request(self, method, url, **kwargs):
+        params, data = kwargs.get('params'), kwargs.get('data')
+        interaction = self.cassette.match(method, url, params, data)
+        if self.speed:
+            self.__wait_for_offset(interaction)
+            time.sleep(interaction['elapsed_sec'] / self.speed)
+        res = requests.Response()
+        res.status_code = interaction['status']
+        res.headers.update(interaction['headers'])
+        res._content = interaction['content']
+        res.url = url
+        res.request = requests.Request(method, url, params=params, data=data).prepare()
+        res.elapsed = timedelta(seconds=interaction['elapsed_sec'])
+        return res
+
+    def __wait_for_offset(self, interaction):
+        '''Hold a request back until its interaction's recorded offset, scaled by speed, has passed'''
+        with self.__lock:
+            if self.__started is None:
+                self.__started = time.monotonic()
+                self.__origin = min((i.get('offset_sec', 0.0) for i in self.cassette.interactions), default=0.0)
+        if 'offset_sec' not in interaction:
+            return
+        delay = self.__started + (interaction['offset_sec'] - self.__origin) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return
+
+
+class AccountHandle(object):
+    '''Immutable handle on one account of an Etrader client.  Its methods act on that account only and never touch
+    the client's current account, so any number of accounts can be traded in parallel from one client.  Holdings
+    (cash_available, positions, total_account_value) are read from the account dict the client keeps up to date'''
+    __slots__ = ('client', 'account', 'id', 'id_key', 'description', 'mode', 'name', 'status', 'type',
+                 'institution_type', 'closed_date', '_hydrate')
+    FIELDS = (('id', 'accountId'), ('id_key', 'accountIdKey'), ('description', 'accountDesc'), ('mode', 'accountMode'),
+              ('name', 'accountName'), ('status', 'accountStatus'), ('type', 'accountType'),
+              ('institution_type', 'institutionType'), ('closed_date', 'closedDate'))
+
+    def __init__(self, client, account, hydrate=None):
+        object.__setattr__(self, 'client', client)
+        object.__setattr__(self, 'account', account)
+        object.__setattr__(self, '_hydrate', hydrate)  # loads holdings of a lazily listed account
+        for attribute, key in self.FIELDS:
+            object.__setattr__(self, attribute, account.get(key))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('AccountHandle is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('AccountHandle is immutable')
+
+    def __repr__(self):
+        return f'AccountHandle(id={self.id!r}, name={self.name!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, AccountHandle) and other.client is self.client and other.id_key == self.id_key
+
+    def __hash__(self):
+        return hash(self.id_key)
+
+    def get(self):
+        return {'id': self.id, 'id_key': self.id_key, 'description': self.description, 'mode': self.mode,
+                'name': self.name, 'status': self.status, 'type': self.type,
+                'institution_type': self.institution_type, 'closed_date': self.closed_date,
+                'cash_available': self.cash_available, 'total_account_value': self.total_account_value,
+                'positions': self.positions}
+
+    @property
+    def cash_available(self):
+        return self.__holding('cashAvailable')
+
+    @property
+    def positions(self):
+        return self.__holding('positions')
+
+    @property
+    def total_account_value(self):
+        return self.__holding('totalAccountValue')
+
+    def __holding(self, key):
+        if 'positions' not in self.account and self._hydrate is not None:
+            self._hydrate(self.account)
+        return self.account.get(key)
+
+    def refresh(self):
+        return self.client.refresh_account(self.id)
+
+    def get_balance(self):
+        return self.client.get_account_balance(self.id)
+
+    def get_positions(self):
+        return self.client.get_account_positions(self.id)
+
+    def get_transaction_history(self, ticker_symbol=None, start_date=None, end_date=None, count=50):
+        return self.client.get_account_transaction_history(self.id, ticker_symbol, start_date, end_date, count)
+
+    def iter_transactions(self, **kwargs):
+        return self.client.iter_transactions(account_id=self.id, **kwargs)
+
+    def get_transaction_details(self, transaction_id):
+        return self.client.get_transaction_details(transaction_id, account_id=self.id)
+
+    def iter_orders(self, **kwargs):
+        return self.client.iter_orders(account_id=self.id, **kwargs)
+
+    def get_existing_orders(self):
+        return self.client.get_existing_orders(self.id)
+
+    def list_orders(self, count=100):
+        return self.client.list_orders(count, account_id=self.id)
+
+    def list_open_orders(self, count=100):
+        return self.client.list_open_orders(count, account_id=self.id)
+
+    def list_executed_orders(self, count=100):
+        return self.client.list_executed_orders(count, account_id=self.id)
+
+    def list_ticker_orders(self, ticker, count=100):
+        return self.client.list_ticker_orders(ticker, count, account_id=self.id)
+
+    def preview_order(self, symbol, order_action, num_shares, **kwargs):
+        return self.client.preview_order(symbol, order_action, num_shares, account_id=self.id, **kwargs)
+
+    def place_orders(self, intents, max_workers=None):
+        '''Etrader.place_orders with this account as the default account of every intent'''
+        return self.client.place_orders([dict({'account_id': self.id}, **intent) for intent in intents], max_workers)
+
+    def place_market_buy_order(self, symbol, dollar_amount):
+        return self.client.place_market_buy_order(symbol, dollar_amount, account_id=self.id)
+
+    def place_market_sell_order(self, symbol, num_shares):
+        return self.client.place_market_sell_order(symbol, num_shares, account_id=self.id)
+
+    def place_limit_buy_order(self, symbol, num_shares, price_limit):
+        return self.client.place_limit_buy_order(symbol, num_shares, price_limit, account_id=self.id)
+
+    def place_limit_sell_order(self, symbol, num_shares, price_limit):
+        return self.client.place_limit_sell_order(symbol, num_shares, price_limit, account_id=self.id)
+
+    def cancel_order(self, order_number):
+        return self.client.cancel_order(order_number, account_id=self.id)
+
+    def watch_order(self, order, callback=None):
+        return self.client.watch_order(order, callback, account_id=self.id)
+
+    def sync_transaction_history(self, store, details=True):
+        return self.client.sync_transaction_history(store, self.id, details)
+
+    def sync_order_history(self, store):
+        return self.client.sync_order_history(store, self.id)
 
 
 class Etrader():
     '''Defines etrade data object, connects to user etrade account, keeps connection alive'''
-    def __init__(self,  production=False, use_cached_session=True, delay_time_sec=2):
+    QUOTE_CHUNK_SIZE = 50  # maximum symbols per quote request when overrideSymbolCount is set
+    PRIORITY_ORDER, PRIORITY_DEFAULT, PRIORITY_BULK = 0, 1, 2
+    ENDPOINTS = {  # endpoint name -> (rate limiter class, default priority)
+        'renew_token': (None, PRIORITY_ORDER),
+        'revoke_token': (None, PRIORITY_ORDER),
+        'accounts_list': ('account', PRIORITY_DEFAULT),
+        'balance': ('account', PRIORITY_DEFAULT),
+        'portfolio': ('account', PRIORITY_DEFAULT),
+        'transactions': ('account', PRIORITY_BULK),
+        'transaction_details': ('account', PRIORITY_BULK),
+        'quote': ('market', PRIORITY_DEFAULT),
+        'lookup': ('market', PRIORITY_DEFAULT),
+        'option_expiry': ('market', PRIORITY_DEFAULT),
+        'option_chain': ('market', PRIORITY_DEFAULT),
+        'orders_list': ('order', PRIORITY_BULK),
+        'order_preview': ('order', PRIORITY_ORDER),
+        'order_place': ('order', PRIORITY_ORDER),
+        'order_cancel': ('order', PRIORITY_ORDER),
+    }
+    RESPONSE_PATHS = {  # endpoint name -> path to the value its methods return; for paged endpoints the last key names the records
+        'accounts_list': ('AccountListResponse', 'Accounts', 'Account'),
+        'balance': ('BalanceResponse',),
+        'portfolio': ('PortfolioResponse', 'AccountPortfolio', 0, 'Position'),
+        'transactions': ('TransactionListResponse', 'Transaction'),
+        'transaction_details': ('TransactionDetailsResponse',),
+        'quote': ('QuoteResponse',),
+        'lookup': (),
+        'option_expiry': ('OptionExpireDateResponse', 'ExpirationDate'),
+        'option_chain': ('OptionChainResponse',),
+        'orders_list': ('OrdersResponse', 'Order'),
+        'order_preview': ('PreviewOrderResponse',),
+        'order_place': (),
+        'order_cancel': ('CancelOrderResponse',),
+    }
+
+    def __init__(self,  production=False, use_cached_session=True, delay_time_sec=2, max_workers=16,
+                 quote_cache_size=0, quote_max_age_sec=1.0, lazy_accounts=False, open_orders_refresh_sec=30,
+                 defer_connect=False, rate_limits=RateLimiter.DEFAULT_LIMITS, max_retries=3, json_backend=None,
+                 response_fields=None, metrics=False, record_to=None, replay_from=None, replay_speed=None,
+                 base_url=None, credentials=None, cache_file=None, option_cache_size=256, option_chain_max_age_sec=5.0,
+                 option_expiry_max_age_sec=3600):
+        self.__account_list = None
+        self.__current_account = None
+        self.__accounts_by_id = {}  # accountId -> AccountHandle
+        self.__accounts_by_id_key = {}  # accountIdKey -> AccountHandle
+        self.__quote_streamer = None
+        self.__streamer_lock = Lock()
+        self.__order_watcher = None
+        self.__watcher_lock = Lock()
+        self.__connect_lock = Lock()
+        self.__connecting_thread = None
+        self.__authorized = False
+        self.__accounts_loaded = False
+        self.__session_manager = SessionManager(renew=self.__renew_shared, reauthorize=self.__reauthorize)
         self.use_cached_session = use_cached_session
-        self.cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.bin')
-        self.consumer_key = secret.CONSUMER_KEY_PROD if production else secret.CONSUMER_KEY_DEV
-        self.consumer_secret = secret.CONSUMER_SECRET_PROD if production else secret.CONSUMER_SECRET_DEV
-        self.web_user = secret.WEB_USER
-        self.web_password = secret.WEB_PASSWORD
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(rate_limits) if rate_limits else None  # rate_limits=None disables throttling
+        self.max_retries = max_retries  # retries of throttled responses
+        # metrics=True, or a RequestMetrics shared between clients, instruments every request
+        self.metrics = (RequestMetrics() if metrics is True else metrics) or None
+        self.decoder = ResponseDecoder(json_backend)  # json_backend=None picks the fastest installed one
+        # endpoint name -> ResponseDecoder fields spec of each returned record.  Projections must keep what the client
+        # itself reads: symbolDescription and quantity of positions, Computed of balances, Brokerage of transactions
+        # filtered by symbol.  Without simdjson they cost a copy of every response (see ResponseDecoder)
+        self.response_fields = {endpoint: ResponseDecoder.normalize(fields) for endpoint, fields in (response_fields or {}).items()}
+        self.lazy_accounts = lazy_accounts  # load each account's balance and positions on first use
+        self.__hydrate_locks = {}  # accountIdKey -> Lock, so first uses of different accounts load concurrently
+        self.__hydrate_locks_lock = Lock()
+        self.__reconcile_lock = Lock()
+        self.__reconcile_pending = {}  # accountIdKey -> rerun requested while a background refresh is running
+        self.__background_threads = set()  # account and open order refreshes, joined on exit so a cassette holds their requests
+        self.open_orders_refresh_sec = open_orders_refresh_sec
+        self.__order_books = {}  # accountIdKey -> OpenOrderBook
+        self.__order_books_lock = Lock()
+        self.quote_cache = TTLCache(quote_cache_size) if quote_cache_size > 0 else None  # opt-in, disabled by default
+        self.quote_max_age_sec = quote_max_age_sec
+        self.option_cache = TTLCache(option_cache_size) if option_cache_size > 0 else None  # chains per expiry and expiry dates
+        self.option_chain_max_age_sec = option_chain_max_age_sec
+        self.option_expiry_max_age_sec = option_expiry_max_age_sec
+        self.cache_file = cache_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.bin')
+        self.session_store = SessionStore(self.cache_file)  # shared with every other process using the same cache_file
+        # record_to (a path or Cassette) records every response; replay_from serves them back with no network, OAuth
+        # or credentials at replay_speed (see ReplaySession)
+        self.replaying = replay_from is not None
+        self.replay_speed = replay_speed
+        if self.replaying:
+            self.cassette = replay_from if isinstance(replay_from, Cassette) else Cassette.load(replay_from)
+        else:
+            self.cassette = record_to if isinstance(record_to, Cassette) or record_to is None else Cassette(record_to)
+        if self.replaying and not replay_speed:
+            self.rate_limiter = None  # nothing to protect when answering as fast as possible
+        # credentials: dict of consumer_key, consumer_secret, access_token and access_token_secret used as is, with no
+        # browser login, session cache or secret.py, e.g. against a stub server at base_url
+        self.__credentials = credentials
+        if self.replaying:
+            self.consumer_key = self.consumer_secret = self.web_user = self.web_password = None
+        elif credentials is not None:
+            self.consumer_key = credentials['consumer_key']
+            self.consumer_secret = credentials['consumer_secret']
+            self.web_user = self.web_password = None
+        else:
+            import secret
+            self.consumer_key = secret.CONSUMER_KEY_PROD if production else secret.CONSUMER_KEY_DEV
+            self.consumer_secret = secret.CONSUMER_SECRET_PROD if production else secret.CONSUMER_SECRET_DEV
+            self.web_user = secret.WEB_USER
+            self.web_password = secret.WEB_PASSWORD
         self.delay_time_sec = delay_time_sec
-        self.session_start_time = datetime.now()
         self.base_url_prod = r"https://api.etrade.com"
         self.base_url_dev = r"https://apisb.etrade.com"
-        self.__base_url = self.base_url_prod if production else self.base_url_dev
-        self.__renew_access_token_url = r"https://api.etrade.com/oauth/renew_access_token"
-        self.__revoke_access_token_url = r"https://api.etrade.com/oauth/revoke_access_token"
+        self.__base_url = base_url.rstrip('/') if base_url else self.base_url_prod if production else self.base_url_dev
+        token_url = base_url.rstrip('/') if base_url else r"https://api.etrade.com"
+        self.__renew_access_token_url = "%s/oauth/renew_access_token" % token_url
+        self.__revoke_access_token_url = "%s/oauth/revoke_access_token" % token_url
         self.service = OAuth1Service(
                   name='etrade',
                   consumer_key=self.consumer_key,
@@ -44,13 +2185,89 @@ class Etrader():
         self.oauth_token = None
         self.oauth_token_secret = None
         self.verifier = None
-        self.session = None
-        self.__authorization()
-        self.current_account = self.__CurrentAccount()
-        self.account_list = self.get_list_of_accounts()
-        self.current_account.set_by_index(0)
-        self.__auto_renew_auth = Timer(60, self.auto_renew_token)  # in new thread, after 1 hour start checking token every hour
-        self.__auto_renew_auth.start()
+        if not defer_connect:  # otherwise authorization and account loading wait for the first call that needs them
+            self.connect()
+
+    def connect(self):
+        '''Authorize the session and load accounts now rather than on first use'''
+        self.__ensure_connected(load_accounts=True)
+        return self
+
+    def __ensure_connected(self, load_accounts):
+        '''Run the deferred network start-up once: authorization and token upkeep, then, when asked for, account
+        loading.  Re-entrant calls from the thread doing the start-up return immediately, other threads wait for it'''
+        if self.__authorized and (self.__accounts_loaded or not load_accounts):
+            return
+        if self.__connecting_thread == get_ident():
+            return
+        with self.__connect_lock:
+            self.__connecting_thread = get_ident()
+            try:
+                if not self.__authorized:
+                    self.__authorization()
+                    self.__authorized = True
+                    if not self.replaying:  # every authorized client renews, whichever call connected it
+                        self.__session_manager.start()
+                if load_accounts and not self.__accounts_loaded:
+                    self.__current_account = self.__CurrentAccount(hydrate=self.__hydrate_account)
+                    self.__account_list = self.get_list_of_accounts()
+                    self.__current_account.set_by_index(0)
+                    self.__accounts_loaded = True
+            finally:
+                self.__connecting_thread = None
+        return
+
+    @property
+    def session(self):
+        self.__ensure_connected(load_accounts=False)
+        return self.__session_manager.session
+
+    @session.setter
+    def session(self, value):
+        if self.cassette is not None and not self.replaying and not isinstance(value, RecordingSession):
+            value = RecordingSession(value, self.cassette)
+        self.__session_manager.swap(value)
+
+    @property
+    def session_start_time(self):
+        '''Time of the last authorization or successful token renewal'''
+        return self.__session_manager.session_start_time
+
+    @property
+    def account_list(self):
+        self.__ensure_connected(load_accounts=True)
+        return self.__account_list
+
+    @account_list.setter
+    def account_list(self, value):
+        handles = [AccountHandle(self, account, self.__hydrate_account) for account in value or []]
+        self.__accounts_by_id = {handle.id: handle for handle in handles}
+        self.__accounts_by_id_key = {handle.id_key: handle for handle in handles}
+        self.__account_list = value
+
+    @property
+    def accounts(self):
+        '''AccountHandle of every account, in account list order'''
+        return [self.__accounts_by_id_key[account['accountIdKey']] for account in self.account_list]
+
+    def account(self, account_id=None, id_key=None):
+        '''AccountHandle by account id or id key (default: the current account)'''
+        self.__ensure_connected(load_accounts=True)
+        if account_id is None and id_key is None:
+            id_key = self.current_account.id_key
+        handle = self.__accounts_by_id.get(account_id) if id_key is None else self.__accounts_by_id_key.get(id_key)
+        if handle is None:
+            raise ValueError(f'Invalid account ID: {account_id}' if id_key is None else f'Invalid account ID Key: {id_key}')
+        return handle
+
+    @property
+    def current_account(self):
+        self.__ensure_connected(load_accounts=True)
+        return self.__current_account
+
+    @current_account.setter
+    def current_account(self, value):
+        self.__current_account = value
 
     def __enter__(self):
         '''Permit WITH instantiation'''
@@ -58,35 +2275,73 @@ class Etrader():
 
     def __exit__(self, exc_type, exc_value, traceback):
         '''Cleanup when object is destroyed'''
-        self.__auto_renew_auth.cancel()
+        self.__session_manager.stop()
+        if self.__quote_streamer is not None:
+            self.__quote_streamer.stop()
+        if self.__order_watcher is not None:
+            self.__order_watcher.stop()
+        self.__join_background()
+        if not self.__authorized:  # deferred start-up never ran, nothing to revoke
+            return
+        if self.cassette is not None and self.cassette.path is not None and not self.replaying:  # in-memory cassettes stay with the caller
+            self.cassette.save()
+        if self.replaying or self.__credentials is not None:  # tokens were not issued by this client
+            return
         if not self.use_cached_session:
             self.revoke_accesss_token()
-            if os.path.isfile(self.cache_file):
-                os.remove(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.bin'))
+            self.session_store.clear()
         return
 
     def close(self):
         self.__exit__(None, None, None)
         return
 
+    def __start_background(self, target, *args):
+        '''Run target in a daemon thread that __exit__ waits for'''
+        def __run():
+            try:
+                target(*args)
+            finally:
+                with self.__reconcile_lock:
+                    self.__background_threads.discard(thread)
+
+        thread = Thread(target=__run, daemon=True)
+        with self.__reconcile_lock:
+            self.__background_threads.add(thread)
+        thread.start()
+        return
+
+    def __join_background(self):
+        '''Wait for background refreshes, including any they start while being waited for'''
+        while True:
+            with self.__reconcile_lock:
+                threads = list(self.__background_threads)
+            if not threads:
+                return
+            for thread in threads:
+                thread.join()
+
     def __authorization(self):
         '''Authorize user session form cache if enabled or create new session'''
-        def __retrieve_connection_cache():
+        if self.replaying:
+            self.session = ReplaySession(self.cassette, self.replay_speed)
+            return
+        if self.__credentials is not None:
+            session = OAuth1Session(**self.__credentials)
+            session.headers.update({"Content-Type": "application/json", "consumerKey": self.consumer_key})
+            self.__configure_session(session)
+            self.session = session
+            return
+
+        def __retrieve_connection_cache(con_data):
             '''If previous session was cached and not destroyed, try to reopen session'''
-            if os.path.isfile(self.cache_file):
-                with open(self.cache_file, "rb") as cache_data:
-                    byte_data = cache_data.read()
-                    try:
-                        con_data = msgpack.unpackb(byte_data)
-                        self.oauth_token = con_data['oauth_token']
-                        self.oauth_token_secret = con_data['oauth_token_secret']
-                        self.service.authorize_url = con_data['authorize_url']
-                        self.verifier = con_data['verifier']
-                        self.session = OAuth1Session(**json.loads(json.dumps(con_data['session'])))
-                    except Exception as e:
-                        return False
-                return True
-            return False
+            if con_data is None:
+                return False
+            try:
+                self.__restore_session(con_data)
+            except Exception as e:
+                return False
+            return True
 
         def __test_connection():
             '''test cached session validity by attempting to renew token'''
@@ -110,7 +2365,6 @@ class Etrader():
             self.oauth_token = None
             self.oauth_token_secret = None
             self.verifier = None
-            self.session = None
             return
 
         def __new_authorization():
@@ -121,55 +2375,188 @@ class Etrader():
                 self.oauth_token, self.oauth_token_secret = self.service.get_request_token(params={'oauth_callback': 'oob', 'format': 'json'})
                 self.service.authorize_url = self.service.authorize_url.format(self.consumer_key, self.oauth_token)
                 self.verifier = self.__get_verifier()
-                self.session = self.service.get_auth_session(self.oauth_token, self.oauth_token_secret, params={'oauth_verifier': self.verifier})
-                self.session.headers.update({"Content-Type": "application/json", "consumerKey": self.consumer_key})
+                session = self.service.get_auth_session(self.oauth_token, self.oauth_token_secret, params={'oauth_verifier': self.verifier})
+                session.headers.update({"Content-Type": "application/json", "consumerKey": self.consumer_key})
+                self.__configure_session(session)
+                self.session = session  # swapped in only once fully set up
             except Exception as e:
                 raise Exception(e)
                 return False
             return True
 
         def __set_connection_cache():
-            '''Write session parameters to disk if caching is enabled'''
-            if os.path.isfile(self.cache_file):
-                os.remove(self.cache_file)
-            with open(self.cache_file, 'wb') as outfile:
-                con_param = {'oauth_token': self.oauth_token,
-                           'oauth_token_secret': self.oauth_token_secret,
-                           'authorize_url': self.service.authorize_url,
-                           'verifier': self.verifier,
-                           'session': {'consumer_key': self.session.consumer_key,
-                                       'consumer_secret': self.session.consumer_secret,
-                                       'access_token': self.session.access_token,
-                                       'access_token_secret': self.session.access_token_secret}}
-                outfile.write(msgpack.packb(con_param))
+            '''Atomically write session parameters to the shared cache if caching is enabled'''
+            con_param = {'oauth_token': self.oauth_token,
+                       'oauth_token_secret': self.oauth_token_secret,
+                       'authorize_url': self.service.authorize_url,
+                       'verifier': self.verifier,
+                       'session': {'consumer_key': self.session.consumer_key,
+                                   'consumer_secret': self.session.consumer_secret,
+                                   'access_token': self.session.access_token,
+                                   'access_token_secret': self.session.access_token_secret}}
+            self.__session_manager.mark_renewed(self.session_store.written_at(self.session_store.write(con_param)))
             return
 
         if not self.use_cached_session:  # If not caching sessions, always get new token and never write to disk
             __new_authorization()
             return
-        elif __retrieve_connection_cache():  # If using cache, test current values by attempting to renew previous token
-            __test_connection()
-        else:  # If token renewal fails, session has expired, required to go through new authorization
-            __new_authorization()
-        __set_connection_cache()  # write connection parameters to disk and update class variables with renewed or new session
+        with self.session_store.lock():  # other processes wait here, then reuse the session set up by this one
+            con_data = self.session_store.read()
+            if not __retrieve_connection_cache(con_data):  # If token renewal fails, session has expired, required to go through new authorization
+                __new_authorization()
+            elif self.session_store.is_fresh(con_data):  # just logged in or renewed by another process, nothing to test
+                self.__session_manager.mark_renewed(self.session_store.written_at(con_data))
+                print('Using cached session.')
+                return
+            else:  # If using cache, test current values by attempting to renew previous token
+                __test_connection()
+            __set_connection_cache()  # write connection parameters to disk and update class variables with renewed or new session
         return
 
+    def __restore_session(self, con_data):
+        '''Install the session described by cached connection parameters'''
+        self.oauth_token = con_data['oauth_token']
+        self.oauth_token_secret = con_data['oauth_token_secret']
+        self.service.authorize_url = con_data['authorize_url']
+        self.verifier = con_data['verifier']
+        session = OAuth1Session(**json.loads(json.dumps(con_data['session'])))
+        self.__configure_session(session)
+        self.session = session
+        return
+
+    def __adopt_cached_session(self, new_token_only=False):
+        '''Take over a renewal or re-authorization another process wrote to the shared cache since this one last
+        renewed, instead of repeating it.  Returns True if one was adopted'''
+        con_data = self.session_store.read()
+        written_at = self.session_store.written_at(con_data)
+        started = self.session_start_time
+        if written_at is None or started is None or written_at <= started or \
+                (datetime.now() - written_at).total_seconds() >= self.__session_manager.renew_every_sec:
+            return False
+        same_token = con_data['session']['access_token'] == getattr(self.session, 'access_token', None)
+        if same_token and new_token_only:
+            return False
+        if not same_token:
+            self.__restore_session(con_data)
+        self.__session_manager.mark_renewed(written_at)
+        return True
+
+    def __renew_shared(self):
+        '''Renew the access token once for every process sharing the session cache: under the cache lock, adopt a
+        renewal another process just made, otherwise renew and restamp the cache so the others skip theirs'''
+        if not self.use_cached_session or self.__credentials is not None or self.replaying:
+            return self.renew_accesss_token().ok
+        with self.session_store.lock():
+            if self.__adopt_cached_session():
+                return True
+            if not self.renew_accesss_token().ok:
+                return False
+            con_data = self.session_store.read()
+            if con_data is not None:
+                self.__session_manager.mark_renewed(self.session_store.written_at(self.session_store.write(con_data)))
+        return True
+
+    def __configure_session(self, session):
+        '''Size the keep-alive connection pool so concurrent requests do not queue for sockets'''
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_workers, 1))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return
+
+    def __request(self, method, url, endpoint, priority=None, **kwargs):
+        '''Send a request through the rate limiter, retrying throttled responses up to max_retries times with backoff.
+        endpoint names an ENDPOINTS entry, which selects the rate limit class and default priority'''
+        endpoint_class, default_priority = self.ENDPOINTS[endpoint]
+        priority = default_priority if priority is None else priority
+        sample = self.metrics.begin(endpoint, method) if self.metrics is not None else None
+        attempt = 0
+        try:
+            while True:
+                waited = self.rate_limiter.acquire(endpoint_class, priority) if self.rate_limiter is not None else 0.0
+                if sample is None:
+                    res = self.session.request(method, url, **kwargs)
+                else:
+                    res = self.__timed_request(sample, waited, method, url, **kwargs)
+                if self.rate_limiter is None:
+                    break
+                if not self.rate_limiter.is_throttled(res):
+                    self.rate_limiter.succeeded(endpoint_class)
+                    break
+                if attempt >= self.max_retries:
+                    break  # caller's raise_for_status reports it
+                self.rate_limiter.throttled(endpoint_class, res.headers.get('Retry-After'), attempt)
+                attempt += 1
+        except Exception as e:
+            if sample is not None:
+                self.metrics.finish(sample, e)
+            raise
+        if sample is not None:
+            self.metrics.finish(sample)
+        return res
+
+    def __timed_request(self, sample, rate_limit_wait_sec, method, url, **kwargs):
+        '''session.request that adds its waits, round-trip time and sizes to a metrics sample'''
+        start = time.perf_counter()
+        session = self.session  # blocks while a deferred authorization is in progress
+        sent = time.perf_counter()
+        res = session.request(method, url, **kwargs)
+        self.metrics.attempt(sample, res, rate_limit_wait_sec, sent - start, time.perf_counter() - sent)
+        return res
+
+    def __decode(self, req, endpoint, default=None, fields=None, page=False):
+        '''Decode the value at RESPONSE_PATHS[endpoint] of a response, projected onto fields (default: the endpoint's
+        response_fields, ResponseDecoder.WHOLE for none).  page=True returns the enclosing page of a paged endpoint,
+        projecting only its records'''
+        path = self.RESPONSE_PATHS[endpoint]
+        fields = self.response_fields.get(endpoint) if fields is None else fields
+        if fields is ResponseDecoder.WHOLE:
+            fields = None
+        if page:
+            path, record_key = path[:-1], path[-1]
+            if fields is not None:
+                fields = {'marker': None, 'moreTransactions': None, record_key: fields}
+        return self.decoder.decode(req.content, path, fields, default)
+
+    def __fan_out(self, func, items, max_workers=None):
+        '''Call func on each item over a bounded worker pool.  Returns (item, result, exception) tuples in input order'''
+        items = list(items)
+        max_workers = min(len(items), max_workers or self.max_workers)
+        if max_workers <= 1:
+            results = []
+            for item in items:
+                try:
+                    results.append((item, func(item), None))
+                except Exception as e:
+                    results.append((item, None, e))
+            return results
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(func, item) for item in items]
+        return [(item, f.result() if f.exception() is None else None, f.exception()) for item, f in zip(items, futures)]
+
     def check_token(self):
-        age = datetime.now() - self.session_start_time
-        if age >= timedelta(hours=4):
-            try:
-                res = self.renew_accesss_token()
-                if not res.ok:
-                    self.__authorization()
-            except Exception as e: # catches ConnectionError where remote host forcibly closes connection
-                # Force new authorization
-                if os.path.isfile(self.cache_file):
-                    os.remove(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.bin'))
-                self.__authorization()
+        '''Renew the access token now if it is due, re-authorizing if renewal fails'''
+        self.__session_manager.check()
+        return
+
+    def __reauthorize(self):
+        '''Replace an expired session: adopt one another process has already re-authorized, otherwise drop the cached
+        credentials and authorize again'''
+        if not self.use_cached_session or self.__credentials is not None or self.replaying:
+            self.__authorization()
+            return
+        with self.session_store.lock():
+            if self.__adopt_cached_session(new_token_only=True):
+                return
+            self.session_store.clear()
+            self.__authorization()
         return
 
     def __get_verifier(self):
         '''Use selenium web driver to make user copy oAuth confirmation code'''
+        import undetected_chromedriver.v2 as uc
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.common.action_chains import ActionChains
+        from selenium.webdriver.common.by import By
 
         # configure undetectable web driver
         user_agent = f'user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4515.159 Safari/537.36'
@@ -228,37 +2615,55 @@ class Etrader():
 
     def renew_accesss_token(self):
         '''renew_access_token'''
-        self._session_start_time = datetime.now()
-        return self.session.get(self.__renew_access_token_url)
+        res = self.__request('GET', self.__renew_access_token_url, 'renew_token')
+        if res.ok:
+            self.__session_manager.mark_renewed()
+        return res
 
     def auto_renew_token(self):
-        while True:
-            self.check_token()
-            time.sleep(3600)  # check token every hour (3600 seconds)
+        '''Start background token upkeep; it stops on close()'''
+        self.__session_manager.start()
+        return
 
     def revoke_accesss_token(self):
         '''revoke_access_token'''
-        self.session.get(self.__revoke_access_token_url)
+        self.__request('GET', self.__revoke_access_token_url, 'revoke_token')
         return
 
-    def get_list_of_accounts(self):
-        '''Get all accounts related to consumer key'''
+    def get_list_of_accounts(self, lazy=None):
+        '''Get all accounts related to consumer key.  Balances and portfolios of every account are fetched concurrently,
+        or, in lazy mode, only when an account's holdings are first read'''
+        lazy = self.lazy_accounts if lazy is None else lazy
 
         def __get_list():
             end_pt = r"v1/accounts/list"
             api_url = "%s/%s.%s" % (self.__base_url, end_pt, 'json')
-            req = self.session.get(api_url)
+            req = self.__request('GET', api_url, 'accounts_list')
             req.raise_for_status()
-            __update_current_account_obj(req.json()['AccountListResponse']['Accounts']['Account'])
-            return
-
-        def __populate_holdings():
-            for i in range(len(self.account_list)):
-                account_value = self.get_account_balance(self.account_list[i]['accountId'])
-                self.account_list[i]['cashAvailable'] = account_value['Computed']['cashAvailableForInvestment']
-                self.account_list[i]['positions'] = self.get_account_positions(self.account_list[i]['accountId'])
-                self.account_list[i]['totalAccountValue'] = account_value['Computed']['RealTimeValues']['totalAccountValue']
-            __update_current_account_obj(self.account_list)
+            return self.__decode(req, 'accounts_list')
+
+        def __keep_known(account_lst):
+            '''Update the dicts of already listed accounts in place, so existing handles, order books and holdings
+            stay attached to them'''
+            merged = []
+            for account in account_lst:
+                known = self.__accounts_by_id_key.get(account['accountIdKey'])
+                if known is not None:
+                    known.account.update(account)
+                    account = known.account
+                merged.append(account)
+            return merged
+
+        def __populate_holdings(account_lst):
+            fetches = [(account, fetch) for account in account_lst for fetch in (self.__fetch_balance, self.__fetch_positions)]
+            results = self.__fan_out(lambda item: item[1](item[0]), fetches)
+            for (account, fetch), result, error in results:
+                if error is not None:
+                    raise error
+                if fetch == self.__fetch_balance:
+                    self.__set_balance(account, result)
+                else:
+                    self.__set_positions(account, result)
             return
 
         def __update_current_account_obj(account_lst):
@@ -266,209 +2671,689 @@ class Etrader():
             self.current_account.update_account_list(account_lst)
             return
 
-        __get_list()
-        __populate_holdings()
+        account_lst = __keep_known(__get_list())
+        if not lazy:
+            __populate_holdings(account_lst)
+        __update_current_account_obj(account_lst)
         return self.account_list
 
-    def get_account_balance(self, account_id=None):
-        '''Get all account balances'''
-        if account_id is not None:
-            self.current_account.set_by_id(account_id)
-        account_id_key = self.current_account.id_key
-        account_inst_type = self.current_account.institution_type
-        account_type = self.current_account.type
-        end_pt = "v1/accounts"
-        api_url = "%s/%s/%s/balance.json" % (self.__base_url, end_pt, account_id_key)
-        payload = {"realTimeNAV": True, "instType": account_inst_type, "accountType": account_type}
-        req = self.session.get(api_url, params=payload)
-        req.raise_for_status()
-        return req.json()['BalanceResponse']
+    def __hydrate_account(self, account):
+        '''Load balance and positions of a lazily listed account on its first use.  Concurrent first uses of one
+        account share a single load'''
+        with self.__hydrate_locks_lock:
+            lock = self.__hydrate_locks.setdefault(account['accountIdKey'], Lock())
+        with lock:
+            if 'positions' not in account:
+                self.__refresh_holdings(account)
+        return
 
-    def get_account_positions(self, account_id=None):
-        '''Get account positions'''
-        if account_id is not None:
-            self.current_account.set_by_id(account_id)
+    def __refresh_holdings(self, account, open_orders=False):
+        '''Re-fetch balance and positions (and optionally open orders) of a single account concurrently and update
+        its dict in place'''
+        fetches = [self.__fetch_balance, self.__fetch_positions] + ([self.__fetch_open_orders] if open_orders else [])
+        results = self.__fan_out(lambda fetch: fetch(account), fetches)
+        for _, _, error in results:
+            if error is not None:
+                raise error
+        self.__set_balance(account, results[0][1])
+        self.__set_positions(account, results[1][1])
+        if open_orders:
+            self.__get_order_book(account).load(results[2][1])
+        return account
+
+    def get_portfolio_table(self, account_ids=None, refresh=False, revalue=False):
+        '''PortfolioTable of the positions of account_ids (default: every account) as already loaded; accounts not
+        loaded yet, or all of them with refresh=True, are fetched concurrently first.  revalue=True reprices the table
+        from one QuoteSnapshot of all its symbols'''
+        self.__ensure_connected(load_accounts=True)
+        if account_ids is None:
+            accounts = list(self.account_list)
+        else:
+            accounts = [self.__resolve_account(account_id) for account_id in account_ids]
+        stale = accounts if refresh else [account for account in accounts if 'positions' not in account]
+        for account, _, error in self.__fan_out(self.__refresh_holdings, stale):
+            if error is not None:
+                raise error
+        table = PortfolioTable(accounts)
+        if revalue and table.symbols:
+            table.revalue(self.get_quote_snapshot(table.symbols))
+        return table
+
+    def refresh_account(self, account_id=None):
+        '''Synchronously re-fetch cash and positions of one account (default: current account) without re-listing accounts'''
+        return self.__refresh_holdings(self.__resolve_account(account_id))
+
+    @staticmethod
+    def __set_balance(account, balance):
+        account['cashAvailable'] = balance['Computed']['cashAvailableForInvestment']
+        account['totalAccountValue'] = balance['Computed']['RealTimeValues']['totalAccountValue']
+        return
+
+    @staticmethod
+    def __set_positions(account, positions):
+        '''Store positions along with a per-symbol share count index'''
+        shares = {}
+        for position in positions:
+            shares[position['symbolDescription']] = shares.get(position['symbolDescription'], 0) + position['quantity']
+        account['sharesBySymbol'] = shares
+        account['positions'] = positions
+        return
+
+    def __fetch_balance(self, account):
         end_pt = "v1/accounts"
-        api_url = "%s/%s/%s/portfolio.json" % (self.__base_url, end_pt, self.current_account.id_key)
-        req = self.session.get(api_url)
+        api_url = "%s/%s/%s/balance.json" % (self.__base_url, end_pt, account['accountIdKey'])
+        payload = {"realTimeNAV": True, "instType": account['institutionType'], "accountType": account['accountType']}
+        req = self.__request('GET', api_url, 'balance', params=payload)
         req.raise_for_status()
-        return req.json()['PortfolioResponse']['AccountPortfolio'][0]['Position']
+        return self.__decode(req, 'balance')
 
-    def get_account_transaction_history(self, account_id=None, ticker_symbol=None):
-        '''Get Transaction History'''
-        if account_id is not None:
-            self.current_account.set_by_id(account_id)
+    def __fetch_positions(self, account):
         end_pt = "v1/accounts"
-        api_url = "%s/%s/%s/transactions.json" % (self.__base_url, end_pt, self.current_account.id_key)
-        req = self.session.get(api_url)
+        api_url = "%s/%s/%s/portfolio.json" % (self.__base_url, end_pt, account['accountIdKey'])
+        req = self.__request('GET', api_url, 'portfolio')
         req.raise_for_status()
-        return req.json()['TransactionListResponse']['Transaction']
+        return self.__decode(req, 'portfolio', default=[])
+
+    def get_account_balance(self, account_id=None):
+        '''Get all account balances'''
+        return self.__fetch_balance(self.__resolve_account(account_id))
+
+    def get_account_positions(self, account_id=None):
+        '''Get account positions'''
+        return self.__fetch_positions(self.__resolve_account(account_id))
+
+    def get_account_transaction_history(self, account_id=None, ticker_symbol=None, start_date=None, end_date=None, count=50):
+        '''Get Transaction History, following pages until count transactions (all of them when count is None)'''
+        return list(islice(self.iter_transactions(account_id, ticker_symbol=ticker_symbol, start_date=start_date, end_date=end_date), count))
+
+    def iter_transactions(self, account_id=None, ticker_symbol=None, start_date=None, end_date=None, sort_order='DESC', page_size=50, prefetch=True, fields=None):
+        '''Yield transactions of an account (default: current account) one at a time across all pages.  Dates are
+        datetime/date objects or MMDDYYYY strings and filter on the server; the transactions endpoint has no symbol
+        filter, so ticker_symbol is matched locally.  fields projects each transaction (see ResponseDecoder)'''
+        account = self.__resolve_account(account_id)
+        api_url = "%s/v1/accounts/%s/transactions.json" % (self.__base_url, account['accountIdKey'])
+        params = {'sortOrder': sort_order}
+        if start_date is not None:
+            params['startDate'] = self.__format_date(start_date)
+        if end_date is not None:
+            params['endDate'] = self.__format_date(end_date)
+        for transaction in self.__iter_pages(api_url, 'transactions', params, min(page_size, 50), prefetch, fields):
+            if ticker_symbol is None or self.transaction_symbol(transaction) == ticker_symbol:
+                yield transaction
+
+    @staticmethod
+    def transaction_symbol(transaction):
+        '''Symbol of a brokerage transaction, None for cash movements'''
+        brokerage = transaction.get('Brokerage', {})
+        return brokerage.get('Product', {}).get('symbol') or brokerage.get('displaySymbol') or None
+
+    def iter_orders(self, account_id=None, status=None, ticker_symbol=None, from_date=None, to_date=None, page_size=100, prefetch=True, fields=None):
+        '''Yield orders of an account (default: current account) one at a time across all pages.  status, symbol
+        (one symbol or a list of up to 25) and the date range (datetime/date or MMDDYYYY) filter on the server.
+        fields projects each order (see ResponseDecoder)'''
+        account = self.__resolve_account(account_id)
+        api_url = f'{self.__base_url}/v1/accounts/{account["accountIdKey"]}/orders.json'
+        params = {}
+        if status is not None:
+            params['status'] = status
+        if ticker_symbol is not None:
+            params['symbol'] = ticker_symbol if isinstance(ticker_symbol, str) else ','.join(ticker_symbol)
+        if from_date is not None:
+            params['fromDate'] = self.__format_date(from_date)
+        if to_date is not None:
+            params['toDate'] = self.__format_date(to_date)
+        return self.__iter_pages(api_url, 'orders_list', params, min(page_size, 100), prefetch, fields)
+
+    def __iter_pages(self, api_url, endpoint, params, page_size, prefetch, fields=None):
+        '''Yield records of a paginated endpoint by following its marker.  With prefetch the next page is requested
+        while the records of the current one are being consumed'''
+        record_key = self.RESPONSE_PATHS[endpoint][-1]
+
+        def __fetch(marker):
+            page_params = dict(params, count=page_size)
+            if marker is not None:
+                page_params['marker'] = marker
+            req = self.__request('GET', api_url, endpoint, params=page_params, timeout=30)
+            req.raise_for_status()
+            return self.__decode(req, endpoint, default={}, fields=fields, page=True)
+
+        def __next_marker(page):
+            if not page.get(record_key) or page.get('moreTransactions') is False:
+                return None
+            return page.get('marker') or None
+
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = __fetch(None)
+            while True:
+                marker = __next_marker(page)
+                pending = pool.submit(__fetch, marker) if pool is not None and marker is not None else None
+                yield from page.get(record_key, [])
+                if marker is None:
+                    return
+                page = pending.result() if pending is not None else __fetch(marker)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False)
+
+    def __resolve_account(self, account_id=None):
+        '''Account dict for account_id, or the current account, without switching the current account'''
+        if account_id is None:
+            return self.current_account.account
+        self.__ensure_connected(load_accounts=True)
+        handle = self.__accounts_by_id.get(account_id)
+        if handle is None:
+            raise ValueError(f'Invalid account ID: {account_id}')
+        return handle.account
+
+    @staticmethod
+    def __format_date(value):
+        return value.strftime('%m%d%Y') if hasattr(value, 'strftime') else str(value)
 
     def get_transaction_details(self, transaction_id=None, account_id=None,):
         '''Get Transaction History'''
         if transaction_id is None:
             return []
-        if account_id is not None:
-            self.current_account.set_by_id(account_id)
+        return self.__fetch_transaction_details(self.__resolve_account(account_id), transaction_id)
+
+    def __fetch_transaction_details(self, account, transaction_id):
         end_pt = "v1/accounts"
-        api_url = "%s/%s/%s/transactions/%s.json" % (self.__base_url, end_pt, self.current_account.id_key, transaction_id)
-        req = self.session.get(api_url)
+        api_url = "%s/%s/%s/transactions/%s.json" % (self.__base_url, end_pt, account['accountIdKey'], transaction_id)
+        req = self.__request('GET', api_url, 'transaction_details')
         req.raise_for_status()
-        return req.json()['TransactionDetailsResponse']
+        return self.__decode(req, 'transaction_details')
+
+    def sync_transaction_history(self, store, account_id=None, details=True):
+        '''Download into a HistoryStore only the transactions newer than the last one it holds, then fetch details
+        concurrently for stored transactions that have none yet.  Returns the number of new transactions'''
+        account = self.__resolve_account(account_id)
+        last_date = store.latest_transaction_date(account['accountId'])
+        start_date = datetime.fromtimestamp(last_date / 1000) if last_date is not None else None
+        new_transactions = []
+        for transaction in self.iter_transactions(account_id=account['accountId'], start_date=start_date):
+            if start_date is not None and store.has_transaction(transaction['transactionId']):
+                continue
+            new_transactions.append(transaction)
+        added = store.add_transactions(account['accountId'], new_transactions)
+        if details:
+            missing = store.transactions_missing_details(account['accountId'])
+            for transaction_id, result, error in self.__fan_out(lambda t_id: self.__fetch_transaction_details(account, t_id), missing):
+                if error is not None:
+                    print(f'Unable to fetch details of transaction {transaction_id}: {error}')
+                    continue
+                store.set_transaction_details(transaction_id, result)
+        return added
+
+    def sync_order_history(self, store, account_id=None):
+        '''Download into a HistoryStore only orders placed since the last sync, re-reading from the oldest stored
+        order that was still open so its final status is kept.  Returns the number of orders written'''
+        account = self.__resolve_account(account_id)
+        sync_start = store.order_sync_start(account['accountId'])
+        from_date = datetime.fromtimestamp(sync_start / 1000) if sync_start is not None else None
+        return store.add_orders(account['accountId'], self.iter_orders(account_id=account['accountId'], from_date=from_date))
 
     def get_existing_orders(self, account_id=None):
         '''Get existing orders in account'''
-        if account_id is not None:
-            self.current_account.set_by_id(account_id)
+        account = self.__resolve_account(account_id)
         end_pt = "v1/accounts"
-        api_url = "%s/%s/%s/orders.json" % (self.__base_url, end_pt, self.current_account.id_key)
-        req = self.session.get(api_url)
+        api_url = "%s/%s/%s/orders.json" % (self.__base_url, end_pt, account['accountIdKey'])
+        req = self.__request('GET', api_url, 'orders_list', priority=self.PRIORITY_DEFAULT)
         req.raise_for_status()
-        return req.json()['OrdersResponse']['Order'] if req.content else []
-
-    def get_quote(self, stock_ticker: list or tuple or str) -> dict:
-        '''Get market quote for provided stock ticker'''
+        return self.__decode(req, 'orders_list', default=[])
+
+    def get_quote(self, stock_ticker: list or tuple or str, max_age_sec=None, columnar=False) -> dict:
+        '''Get market quotes for provided stock tickers as a dict keyed by symbol.  Large ticker lists are split into
+        endpoint-sized chunks that are fetched concurrently.  Symbols that could not be quoted map to {'error': reason}.
+        When the quote cache is enabled, quotes younger than max_age_sec (default quote_max_age_sec) are served from
+        it and concurrent requests for the same symbols share one fetch; max_age_sec=0 always fetches.
+        columnar=True returns a QuoteSnapshot instead (see get_quote_snapshot)'''
+        if not isinstance(stock_ticker, list) and not isinstance(stock_ticker, tuple):
+            stock_ticker = [stock_ticker]
+        if columnar:
+            return self.get_quote_snapshot(stock_ticker)
+        symbols = list(dict.fromkeys(stock_ticker))
+        if self.quote_cache is None or max_age_sec == 0:
+            return self.__fetch_quotes(symbols)
+        max_age_sec = self.quote_max_age_sec if max_age_sec is None else max_age_sec
+        return self.quote_cache.get_many(symbols, self.__fetch_quotes, max_age_sec)
+
+    def stream_quotes(self, symbols, callback=None, interval_sec=1.0):
+        '''Subscribe to changes of symbols on this client's shared QuoteStreamer, started on first use.  Every
+        subscriber shares the one poller; interval_sec only applies when it is created'''
+        with self.__streamer_lock:
+            if self.__quote_streamer is None:
+                self.__quote_streamer = QuoteStreamer(self, interval_sec)
+            streamer = self.__quote_streamer
+        subscription = streamer.subscribe(symbols, callback)
+        streamer.start()
+        return subscription
+
+    @property
+    def quote_streamer(self):
+        '''The shared QuoteStreamer, None until stream_quotes is first called'''
+        return self.__quote_streamer
+
+    def quote_cache_stats(self):
+        '''Hit, miss and coalesced request counters of the quote cache'''
+        return self.quote_cache.stats() if self.quote_cache is not None else {}
+
+    def __fetch_quotes(self, symbols):
+        '''Fetch quotes for symbols in concurrent endpoint-sized chunks'''
+        chunks = [symbols[i:i + self.QUOTE_CHUNK_SIZE] for i in range(0, len(symbols), self.QUOTE_CHUNK_SIZE)]
+        quotes = {}
+        for chunk, quote_response, error in self.__fan_out(self.__get_quote_chunk, chunks):
+            if error is not None:
+                quotes.update({symbol: {'error': str(error)} for symbol in chunk})
+                continue
+            _merge_quote_response(quotes, chunk, quote_response)
+        return quotes
+
+    def get_quote_snapshot(self, stock_ticker: list or tuple or str):
+        '''Fetch quotes concurrently like get_quote and return them as a columnar QuoteSnapshot of NumPy arrays (bid,
+        ask, last, volume, timestamp, ...) with a symbol -> row index.  Always fetches; requires numpy'''
         if not isinstance(stock_ticker, list) and not isinstance(stock_ticker, tuple):
             stock_ticker = [stock_ticker]
-        stock_ticker = ','.join(stock_ticker)
+        symbols = list(dict.fromkeys(stock_ticker))
+        chunks = [symbols[i:i + self.QUOTE_CHUNK_SIZE] for i in range(0, len(symbols), self.QUOTE_CHUNK_SIZE)]
+
+        def __parse_chunk(chunk):
+            hook, returned, columns = QuoteSnapshot.parser()
+            content = self.__get_quote_chunk(chunk, raw=True)
+            if content:
+                json.loads(content, object_pairs_hook=hook)
+            return returned, columns
+
+        snapshot_symbols, snapshot_columns, missing = [], None, []
+        for chunk, result, error in self.__fan_out(__parse_chunk, chunks):
+            if error is not None:
+                print(f'Quote request for {len(chunk)} symbols failed: {error}')
+                missing.extend(chunk)
+                continue
+            returned, columns = result
+            requested = {symbol.upper(): symbol for symbol in chunk}
+            returned = [requested.get(symbol.upper(), symbol) for symbol in returned]
+            returned_set = set(returned)
+            missing.extend(symbol for symbol in chunk if symbol not in returned_set)
+            snapshot_symbols.extend(returned)
+            if snapshot_columns is None:
+                snapshot_columns = columns
+            else:
+                for merged, column in zip(snapshot_columns, columns):
+                    merged.extend(column)
+        if snapshot_columns is None:
+            snapshot_columns = QuoteSnapshot.parser()[2]
+        return QuoteSnapshot(snapshot_symbols, snapshot_columns, missing)
+
+    def __get_quote_chunk(self, symbols, raw=False):
+        '''Request a single quote call for up to QUOTE_CHUNK_SIZE symbols'''
         end_pt = "v1/market/quote"
-        api_url = "%s/%s/%s.json" % (self.__base_url, end_pt, stock_ticker)
-        req = self.session.get(api_url)
+        api_url = "%s/%s/%s.json" % (self.__base_url, end_pt, ','.join(symbols))
+        req = self.__request('GET', api_url, 'quote', params={'overrideSymbolCount': 'true'})
         req.raise_for_status()
-        return req.json()['QuoteResponse']['QuoteData'] if req.content else []
+        if raw:
+            return req.content
+        return self.__decode(req, 'quote', default={})
 
     def look_up_product(self, search_str: str) -> dict:
         '''Performs a look up product'''
-        # api_url = self.base_url + "lookup/%s" % search_str
-        api_url = "%slookup/%s" % (self.__base_url, search_str + ".json")
-        req = self.session.get(api_url)
+        api_url = "%s/v1/market/lookup/%s.json" % (self.__base_url, quote(search_str, safe=''))
+        req = self.__request('GET', api_url, 'lookup')
         req.raise_for_status()
-        return req.json()
-
-    def list_orders(self, count=100):
-        '''lists all orders of self.current_account up to count value'''
-        end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders.json'
-        req = self.session.get(api_url, params={'count': count}, timeout=30)
+        return self.__decode(req, 'lookup')
+
+    def get_option_expiry_dates(self, symbol: str, expiry_type='ALL', max_age_sec=None) -> list:
+        '''Sorted expiration dates of the options on symbol.  expiry_type is the endpoint's expiryType (ALL, MONTHLY,
+        WEEKLY, QUARTERLY, ...).  Served from the option cache for option_expiry_max_age_sec unless max_age_sec says
+        otherwise; max_age_sec=0 always fetches'''
+        key = ('expiry', symbol.upper(), expiry_type)
+        if self.option_cache is None or max_age_sec == 0:
+            return self.__fetch_option_expiry_dates(key)
+        max_age_sec = self.option_expiry_max_age_sec if max_age_sec is None else max_age_sec
+        return list(self.option_cache.get(key, self.__fetch_option_expiry_dates, max_age_sec))
+
+    def __fetch_option_expiry_dates(self, key):
+        _, symbol, expiry_type = key
+        api_url = "%s/v1/market/optionexpiredate.json" % self.__base_url
+        req = self.__request('GET', api_url, 'option_expiry', params={'symbol': symbol, 'expiryType': expiry_type})
         req.raise_for_status()
-        return req.json()['OrdersResponse'] if req.content else []
+        expiration_dates = self.__decode(req, 'option_expiry', default=[])
+        return sorted({date(d['year'], d['month'], d['day']) for d in expiration_dates})
+
+    def get_option_chain(self, symbol: str, expiries=None, strike_price_near=None, no_of_strikes=None, include_weekly=True,
+                         chain_type='CALLPUT', option_category='STANDARD', price_type='ATNM', max_age_sec=None):
+        '''Option chain of symbol for expiries (dates, datetimes or 'YYYY-MM-DD' strings; default every expiry date) as
+        one array-backed OptionChain.  Expiries are fetched concurrently, one optionchains call each, and cached per
+        expiry for option_chain_max_age_sec, so once the expiry dates are cached a full chain takes about one round-trip.
+        strike_price_near and no_of_strikes limit each expiry to the strikes around a price.  Expiries that could not
+        be fetched are listed in the chain's missing'''
+        symbol = symbol.upper()
+        if expiries is None:
+            expiries = self.get_option_expiry_dates(symbol)
+        elif isinstance(expiries, (str, date)):
+            expiries = [expiries]
+        options = (strike_price_near, no_of_strikes, include_weekly, chain_type, option_category, price_type)
+        keys = [('chain', symbol, expiry, options) for expiry in dict.fromkeys(self.__expiry_date(e) for e in expiries)]
+        if self.option_cache is None or max_age_sec == 0:
+            chains = self.__fetch_option_chains(keys)
+        else:
+            max_age_sec = self.option_chain_max_age_sec if max_age_sec is None else max_age_sec
+            chains = self.option_cache.get_many(keys, self.__fetch_option_chains, max_age_sec)
+        return OptionChain.concat(symbol, [chains[key] for key in keys if chains.get(key) is not None],
+                                  missing=[key[2] for key in keys if chains.get(key) is None])
+
+    def __fetch_option_chains(self, keys):
+        '''Fetch the chain of every (_, symbol, expiry, options) key concurrently.  Failed expiries are left out'''
+        api_url = "%s/v1/market/optionchains.json" % self.__base_url
+
+        def __fetch(key):
+            _, symbol, expiry, (strike_price_near, no_of_strikes, include_weekly, chain_type, option_category, price_type) = key
+            params = {'symbol': symbol, 'expiryYear': expiry.year, 'expiryMonth': expiry.month, 'expiryDay': expiry.day,
+                      'includeWeekly': str(bool(include_weekly)).lower(), 'chainType': chain_type,
+                      'optionCategory': option_category, 'priceType': price_type}
+            if strike_price_near is not None:
+                params['strikePriceNear'] = strike_price_near
+            if no_of_strikes is not None:
+                params['noOfStrikes'] = no_of_strikes
+            req = self.__request('GET', api_url, 'option_chain', params=params)
+            req.raise_for_status()
+            response = self.__decode(req, 'option_chain', default={}, fields=self.decoder.reader_fields(OptionChain.FIELDS))
+            return OptionChain.from_response(symbol, expiry, response)
 
-    def list_open_orders(self, count=100):
-        '''lists all OPEN orders of self.current_account up to count value'''
-        end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders.json'
-        req = self.session.get(api_url, params={'count': count, 'status': 'OPEN'}, timeout=30)
-        req.raise_for_status()
-        return req.json()['OrdersResponse'] if req.content else []
+        chains = {}
+        for key, chain, error in self.__fan_out(__fetch, keys):
+            if error is not None:
+                print(f'Option chain request for {key[1]} expiring {key[2]} failed: {error}')
+                continue
+            chains[key] = chain
+        return chains
 
-    def list_executed_orders(self, count=100):
-        '''lists all EXECUTED orders of self.current_account up to count value'''
-        end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders.json'
-        req = self.session.get(api_url, params={'count': 100, 'status': 'EXECUTED'}, timeout=30)
-        req.raise_for_status()
-        return req.json()['OrdersResponse'] if req.content else []
+    @staticmethod
+    def __expiry_date(value):
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    def invalidate_option_chain(self, symbol=None, expiry=None):
+        '''Drop cached chains of symbol (default: every symbol) expiring on expiry (default: every expiry, together with
+        the cached expiry dates)'''
+        if self.option_cache is None:
+            return
+        symbol = symbol.upper() if symbol is not None else None
+        expiry = self.__expiry_date(expiry) if expiry is not None else None
 
-    def list_ticker_orders(self, ticker, count=100):
-        '''lists all orders of TICKER in self.current_account up to count value'''
-        # api_url = self.base_url + "lookup/%s" % search_str
-        end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders.json'
-        req = self.session.get(api_url, params={'count': count, 'symbol':ticker}, timeout=30)
-        req.raise_for_status()
-        return req.json()['OrdersResponse'] if req.content else []
+        def __matches(key):
+            if symbol is not None and key[1] != symbol:
+                return False
+            if key[0] == 'expiry':
+                return expiry is None
+            return expiry is None or key[2] == expiry
+        self.option_cache.invalidate_matching(__matches)
+        return
 
-    def preview_order(self, symbol, order_action, num_shares, price_type='MARKET', limit_price='', stop_price='', market_session='REGULAR', order_term='GOOD_UNTIL_CANCEL', all_or_none=False, preview_id=None, unique_id=None):
+    def option_cache_stats(self):
+        '''Hit, miss and coalesced request counters of the option chain cache'''
+        return self.option_cache.stats() if self.option_cache is not None else {}
+
+    def list_orders(self, count=100, account_id=None):
+        '''lists all orders of self.current_account (or account_id) up to count value (all when None)'''
+        return self.__collect_orders(count, account_id)
+
+    def list_open_orders(self, count=100, account_id=None):
+        '''lists all OPEN orders of self.current_account (or account_id) up to count value (all when None)'''
+        return self.__collect_orders(count, account_id, status='OPEN')
+
+    def __collect_orders(self, count, account_id=None, **filters):
+        '''OrdersResponse-shaped dict of up to count orders (all of them when count is None) gathered across pages,
+        [] when there are none'''
+        orders = list(islice(self.iter_orders(account_id, page_size=count or 100, prefetch=count is None, **filters), count))
+        return {'Order': orders} if orders else []
+
+    def __fetch_open_orders(self, account):
+        return list(self.iter_orders(account_id=account['accountId'], status='OPEN', prefetch=False,
+                                    fields=self.decoder.reader_fields(OpenOrderBook.FIELDS)))
+
+    def __get_order_book(self, account):
+        with self.__order_books_lock:
+            if account['accountIdKey'] not in self.__order_books:
+                self.__order_books[account['accountIdKey']] = OpenOrderBook()
+            return self.__order_books[account['accountIdKey']]
+
+    def __open_order_book(self, account):
+        '''Open order book of an account.  Loaded synchronously the first time, afterwards refreshed in the background
+        once older than open_orders_refresh_sec while the current contents keep being served'''
+        book = self.__get_order_book(account)
+        if book.refreshed_at is None:
+            book.load(self.__fetch_open_orders(account))
+        elif book.is_stale(self.open_orders_refresh_sec) and not book.refreshing:
+            book.refreshing = True
+
+            def __refresh():
+                try:
+                    book.load(self.__fetch_open_orders(account))
+                except Exception as e:
+                    print(f'Background refresh of open orders for account {account.get("accountId")} failed: {e}')
+                finally:
+                    book.refreshing = False
+
+            self.__start_background(__refresh)
+        return book
+
+    def list_executed_orders(self, count=100, account_id=None):
+        '''lists all EXECUTED orders of self.current_account (or account_id) up to count value (all when None)'''
+        return self.__collect_orders(count, account_id, status='EXECUTED')
+
+    def list_ticker_orders(self, ticker, count=100, account_id=None):
+        '''lists all orders of TICKER in self.current_account (or account_id) up to count value (all when None)'''
+        return self.__collect_orders(count, account_id, ticker_symbol=ticker)
+
+    def preview_order(self, symbol, order_action, num_shares, price_type='MARKET', limit_price='', stop_price='', market_session='REGULAR', order_term='GOOD_UNTIL_CANCEL', all_or_none=False, preview_id=None, unique_id=None, account_id=None):
         '''Construct Order on ETRADE before executing'''
+        return self.__preview_order(self.__resolve_account(account_id), symbol, order_action, num_shares, price_type, limit_price, stop_price, market_session, order_term, all_or_none, unique_id)
+
+    def __preview_order(self, account, symbol, order_action, num_shares, price_type='MARKET', limit_price='', stop_price='', market_session='REGULAR', order_term='GOOD_UNTIL_CANCEL', all_or_none=False, unique_id=None):
         end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders/preview.json'
-        instrument = {'Product': {'securityType': 'EQ', 'symbol':symbol},
-                     'orderAction': order_action,
-                     'quantityType': 'QUANTITY',
-                     'quantity': num_shares
-                      }
-        order = {'allOrNone': str(all_or_none).lower(),
-                 'priceType': price_type,
-                 'orderTerm': order_term,
-                 'marketSession': market_session,
-                 'stopPrice': stop_price,
-                 'limitPrice': limit_price,
-                 'Instrument': instrument
-                 }
-        payload = {'PreviewOrderRequest': {'orderType': 'EQ',
-                                           'clientOrderId': unique_id if unique_id is not None else datetime.now().strftime("%Y-%m-%d_%H:%M:%S"),
-                                           'Order': order}}
-        payload = jxmlease.emit_xml(payload)
+        api_url = f'{self.__base_url}/{end_pt}/{account["accountIdKey"]}/orders/preview.json'
+        payload = _preview_order_xml(symbol, order_action, num_shares, price_type, limit_price, stop_price, market_session, order_term, all_or_none, unique_id)
 
         headers = {"Content-Type": "application/xml", "consumerKey": self.consumer_key}
-        req = self.session.post(api_url, header_auth=True, headers=headers, data=payload)
+        req = self.__request('POST', api_url, 'order_preview', header_auth=True, headers=headers, data=payload)
         req.raise_for_status()
         if 'error' in req.text.lower():
             raise ValueError(json.loads(req.text))
-        return req.json()['PreviewOrderResponse'] if req.content else []
+        return self.__decode(req, 'order_preview', default=[])
 
-    def __execute_previewd_order(self, order_obj, unique_id=None):
+    def __execute_previewd_order(self, order_obj, unique_id=None, account=None):
         '''Execute previously previewed order'''
+        account = account if account is not None else self.current_account.account
         end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders/place.json'
+        api_url = f'{self.__base_url}/{end_pt}/{account["accountIdKey"]}/orders/place.json'
 
-        payload = {'PlaceOrderRequest': order_obj}
-        payload['PlaceOrderRequest']['Order'] = payload['PlaceOrderRequest']['Order'][0]
-        payload['PlaceOrderRequest']['clientOrderId'] = unique_id if unique_id is not None else datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-        payload = jxmlease.emit_xml(payload)
+        payload = _place_order_xml(order_obj, unique_id)
 
         headers = {"Content-Type": "application/xml", "consumerKey": self.consumer_key}
-        req = self.session.post(api_url, header_auth=True, headers=headers, data=payload)
+        req = self.__request('POST', api_url, 'order_place', header_auth=True, headers=headers, data=payload)
         req.raise_for_status()
-        req_json = req.json()
-        req = req_json['PlaceOrderResponse']['Order'][0]
-        req['orderId'] = req_json['PlaceOrderResponse']['OrderIds'][0]['orderId']
-        return req
-
-    def __update_account_info(self):
-        self.current_account.update_account_list(self.get_list_of_accounts())
-        self.current_account.set_by_id_key(self.current_account.id_key)
+        return _placed_order(self.__decode(req, 'order_place'))
+
+    def __update_account_info(self, order=None, account=None, reconcile=True):
+        '''Patch the traded account from the order response right away, then reconcile it with the broker in the background.
+        A BUY debits cashAvailable and a SELL debits the held shares of its symbol, so orders placed before the
+        reconcile cannot spend the same cash or shares again'''
+        account = account if account is not None else self.current_account.account
+        if order:
+            instrument = order.get('Instrument', [{}])[0]
+            if instrument.get('orderAction') == 'BUY' and 'estimatedTotalAmount' in order and 'cashAvailable' in account:
+                account['cashAvailable'] = account['cashAvailable'] - float(order['estimatedTotalAmount'])
+            if instrument.get('orderAction') in OpenOrderBook.SELL_ACTIONS and 'sharesBySymbol' in account:
+                # debited from the holdings instead of booked as an open sell, which a background reload of the book
+                # started before this order could drop; the reconcile reloads both together
+                symbol = instrument['Product']['symbol']
+                account['sharesBySymbol'][symbol] = account['sharesBySymbol'].get(symbol, 0) - instrument.get('quantity', 0)
+            else:
+                self.__get_order_book(account).add_placed_order(order)
+        if reconcile:
+            self.__schedule_reconcile(account)
         return
 
-    def __available_shares_by_symbol(self, symbol):
-        open_orders = self.list_open_orders()['Order'] if self.list_open_orders() else []
-        current_holdings = [t['quantity'] for t in self.current_account.positions if t['symbolDescription'] == symbol]
-        current_holdings = sum(current_holdings) if len(current_holdings) > 0 else 0
-        if not open_orders:
-            return current_holdings
-        allocated_shares = [x['OrderDetail'][0]['Instrument'][0]['orderedQuantity'] for x in open_orders if x['OrderDetail'][0]['Instrument'][0]['Product']['symbol'] == symbol]
-        allocated_shares = sum(allocated_shares) if len(allocated_shares) > 0 else 0
-        return current_holdings-allocated_shares
+    def place_orders(self, intents, max_workers=None):
+        '''Preview and place a batch of orders concurrently.  Each intent is a dict with 'symbol', 'action' ('BUY' or
+        'SELL') and 'num_shares' and/or 'dollar_amount' (market buys are priced from one batched quote), plus optional
+        'limit_price' (makes it a LIMIT order), 'account_id' (default: current account) and 'unique_id'.
+
+        Funds and shares are checked against a ReservationLedger seeded once from local account state and debited in
+        intent order before anything is sent, so the batch never over-commits and accounts are not re-fetched between
+        orders.  Funds reserved by orders that then fail are not handed to later intents of the batch.  Every order
+        gets one clientOrderId (its unique_id, or a random one) for both preview and place.  Returns one result dict
+        per intent, in order, with 'intent', 'num_shares', 'order' (the placed order) and 'error' keys; malformed
+        intents only fail their own result'''
+        results = [{'intent': intent, 'num_shares': 0, 'order': None, 'error': None} for intent in intents]
+        accounts = []
+        for result in results:
+            try:
+                accounts.append(self.__validate_intent(result['intent']))
+            except ValueError as e:
+                result['error'] = str(e)
+                accounts.append(None)
+        for account in accounts:
+            if account is not None and 'positions' not in account:
+                self.__hydrate_account(account)
+
+        market_buy_symbols = [r['intent']['symbol'] for r, a in zip(results, accounts)
+                              if a is not None and r['intent']['action'].upper() == 'BUY' and r['intent'].get('limit_price') is None]
+        quotes = self.get_quote(market_buy_symbols) if market_buy_symbols else {}
+
+        ledger = ReservationLedger()
+        for account in {a['accountIdKey']: a for a in accounts if a is not None}.values():
+            book = self.__open_order_book(account)
+            ledger.set_cash(account['accountIdKey'], account.get('cashAvailable') or 0)
+            for symbol, shares in account.get('sharesBySymbol', {}).items():
+                ledger.set_shares(account['accountIdKey'], symbol, shares - book.sell_shares(symbol))
+
+        submissions = []
+        for result, account in zip(results, accounts):
+            if account is None:
+                continue
+            intent = result['intent']
+            action = intent['action'].upper()
+            price = intent.get('limit_price')
+            if action == 'BUY' and price is None:
+                quote = quotes.get(intent['symbol'], {'error': 'No quote requested'})
+                if 'error' in quote:
+                    result['error'] = f'Unable to quote {intent["symbol"]}: {quote["error"]}'
+                    continue
+                price = quote['All']['ask']
+            if action == 'BUY':
+                num_shares = ledger.reserve_cash(account['accountIdKey'], price, intent.get('num_shares'), intent.get('dollar_amount'))
+            else:
+                num_shares = ledger.reserve_shares(account['accountIdKey'], intent['symbol'], intent['num_shares'])
+            if num_shares <= 0:
+                result['error'] = 'Insufficient funds' if action == 'BUY' else f'No existing holdings of: {intent["symbol"]}'
+                continue
+            result['num_shares'] = num_shares
+            submissions.append((result, account, action, _client_order_id(intent.get('unique_id'))))
+
+        def __submit(submission):
+            result, account, action, client_order_id = submission
+            intent = result['intent']
+            price_type = 'LIMIT' if intent.get('limit_price') is not None else 'MARKET'
+            preview = self.__preview_order(account, intent['symbol'], action, result['num_shares'], price_type=price_type,
+                                           limit_price=intent.get('limit_price', ''), unique_id=client_order_id)
+            return self.__execute_previewd_order(preview, client_order_id, account=account)
+
+        for (result, account, _, _), order, error in self.__fan_out(__submit, submissions, max_workers):
+            if error is not None:
+                result['error'] = str(error)
+                continue
+            result['order'] = order
+            self.__update_account_info(order, account=account, reconcile=False)
+
+        for account in {a['accountIdKey']: a for (_, a, _, _) in submissions}.values():
+            self.__schedule_reconcile(account)
+        return results
+
+    def __validate_intent(self, intent):
+        '''Account of a place_orders intent; ValueError if the intent cannot be submitted'''
+        for key in ('symbol', 'action'):
+            if not intent.get(key):
+                raise ValueError(f'Intent is missing {key!r}')
+        action = str(intent['action']).upper()
+        if action not in ('BUY', 'SELL'):
+            raise ValueError(f'Unsupported action: {intent["action"]}')
+        if action == 'SELL' and intent.get('num_shares') is None:
+            raise ValueError('SELL intents need num_shares')
+        if action == 'BUY' and intent.get('num_shares') is None and intent.get('dollar_amount') is None:
+            raise ValueError('BUY intents need num_shares or dollar_amount')
+        return self.__resolve_account(intent.get('account_id'))
+
+    def __schedule_reconcile(self, account):
+        '''Start a background refresh of one account.  Requests made while one is running are coalesced into a single rerun'''
+        id_key = account['accountIdKey']
+        with self.__reconcile_lock:
+            if id_key in self.__reconcile_pending:
+                self.__reconcile_pending[id_key] = True  # run again so the latest order is reflected
+                return
+            self.__reconcile_pending[id_key] = False
+        self.__start_background(self.__reconcile, account)
+        return
 
-    def place_market_buy_order(self, symbol, dollar_amount):
+    def __reconcile(self, account):
+        id_key = account['accountIdKey']
+        while True:
+            try:
+                self.__refresh_holdings(account, open_orders=True)
+            except Exception as e:
+                print(f'Background refresh of account {account.get("accountId")} failed: {e}')
+            with self.__reconcile_lock:
+                if not self.__reconcile_pending[id_key]:
+                    del self.__reconcile_pending[id_key]
+                    return
+                self.__reconcile_pending[id_key] = False
+
+    def __available_shares_by_symbol(self, symbol, account):
+        '''Held shares of symbol not already committed to open sell orders, from the local indexes'''
+        if 'positions' not in account:
+            self.__hydrate_account(account)
+        return account['sharesBySymbol'].get(symbol, 0) - self.__open_order_book(account).sell_shares(symbol)
+
+    def place_market_buy_order(self, symbol, dollar_amount, account_id=None):
         '''Place Market BUY order for ticker with maximum number of shares per given dollar amount'''
-        current_price = self.get_quote(symbol)[0]['All']['ask']
-        funds = self.current_account.cash_available
+        account = self.__resolve_account(account_id)
+        quote = self.get_quote(symbol)[symbol]
+        if 'error' in quote:
+            raise ValueError(f'Unable to quote {symbol}: {quote["error"]}')
+        current_price = quote['All']['ask']
+        funds = self.__cash_available(account)
         num_shares = self.__calc_number_of_shares(current_price, min(dollar_amount, funds))
 
         if num_shares <= 0:
             print(f'Insufficient funds! Security cost: {current_price} > Allocated Funds: {dollar_amount} OR Cash Available: {funds}')
             return []
 
-        response = self.__execute_previewd_order(self.preview_order(symbol, 'BUY', num_shares, price_type='MARKET'))
-        self.__update_account_info()
+        unique_id = _client_order_id()
+        response = self.__execute_previewd_order(self.__preview_order(account, symbol, 'BUY', num_shares, price_type='MARKET', unique_id=unique_id), unique_id, account=account)
+        self.__update_account_info(response, account=account)
         return response
 
-    def place_market_sell_order(self, symbol, num_shares):
+    def place_market_sell_order(self, symbol, num_shares, account_id=None):
         '''Place Market SELL order for ticker with number of shares per given'''
-        num_shares = min(num_shares, self.__available_shares_by_symbol(symbol))
+        account = self.__resolve_account(account_id)
+        num_shares = min(num_shares, self.__available_shares_by_symbol(symbol, account))
 
         if num_shares <= 0:
             print(f'No existing holdings of: {symbol}')
             return []
 
-        req = self.__execute_previewd_order(self.preview_order(symbol, 'SELL', num_shares, price_type='MARKET'))
-        self.__update_account_info()
+        unique_id = _client_order_id()
+        req = self.__execute_previewd_order(self.__preview_order(account, symbol, 'SELL', num_shares, price_type='MARKET', unique_id=unique_id), unique_id, account=account)
+        self.__update_account_info(req, account=account)
         return req
 
-    def place_limit_buy_order(self, symbol, num_shares, price_limit):
+    def place_limit_buy_order(self, symbol, num_shares, price_limit, account_id=None):
         '''Place LIMIT BUY order for ticker with given number of shares'''
-        funds = self.current_account.cash_available
+        account = self.__resolve_account(account_id)
+        funds = self.__cash_available(account)
         expected_num_shares = self.__calc_number_of_shares(price_limit, funds)
         num_shares = min(num_shares, expected_num_shares)
 
@@ -476,35 +3361,65 @@ class Etrader():
             print(f'Insufficient funds for purchase of single product: {symbol} at: ${price_limit}.  Current cash: ${funds}')
             return []
 
-        req = self.__execute_previewd_order(self.preview_order(symbol, 'BUY', num_shares, limit_price=price_limit, price_type='LIMIT'))
-        self.__update_account_info()
+        unique_id = _client_order_id()
+        req = self.__execute_previewd_order(self.__preview_order(account, symbol, 'BUY', num_shares, limit_price=price_limit, price_type='LIMIT', unique_id=unique_id), unique_id, account=account)
+        self.__update_account_info(req, account=account)
         return req
 
-    def place_limit_sell_order(self, symbol, num_shares, price_limit):
+    def place_limit_sell_order(self, symbol, num_shares, price_limit, account_id=None):
         '''Place LIMIT SELL order for ticker with given number of shares'''
-        num_shares = min(num_shares, self.__available_shares_by_symbol(symbol))
+        account = self.__resolve_account(account_id)
+        num_shares = min(num_shares, self.__available_shares_by_symbol(symbol, account))
 
         if num_shares <= 0:
             print(f'No existing holdings of: {symbol}')
             return []
 
-        req = self.__execute_previewd_order(self.preview_order(symbol, 'SELL', num_shares, limit_price=price_limit, price_type='LIMIT'))
-        self.__update_account_info()
+        unique_id = _client_order_id()
+        req = self.__execute_previewd_order(self.__preview_order(account, symbol, 'SELL', num_shares, limit_price=price_limit, price_type='LIMIT', unique_id=unique_id), unique_id, account=account)
+        self.__update_account_info(req, account=account)
         return req
 
-    def cancel_order(self, order_number):
+    def __cash_available(self, account):
+        if 'positions' not in account:
+            self.__hydrate_account(account)
+        return account.get('cashAvailable')
+
+    def cancel_order(self, order_number, account_id=None):
         '''Cancel Executed Order'''
+        account = self.__resolve_account(account_id)
         end_pt = "v1/accounts"
-        api_url = f'{self.__base_url}/{end_pt}/{self.current_account.id_key}/orders/cancel.json'
-        payload = jxmlease.emit_xml({"CancelOrderRequest": {"orderId": order_number}})
+        api_url = f'{self.__base_url}/{end_pt}/{account["accountIdKey"]}/orders/cancel.json'
+        payload = _cancel_order_xml(order_number)
         headers = {"Content-Type": "application/xml", "consumerKey": self.consumer_key}
-        req = self.session.put(api_url, header_auth=True, headers=headers, data=payload)
+        req = self.__request('PUT', api_url, 'order_cancel', header_auth=True, headers=headers, data=payload)
         req.raise_for_status()
-        self.__update_account_info()
-        return req.json()['CancelOrderResponse']
+        self.__get_order_book(account).remove(order_number)
+        self.__update_account_info(account=account)
+        return self.__decode(req, 'order_cancel')
+
+    def watch_order(self, order, callback=None, account_id=None):
+        '''Track a placed order (a place_* result or an order id) until it fills, is cancelled or is rejected, on this
+        client's shared OrderWatcher, started on first use.  Orders of one account share one poll.  Returns a Future
+        of the final order state (see OrderWatcher.state); callback(event, state) also sees partial fills'''
+        account = self.__resolve_account(account_id)
+        order_id = order['orderId'] if isinstance(order, dict) else int(order)
+        placed_at = datetime.fromtimestamp(order['placedTime'] / 1000) if isinstance(order, dict) and order.get('placedTime') else None
+        with self.__watcher_lock:
+            if self.__order_watcher is None:
+                self.__order_watcher = OrderWatcher(self)
+            watcher = self.__order_watcher
+        future = watcher.watch(order_id, account['accountId'], callback, placed_at)
+        watcher.start()
+        return future
+
+    @property
+    def order_watcher(self):
+        '''The shared OrderWatcher, None until watch_order is first called'''
+        return self.__order_watcher
 
     class __CurrentAccount(object):
-        def __init__(self, account_list=None):
+        def __init__(self, account_list=None, hydrate=None):
             self.id = None
             self.id_key = None
             self.description = None
@@ -514,10 +3429,10 @@ class Etrader():
             self.type = None
             self.institution_type = None
             self.closed_date = None
-            self.cash_available = None
-            self.positions = None
-            self.total_account_value = None
+            self.account = None
             self.__account_list = account_list
+            self.__index(account_list)
+            self.__hydrate = hydrate  # loads holdings of a lazily listed account
 
         def __call__(self):
             return self.get()
@@ -529,7 +3444,28 @@ class Etrader():
                     'cash_available': self.cash_available, 'total_account_value': self.total_account_value,
                     'positions': self.positions}
 
+        @property
+        def cash_available(self):
+            return self.__holding('cashAvailable')
+
+        @property
+        def positions(self):
+            return self.__holding('positions')
+
+        @property
+        def total_account_value(self):
+            return self.__holding('totalAccountValue')
+
+        def __holding(self, key):
+            '''Read a holdings field of the current account, hydrating it first if it was listed lazily'''
+            if self.account is None:
+                return None
+            if 'positions' not in self.account and self.__hydrate is not None:
+                self.__hydrate(self.account)
+            return self.account.get(key)
+
         def set(self, account_dict):
+            self.account = account_dict
             self.id = account_dict['accountId'] if 'accountId' in account_dict else None
             self.id_key = account_dict['accountIdKey'] if 'accountIdKey' in account_dict else None
             self.description = account_dict['accountDesc'] if 'accountDesc' in account_dict else None
@@ -539,40 +3475,18 @@ class Etrader():
             self.type = account_dict['accountType'] if 'accountType' in account_dict else None
             self.institution_type = account_dict['institutionType'] if 'institutionType' in account_dict else None
             self.closed_date = account_dict['closedDate'] if 'closedDate' in account_dict else None
-            if 'cashAvailable' in account_dict:
-                self.cash_available = account_dict['cashAvailable']
-            if 'positions' in account_dict:
-                self.positions = account_dict['positions']
-            if 'totalAccountValue' in account_dict:
-                self.total_account_value = account_dict['totalAccountValue']
             return
 
         def set_by_id(self, id):
-            account_dict = None
-            idx = 0
-            for i in range(len(self.__account_list)):
-                if self.__account_list[i]['accountId'] == id:
-                    account_dict = self.__account_list[i]
-                    idx = i
-                    break
-            if account_dict is None:
+            if id not in self.__by_id:
                 raise ValueError(f'Invalid account ID: {id}')
-            else:
-                self.set(self.__account_list[idx])
+            self.set(self.__by_id[id])
             return
 
         def set_by_id_key(self, id_key):
-            account_dict = None
-            idx = 0
-            for i in range(len(self.__account_list)):
-                if self.__account_list[i]['accountIdKey'] == id_key:
-                    account_dict = self.__account_list[i]
-                    idx = i
-                    break
-            if account_dict is None:
+            if id_key not in self.__by_id_key:
                 raise ValueError(f'Invalid account ID Key: {id_key}')
-            else:
-                self.set(self.__account_list[idx])
+            self.set(self.__by_id_key[id_key])
             return
 
         def set_by_index(self, index):
@@ -585,9 +3499,327 @@ class Etrader():
 
         def update_account_list(self, account_list):
             self.__account_list = account_list
+            self.__index(account_list)
+            if self.id_key in self.__by_id_key:  # follow the current account into the refreshed list
+                self.set(self.__by_id_key[self.id_key])
+            return
+
+        def __index(self, account_list):
+            self.__by_id = {account_dict.get('accountId'): account_dict for account_dict in account_list or []}
+            self.__by_id_key = {account_dict.get('accountIdKey'): account_dict for account_dict in account_list or []}
             return
 
     @staticmethod
     def __calc_number_of_shares(price, funds):
         return math.floor(funds/price)
 
+
+class AsyncEtrader(object):
+    '''asyncio counterpart of Etrader.  Signs OAuth1 requests itself over a pooled keep-alive aiohttp connector and
+    reuses the credentials Etrader caches in cache.bin, so an Etrader session must have been authorized first, unless
+    credentials are given as for Etrader'''
+    QUOTE_CHUNK_SIZE = Etrader.QUOTE_CHUNK_SIZE
+
+    def __init__(self, production=False, cache_file=None, max_connections=100, keepalive_timeout_sec=60, json_backend=None,
+                 base_url=None, credentials=None):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('AsyncEtrader requires aiohttp: pip install aiohttp')
+        self.cache_file = cache_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.bin')
+        self.max_connections = max_connections
+        self.keepalive_timeout_sec = keepalive_timeout_sec
+        self.decoder = ResponseDecoder(json_backend)
+        self.__base_url = base_url.rstrip('/') if base_url else r"https://api.etrade.com" if production else r"https://apisb.etrade.com"
+        self.__renew_access_token_url = "%s/oauth/renew_access_token" % (base_url.rstrip('/') if base_url else r"https://api.etrade.com")
+        self.consumer_key = None
+        self.__consumer_secret = None
+        self.__access_token = None
+        self.__access_token_secret = None
+        if credentials is not None:  # consumer_key, consumer_secret, access_token and access_token_secret, see Etrader
+            self.__set_credentials(credentials)
+        else:
+            self.__load_connection_cache()
+        self.http = None
+        self.account_list = []
+        self.__accounts_by_id = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return
+
+    async def open(self, load_accounts=True):
+        '''Open the connection pool and, by default, load and hydrate the account list'''
+        if self.http is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout_sec)
+            self.http = aiohttp.ClientSession(connector=connector, headers={"consumerKey": self.consumer_key})
+        if load_accounts:
+            await self.get_list_of_accounts()
+        return
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+        return
+
+    def __load_connection_cache(self):
+        '''Read access credentials written by Etrader's session cache'''
+        con_data = SessionStore(self.cache_file).read()
+        if con_data is None:
+            raise ValueError(f'No cached session at {self.cache_file}; authorize once with Etrader first')
+        self.__set_credentials(con_data['session'])
+        return
+
+    def __set_credentials(self, credentials):
+        self.consumer_key = credentials['consumer_key']
+        self.__consumer_secret = credentials['consumer_secret']
+        self.__access_token = credentials['access_token']
+        self.__access_token_secret = credentials['access_token_secret']
+        return
+
+    def __oauth_header(self, method, url, params):
+        '''HMAC-SHA1 OAuth1 Authorization header for a request (RFC 5849)'''
+        def __encode(value):
+            return quote(str(value), safe='~')
+
+        oauth_params = {'oauth_consumer_key': self.consumer_key,
+                        'oauth_nonce': uuid.uuid4().hex,
+                        'oauth_signature_method': 'HMAC-SHA1',
+                        'oauth_timestamp': str(int(time.time())),
+                        'oauth_token': self.__access_token,
+                        'oauth_version': '1.0'}
+        url_parts = urlsplit(url)
+        base_url = "%s://%s%s" % (url_parts.scheme.lower(), url_parts.netloc.lower(), url_parts.path)
+        pairs = sorted((__encode(k), __encode(v)) for k, v in list((params or {}).items()) + list(oauth_params.items()))
+        normalized_params = '&'.join('%s=%s' % pair for pair in pairs)
+        base_string = '&'.join([method.upper(), __encode(base_url), __encode(normalized_params)])
+        signing_key = '%s&%s' % (__encode(self.__consumer_secret), __encode(self.__access_token_secret))
+        digest = hmac.new(signing_key.encode(), base_string.encode(), hashlib.sha1).digest()
+        oauth_params['oauth_signature'] = base64.b64encode(digest).decode()
+        return 'OAuth realm="",' + ','.join('%s="%s"' % (k, __encode(v)) for k, v in oauth_params.items())
+
+    async def __request(self, method, url, params=None, data=None, content_type="application/json", raw=False):
+        '''Send a signed request and return the decoded JSON body, or None when the body is empty.  raw=True returns
+        the body undecoded'''
+        if self.http is None:
+            await self.open(load_accounts=False)
+        params = {k: (str(v).lower() if isinstance(v, bool) else str(v)) for k, v in (params or {}).items()}
+        headers = {"Authorization": self.__oauth_header(method, url, params), "Content-Type": content_type}
+        async with self.http.request(method, url, params=params, data=data, headers=headers) as resp:
+            resp.raise_for_status()
+            body = await resp.read()
+        return body if raw else self.decoder.decode(body)
+
+    def __account(self, account_id=None):
+        '''Account dict for account_id, defaulting to the first account; never changes shared state'''
+        if account_id is None:
+            if not self.account_list:
+                raise ValueError('No accounts loaded')
+            return self.account_list[0]
+        try:
+            return self.__accounts_by_id[account_id]
+        except KeyError:
+            raise ValueError(f'Invalid account ID: {account_id}')
+
+    async def renew_accesss_token(self):
+        '''renew_access_token; the endpoint answers in plain text, which is returned'''
+        return (await self.__request('GET', self.__renew_access_token_url, raw=True)).decode()
+
+    async def get_list_of_accounts(self, hydrate=True):
+        '''Get all accounts related to consumer key, fetching every balance and portfolio concurrently'''
+        res = await self.__request('GET', "%s/v1/accounts/list.json" % self.__base_url)
+        self.account_list = res['AccountListResponse']['Accounts']['Account']
+        self.__accounts_by_id = {account['accountId']: account for account in self.account_list}
+        if hydrate:
+            import asyncio
+            await asyncio.gather(*[self.__populate_holdings(account) for account in self.account_list])
+        return self.account_list
+
+    async def __populate_holdings(self, account):
+        import asyncio
+        account_value, positions = await asyncio.gather(self.get_account_balance(account['accountId']),
+                                                        self.get_account_positions(account['accountId']))
+        account['cashAvailable'] = account_value['Computed']['cashAvailableForInvestment']
+        account['positions'] = positions
+        account['totalAccountValue'] = account_value['Computed']['RealTimeValues']['totalAccountValue']
+        return account
+
+    async def get_account_balance(self, account_id=None):
+        '''Get all account balances'''
+        account = self.__account(account_id)
+        api_url = "%s/v1/accounts/%s/balance.json" % (self.__base_url, account['accountIdKey'])
+        payload = {"realTimeNAV": True, "instType": account['institutionType'], "accountType": account['accountType']}
+        return (await self.__request('GET', api_url, params=payload))['BalanceResponse']
+
+    async def get_account_positions(self, account_id=None):
+        '''Get account positions'''
+        api_url = "%s/v1/accounts/%s/portfolio.json" % (self.__base_url, self.__account(account_id)['accountIdKey'])
+        res = await self.__request('GET', api_url)
+        return res['PortfolioResponse']['AccountPortfolio'][0]['Position'] if res else []
+
+    async def get_account_transaction_history(self, account_id=None):
+        '''Get Transaction History'''
+        api_url = "%s/v1/accounts/%s/transactions.json" % (self.__base_url, self.__account(account_id)['accountIdKey'])
+        res = await self.__request('GET', api_url)
+        return res['TransactionListResponse']['Transaction'] if res else []
+
+    async def get_transaction_details(self, transaction_id=None, account_id=None):
+        '''Get Transaction Details'''
+        if transaction_id is None:
+            return []
+        api_url = "%s/v1/accounts/%s/transactions/%s.json" % (self.__base_url, self.__account(account_id)['accountIdKey'], transaction_id)
+        return (await self.__request('GET', api_url))['TransactionDetailsResponse']
+
+    async def get_existing_orders(self, account_id=None):
+        '''Get existing orders in account'''
+        res = await self.list_orders(account_id=account_id)
+        return res['Order'] if res else []
+
+    async def get_quote(self, stock_ticker: list or tuple or str) -> dict:
+        '''Get market quotes keyed by symbol, fetching endpoint-sized chunks concurrently'''
+        if not isinstance(stock_ticker, list) and not isinstance(stock_ticker, tuple):
+            stock_ticker = [stock_ticker]
+        symbols = list(dict.fromkeys(stock_ticker))
+        chunks = [symbols[i:i + self.QUOTE_CHUNK_SIZE] for i in range(0, len(symbols), self.QUOTE_CHUNK_SIZE)]
+        import asyncio
+        responses = await asyncio.gather(*[self.__get_quote_chunk(chunk) for chunk in chunks], return_exceptions=True)
+        quotes = {}
+        for chunk, quote_response in zip(chunks, responses):
+            if isinstance(quote_response, Exception):
+                quotes.update({symbol: {'error': str(quote_response)} for symbol in chunk})
+            else:
+                _merge_quote_response(quotes, chunk, quote_response)
+        return quotes
+
+    async def __get_quote_chunk(self, symbols):
+        api_url = "%s/v1/market/quote/%s.json" % (self.__base_url, ','.join(symbols))
+        res = await self.__request('GET', api_url, params={'overrideSymbolCount': True})
+        return res['QuoteResponse'] if res else {}
+
+    async def __collect_orders(self, count, account_id, params):
+        '''OrdersResponse-shaped dict of up to count orders (all of them when count is None) gathered across pages by
+        following the marker, [] when there are none'''
+        api_url = "%s/v1/accounts/%s/orders.json" % (self.__base_url, self.__account(account_id)['accountIdKey'])
+        orders, marker = [], None
+        while count is None or len(orders) < count:
+            page_params = dict(params, count=min(count or 100, 100))
+            if marker is not None:
+                page_params['marker'] = marker
+            res = await self.__request('GET', api_url, params=page_params)
+            page = res['OrdersResponse'] if res else {}
+            orders.extend(page.get('Order', []))
+            marker = page.get('marker') or None
+            if not page.get('Order') or marker is None:
+                break
+        orders = orders[:count] if count is not None else orders
+        return {'Order': orders} if orders else []
+
+    async def list_orders(self, count=100, account_id=None):
+        '''lists all orders of the account up to count value (all when None)'''
+        return await self.__collect_orders(count, account_id, {})
+
+    async def list_open_orders(self, count=100, account_id=None):
+        '''lists all OPEN orders of the account up to count value (all when None)'''
+        return await self.__collect_orders(count, account_id, {'status': 'OPEN'})
+
+    async def list_executed_orders(self, count=100, account_id=None):
+        '''lists all EXECUTED orders of the account up to count value (all when None)'''
+        return await self.__collect_orders(count, account_id, {'status': 'EXECUTED'})
+
+    async def list_ticker_orders(self, ticker, count=100, account_id=None):
+        '''lists all orders of TICKER in the account up to count value (all when None)'''
+        return await self.__collect_orders(count, account_id, {'symbol': ticker})
+
+    async def preview_order(self, symbol, order_action, num_shares, price_type='MARKET', limit_price='', stop_price='', market_session='REGULAR', order_term='GOOD_UNTIL_CANCEL', all_or_none=False, unique_id=None, account_id=None):
+        '''Construct Order on ETRADE before executing'''
+        api_url = "%s/v1/accounts/%s/orders/preview.json" % (self.__base_url, self.__account(account_id)['accountIdKey'])
+        payload = _preview_order_xml(symbol, order_action, num_shares, price_type, limit_price, stop_price, market_session, order_term, all_or_none, unique_id)
+        res = await self.__request('POST', api_url, data=payload, content_type="application/xml")
+        if res and 'Error' in res:
+            raise ValueError(res)
+        return res['PreviewOrderResponse'] if res else []
+
+    async def __execute_previewed_order(self, order_obj, unique_id=None, account_id=None):
+        api_url = "%s/v1/accounts/%s/orders/place.json" % (self.__base_url, self.__account(account_id)['accountIdKey'])
+        res = await self.__request('POST', api_url, data=_place_order_xml(order_obj, unique_id), content_type="application/xml")
+        return _placed_order(res)
+
+    async def __refresh_account(self, account_id=None):
+        await self.__populate_holdings(self.__account(account_id))
+        return
+
+    async def __available_shares_by_symbol(self, symbol, account_id=None):
+        import asyncio
+        positions, open_orders = await asyncio.gather(self.get_account_positions(account_id), self.list_open_orders(account_id=account_id))
+        open_orders = open_orders['Order'] if open_orders else []
+        held = sum(t['quantity'] for t in positions if t['symbolDescription'] == symbol)
+        allocated = sum(x['OrderDetail'][0]['Instrument'][0]['orderedQuantity'] for x in open_orders if x['OrderDetail'][0]['Instrument'][0]['Product']['symbol'] == symbol)
+        return held - allocated
+
+    async def place_market_buy_order(self, symbol, dollar_amount, account_id=None):
+        '''Place Market BUY order for ticker with maximum number of shares per given dollar amount'''
+        quote = (await self.get_quote(symbol))[symbol]
+        if 'error' in quote:
+            raise ValueError(f'Unable to quote {symbol}: {quote["error"]}')
+        current_price = quote['All']['ask']
+        funds = self.__account(account_id)['cashAvailable']
+        num_shares = math.floor(min(dollar_amount, funds) / current_price)
+        if num_shares <= 0:
+            print(f'Insufficient funds! Security cost: {current_price} > Allocated Funds: {dollar_amount} OR Cash Available: {funds}')
+            return []
+        unique_id = _client_order_id()
+        preview = await self.preview_order(symbol, 'BUY', num_shares, price_type='MARKET', unique_id=unique_id, account_id=account_id)
+        response = await self.__execute_previewed_order(preview, unique_id, account_id=account_id)
+        await self.__refresh_account(account_id)
+        return response
+
+    async def place_market_sell_order(self, symbol, num_shares, account_id=None):
+        '''Place Market SELL order for ticker with number of shares per given'''
+        num_shares = min(num_shares, await self.__available_shares_by_symbol(symbol, account_id))
+        if num_shares <= 0:
+            print(f'No existing holdings of: {symbol}')
+            return []
+        unique_id = _client_order_id()
+        preview = await self.preview_order(symbol, 'SELL', num_shares, price_type='MARKET', unique_id=unique_id, account_id=account_id)
+        response = await self.__execute_previewed_order(preview, unique_id, account_id=account_id)
+        await self.__refresh_account(account_id)
+        return response
+
+    async def place_limit_buy_order(self, symbol, num_shares, price_limit, account_id=None):
+        '''Place LIMIT BUY order for ticker with given number of shares'''
+        funds = self.__account(account_id)['cashAvailable']
+        num_shares = min(num_shares, math.floor(funds / price_limit))
+        if num_shares <= 0:
+            print(f'Insufficient funds for purchase of single product: {symbol} at: ${price_limit}.  Current cash: ${funds}')
+            return []
+        unique_id = _client_order_id()
+        preview = await self.preview_order(symbol, 'BUY', num_shares, limit_price=price_limit, price_type='LIMIT', unique_id=unique_id, account_id=account_id)
+        response = await self.__execute_previewed_order(preview, unique_id, account_id=account_id)
+        await self.__refresh_account(account_id)
+        return response
+
+    async def place_limit_sell_order(self, symbol, num_shares, price_limit, account_id=None):
+        '''Place LIMIT SELL order for ticker with given number of shares'''
+        num_shares = min(num_shares, await self.__available_shares_by_symbol(symbol, account_id))
+        if num_shares <= 0:
+            print(f'No existing holdings of: {symbol}')
+            return []
+        unique_id = _client_order_id()
+        preview = await self.preview_order(symbol, 'SELL', num_shares, limit_price=price_limit, price_type='LIMIT', unique_id=unique_id, account_id=account_id)
+        response = await self.__execute_previewed_order(preview, unique_id, account_id=account_id)
+        await self.__refresh_account(account_id)
+        return response
+
+    async def cancel_order(self, order_number, account_id=None):
+        '''Cancel Executed Order'''
+        api_url = "%s/v1/accounts/%s/orders/cancel.json" % (self.__base_url, self.__account(account_id)['accountIdKey'])
+        payload = _cancel_order_xml(order_number)
+        res = await self.__request('PUT', api_url, data=payload, content_type="application/xml")
+        await self.__refresh_account(account_id)
+        return res['CancelOrderResponse']
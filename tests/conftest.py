@@ -0,0 +1,40 @@
+'''Fixtures shared by the tests: a StubServer (benchmarks/stub_server.py) on a free port and Etrader clients pointed
+at it with token credentials, so no test needs network access or a browser login'''
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+import etrader
+from stub_server import StubServer
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as stub:
+        yield stub
+
+
+@pytest.fixture
+def make_client(stub, tmp_path):
+    '''Etrader factory; clients are closed at teardown.  The rate limiter is off unless rate_limits is given'''
+    clients = []
+
+    def __make_client(**kwargs):
+        kwargs.setdefault('rate_limits', None)
+        kwargs.setdefault('cache_file', str(tmp_path / 'cache.bin'))
+        client = etrader.Etrader(base_url=stub.url, credentials=stub.credentials, defer_connect=True, **kwargs)
+        clients.append(client)
+        return client
+
+    yield __make_client
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
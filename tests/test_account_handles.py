@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from etrader import AccountHandle
+
+
+def test_account_handles_look_up_accounts(stub, client):
+    handles = client.accounts
+    assert [handle.id for handle in handles] == [str(10000 + i) for i in range(stub.accounts)]
+    assert [handle.id_key for handle in handles] == [f'k{i}' for i in range(stub.accounts)]
+    assert client.account(account_id='10002') is handles[2]
+    assert client.account(id_key='k2') is handles[2]
+    assert client.account() == client.account(id_key=client.current_account.id_key)
+    assert len(set(handles + client.accounts)) == stub.accounts
+    with pytest.raises(ValueError):
+        client.account(account_id='99999')
+    with pytest.raises(ValueError):
+        client.account(id_key='nope')
+
+
+def test_account_handles_are_immutable(client):
+    handle = client.accounts[1]
+    with pytest.raises(AttributeError):
+        handle.id = '1'
+    with pytest.raises(AttributeError):
+        del handle.id_key
+    assert repr(handle) == f'AccountHandle(id={handle.id!r}, name={handle.name!r})'
+    assert handle != AccountHandle(None, handle.account)  # another client's handle
+
+
+def test_account_handle_reads_its_own_account(stub, client):
+    handle = client.accounts[1]
+    assert handle.account is client.account_list[1]
+    assert handle.get()['positions'] is handle.positions
+    assert len(handle.positions) == stub.positions == len(handle.get_positions())
+    assert handle.cash_available == handle.get_balance()['Computed']['cashAvailableForInvestment']
+    assert handle.total_account_value is not None
+    assert all(order['orderId'] for order in handle.list_executed_orders(count=5)['Order'])
+
+
+def test_account_handles_trade_their_own_accounts(stub, make_client):
+    stub.orders = 0
+    client = make_client()
+    current = client.current_account.id_key
+    handles = client.accounts
+    with ThreadPoolExecutor(len(handles)) as pool:
+        placed = list(pool.map(lambda handle: handle.place_limit_buy_order('SYM1', 1, 10.0), handles))
+    assert client.current_account.id_key == current  # handles never switch the client's current account
+    for handle, order in zip(handles, placed):
+        assert [o['orderId'] for o in handle.list_open_orders()['Order']] == [order['orderId']]
+    handles[0].cancel_order(placed[0]['orderId'])
+    assert handles[0].list_open_orders() == []
+    assert len(handles[1].list_open_orders()['Order']) == 1
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_accounts_are_hydrated_concurrently(stub, make_client):
+    stub.accounts, stub.latency_sec = 6, 0.1
+    client = make_client()
+    start = time.monotonic()
+    accounts = client.account_list
+    assert time.monotonic() - start < 0.1 * 6  # list, then every balance and portfolio at once
+    assert all(len(a['positions']) == stub.positions and 'cashAvailable' in a for a in accounts)
+    assert stub.requests == 1 + 2 * 6
+
+
+def test_lazy_accounts_hydrate_once_per_account(stub, make_client):
+    stub.accounts, stub.latency_sec = 4, 0.05
+    client = make_client(lazy_accounts=True)
+    handles = client.accounts
+    before = stub.requests
+    assert before == 1  # only the account list
+    with ThreadPoolExecutor(8) as pool:
+        positions = list(pool.map(lambda handle: handle.positions, handles + handles))
+    assert all(len(p) == stub.positions for p in positions)
+    assert stub.requests == before + 2 * len(handles)  # one balance and one portfolio request per account
+
+
+def test_relisting_accounts_keeps_their_dicts(client):
+    account = client.account_list[0]
+    account['marker'] = True
+    client.get_list_of_accounts()
+    assert client.account_list[0] is account and account['marker']
+
+
+def test_buy_debits_cash_until_reconciled(client, monkeypatch):
+    monkeypatch.setattr(client, '_Etrader__schedule_reconcile', lambda account: None)  # keep the optimistic patch in place
+    account = client.account_list[0]
+    cash = account['cashAvailable']
+    order = client.place_limit_buy_order('SYM1', 10, 25.0)
+    assert account['cashAvailable'] == cash - order['estimatedTotalAmount'] == cash - 250.0
+
+
+def test_sell_debits_held_shares(client, monkeypatch):
+    monkeypatch.setattr(client, '_Etrader__schedule_reconcile', lambda account: None)
+    account = client.account_list[0]
+    held = account['sharesBySymbol']['SYM0']
+    first = client.place_orders([{'symbol': 'SYM0', 'action': 'SELL', 'num_shares': held - 4, 'limit_price': 10.0}])[0]
+    assert first['error'] is None
+    assert account['sharesBySymbol']['SYM0'] == 4
+    second = client.place_orders([{'symbol': 'SYM0', 'action': 'SELL', 'num_shares': held, 'limit_price': 10.0}])[0]
+    assert second['num_shares'] == 4
+    third = client.place_orders([{'symbol': 'SYM0', 'action': 'SELL', 'num_shares': 1, 'limit_price': 10.0}])[0]
+    assert third['error'] == 'No existing holdings of: SYM0'
+
+
+def test_order_reconciles_only_the_traded_account(stub, client):
+    stub.accounts = 3
+    account = client.account_list[0]
+    cash = account['cashAvailable']
+    before = stub.requests
+    client.place_limit_buy_order('SYM1', 10, 25.0)
+    deadline = time.monotonic() + 5
+    while account['cashAvailable'] != cash and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert account['cashAvailable'] == cash  # reloaded from the broker
+    time.sleep(0.1)
+    assert stub.requests == before + 2 + 3  # preview and place, then balance, portfolio and open orders of one account
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from etrader import AsyncEtrader, SessionStore
+
+
+def run(stub, coroutine_function, **kwargs):
+    '''Run coroutine_function(client) on a fresh event loop with an AsyncEtrader pointed at the stub'''
+    async def __main():
+        async with AsyncEtrader(base_url=stub.url, credentials=stub.credentials, **kwargs) as client:
+            return await coroutine_function(client)
+    return asyncio.run(__main())
+
+
+def test_async_client_hydrates_accounts_concurrently(stub):
+    stub.accounts, stub.latency_sec = 4, 0.1
+
+    async def __accounts(client):
+        return client.account_list
+
+    accounts = run(stub, __accounts)
+    assert [a['accountId'] for a in accounts] == ['10000', '10001', '10002', '10003']
+    assert all(len(a['positions']) == stub.positions and a['cashAvailable'] > 0 for a in accounts)
+    assert stub.requests == 1 + 2 * 4
+
+
+def test_async_client_quotes_in_chunks(stub):
+    symbols = [stub.symbol(i) for i in range(120)] + ['BAD1']
+
+    async def __quotes(client):
+        return await client.get_quote(symbols)
+
+    quotes = run(stub, __quotes, max_connections=4)
+    assert list(quotes) == symbols
+    assert all('All' in quotes[symbol] for symbol in symbols[:-1])
+    assert 'error' in quotes['BAD1']
+
+
+def test_async_client_reports_failed_chunks(stub):
+    async def __quotes(client):
+        stub.failure_rate = 1.0
+        return await client.get_quote(['SYM1', 'SYM2'])
+
+    quotes = run(stub, __quotes)
+    assert all('500' in quote['error'] for quote in quotes.values())
+
+
+def test_async_client_places_and_cancels_orders(stub):
+    async def __trade(client):
+        order = await client.place_limit_buy_order('SYM1', 2, 10.0)
+        open_orders = (await client.list_open_orders())['Order']
+        cancelled = await client.cancel_order(order['orderId'])
+        still_open = await client.list_open_orders()
+        return order, open_orders, cancelled, still_open
+
+    order, open_orders, cancelled, still_open = run(stub, __trade)
+    assert open_orders[0]['orderId'] == order['orderId']
+    assert cancelled['orderId'] == order['orderId']
+    assert order['orderId'] not in [o['orderId'] for o in (still_open or {}).get('Order', [])]
+
+
+def test_async_client_limits_sells_to_held_shares(stub):
+    async def __sell(client):
+        held = {p['symbolDescription']: p['quantity'] for p in client.account_list[0]['positions']}
+        order = await client.place_limit_sell_order('SYM0', held['SYM0'] + 50, 10.0)
+        return held['SYM0'], order, await client.place_limit_sell_order('NOTHELD', 1, 10.0)
+
+    held, order, nothing = run(stub, __sell)
+    assert order['Instrument'][0]['quantity'] == held
+    assert nothing == []
+
+
+def test_async_client_renews_token(stub):
+    async def __renew(client):
+        return await client.renew_accesss_token()
+
+    assert run(stub, __renew) == 'Access Token has been renewed'
+
+
+def test_async_client_reads_cached_session(stub, tmp_path):
+    cache_file = str(tmp_path / 'cache.bin')
+    with pytest.raises(ValueError):
+        AsyncEtrader(cache_file=cache_file)
+    SessionStore(cache_file).write({'session': stub.credentials})
+    assert AsyncEtrader(cache_file=cache_file, base_url=stub.url).consumer_key == stub.credentials['consumer_key']
+
+
+def test_async_list_orders_follows_markers(stub):
+    stub.orders = 250
+
+    async def __lists(client):
+        return [await client.list_orders(count=None), await client.list_orders(count=120), await client.list_orders(),
+                await client.list_open_orders(count=None), await client.list_executed_orders(count=None),
+                await client.list_ticker_orders('SYM5', count=None)]
+
+    everything, some, default, open_orders, executed, ticker = run(stub, __lists)
+    assert len(everything['Order']) == 250 and len({o['orderId'] for o in everything['Order']}) == 250
+    assert (len(some['Order']), len(default['Order']), len(open_orders['Order']), len(executed['Order'])) == (120, 100, 50, 100)
+    assert {o['OrderDetail'][0]['Instrument'][0]['Product']['symbol'] for o in ticker['Order']} == {'SYM5'}
+    stub.orders = 0
+    assert run(stub, lambda client: client.list_orders(count=None)) == []
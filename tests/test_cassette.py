@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from etrader import Cassette, ReplaySession
+
+
+def test_cassette_records_and_replays(stub, make_client, tmp_path):
+    path = str(tmp_path / 'session.cassette')
+    recorder = make_client(record_to=path)
+    quotes = recorder.get_quote(['SYM1', 'SYM2'])
+    placed = recorder.place_limit_buy_order('SYM1', 1, 10.0)
+    recorder.close()
+
+    stub.stop()  # replay needs no server
+    replayer = make_client(replay_from=path)
+    assert replayer.get_quote(['SYM1', 'SYM2']) == quotes
+    assert replayer.place_limit_buy_order('SYM1', 1, 10.0)['orderId'] == placed['orderId']  # matched despite a new clientOrderId
+    assert replayer.get_quote(['SYM1', 'SYM2']) == quotes  # used up: the last response is repeated
+    assert 'No recorded response' in replayer.get_quote('SYM3')['SYM3']['error']
+
+
+def test_cassette_holds_background_refreshes(stub, make_client, tmp_path, capsys):
+    path = str(tmp_path / 'session.cassette')
+    recorder = make_client(record_to=path)
+    recorder.get_quote('SYM1')  # connect first, so only the order and its reconcile are slowed down
+    stub.latency_sec = 0.1
+    recorder.place_limit_buy_order('SYM1', 1, 10.0)  # reconciles the account in the background
+    recorder.close()  # waits for the reconcile before saving
+    saved = Cassette.load(path).interactions
+    assert len(saved) == len(recorder.cassette.interactions)
+    assert any(i['url'].endswith('/orders.json') and i['params'].get('status') == 'OPEN' for i in saved)
+
+    stub.stop()
+    replayer = make_client(replay_from=Cassette.load(path, strict=True))
+    replayer.get_quote('SYM1')
+    replayer.place_limit_buy_order('SYM1', 1, 10.0)
+    replayer.close()
+    assert 'No recorded response' not in capsys.readouterr().out
+
+
+def test_strict_cassette_raises_once_used_up(stub, make_client, tmp_path):
+    path = str(tmp_path / 'session.cassette')
+    recorder = make_client(record_to=path)
+    recorder.get_quote('SYM1')
+    recorder.close()
+    replayer = make_client(replay_from=Cassette.load(path, strict=True))
+    assert 'All' in replayer.get_quote('SYM1')['SYM1']
+    assert 'No recorded response' in replayer.get_quote('SYM1')['SYM1']['error']
+
+
+def test_cassette_save_needs_a_path(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette().save()
+    cassette = Cassette()
+    cassette.save(str(tmp_path / 'empty.cassette'))
+    assert Cassette.load(str(tmp_path / 'empty.cassette')).interactions == []
+
+
+def interaction(url, offset_sec, elapsed_sec=0.0):
+    return {'method': 'GET', 'url': url, 'params': {}, 'body': b'', 'status': 200, 'headers': {}, 'content': b'{}',
+            'elapsed_sec': elapsed_sec, 'offset_sec': offset_sec}
+
+
+@pytest.mark.parametrize('speed, expected_sec', [(1.0, 0.4), (2.0, 0.2), (None, 0.0)])
+def test_replay_is_paced_by_recorded_offsets(speed, expected_sec):
+    cassette = Cassette()
+    cassette.interactions = [interaction('http://stub/a', 10.0), interaction('http://stub/b', 10.4)]
+    session = ReplaySession(cassette, speed)
+    start = time.monotonic()
+    session.request('GET', 'http://stub/a')
+    session.request('GET', 'http://stub/b')
+    assert expected_sec <= time.monotonic() - start < expected_sec + 0.15
@@ -0,0 +1,49 @@
+import pytest
+
+from etrader import OpenOrderBook, ResponseDecoder
+
+
+def test_response_decoder_projects_fields():
+    content = b'{"R": {"Order": [{"orderId": 1, "OrderDetail": [{"status": "OPEN", "placedTime": 5}], "extra": 1}, {"orderId": 2}]}}'
+    decoder = ResponseDecoder('json')
+    fields = {'orderId': None, 'OrderDetail': ('status',)}
+    assert decoder.decode(content, ('R', 'Order'), fields) == [{'orderId': 1, 'OrderDetail': [{'status': 'OPEN'}]}, {'orderId': 2}]
+    assert decoder.decode(content, ('R', 'Order', 1)) == {'orderId': 2}
+    assert decoder.decode(b'', ('R',), fields, default=[]) == []
+    assert ResponseDecoder.normalize(fields) == {'orderId': None, 'OrderDetail': {'status': None}}
+    with pytest.raises(ValueError):
+        ResponseDecoder('no-such-json-module')
+
+
+@pytest.mark.parametrize('backend', ResponseDecoder.BACKENDS)
+def test_response_decoder_backends_agree(backend):
+    pytest.importorskip(backend)
+    content = b'{"R": [{"a": 1, "b": {"c": [1, 2], "d": null}}, {"a": 2.5}]}'
+    decoder = ResponseDecoder(backend)
+    assert decoder.backend == backend
+    assert decoder.decode(content, ('R',)) == [{'a': 1, 'b': {'c': [1, 2], 'd': None}}, {'a': 2.5}]
+    assert decoder.decode(content, ('R',), {'b': ('c',)}) == [{'b': {'c': [1, 2]}}, {}]
+
+
+@pytest.mark.parametrize('backend', ResponseDecoder.BACKENDS)
+def test_reader_fields_project_only_with_simdjson(backend):
+    pytest.importorskip(backend)
+    decoder = ResponseDecoder(backend)
+    expected = OpenOrderBook.FIELDS if backend == 'simdjson' else ResponseDecoder.WHOLE
+    assert decoder.reader_fields(OpenOrderBook.FIELDS) is expected
+
+
+def test_client_response_fields(make_client):
+    client = make_client(response_fields={'portfolio': ('symbolDescription', 'quantity')})
+    positions = client.get_account_positions()
+    assert positions and all(set(p) == {'symbolDescription', 'quantity'} for p in positions)
+
+
+def test_internal_reads_skip_projection_without_simdjson(stub, make_client, monkeypatch):
+    stub.orders = 10
+    client = make_client(json_backend='json', response_fields={'orders_list': ('orderId',)})
+    projected = []
+    monkeypatch.setattr(ResponseDecoder, 'project', classmethod(lambda cls, node, fields: projected.append(fields)))
+    orders = client._Etrader__fetch_open_orders(client.account_list[0])
+    assert orders and all('orderType' in order and 'OrderDetail' in order for order in orders)
+    assert projected == []
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from etrader import HistoryStore
+
+
+def test_sync_transaction_history_downloads_only_new_transactions(stub, client, tmp_path):
+    stub.transactions = 120
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    try:
+        assert client.sync_transaction_history(store, details=False) == 120
+        assert len(store.transactions_missing_details(client.current_account.id)) == 120
+        assert client.sync_transaction_history(store) == 0
+        assert store.transactions_missing_details(client.current_account.id) == []
+        transactions = store.transactions(account_id=client.current_account.id)
+        assert len(transactions) == 120
+        assert [t['transactionDate'] for t in transactions] == sorted((t['transactionDate'] for t in transactions), reverse=True)
+        assert all('details' in t for t in transactions)
+        assert store.latest_transaction_date(client.current_account.id) == transactions[0]['transactionDate']
+        symbol = client.transaction_symbol(transactions[0])
+        assert {client.transaction_symbol(t) for t in store.transactions(symbol=symbol)} == {symbol}
+        bought = store.transactions(transaction_type='Bought', end=datetime.fromtimestamp(transactions[0]['transactionDate'] / 1000))
+        assert bought and all(t['transactionType'] == 'Bought' for t in bought)
+    finally:
+        store.close()
+
+
+def test_sync_order_history_keeps_status_changes(stub, client, tmp_path):
+    stub.orders = 30
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    try:
+        assert client.sync_order_history(store) == 30
+        order = client.place_limit_buy_order('SYM1', 1, 10.0)
+        assert client.sync_order_history(store) == 31
+        assert store.orders(status='OPEN')[0]['orderId'] == order['orderId']
+        open_placed = [o['OrderDetail'][0]['placedTime'] for o in store.orders(status='OPEN')]
+        assert store.order_sync_start(client.current_account.id) == min(open_placed)  # still open orders are re-read
+        client.cancel_order(order['orderId'])
+        client.sync_order_history(store)
+        assert store.orders(status='OPEN')[0]['orderId'] != order['orderId']
+        assert store.orders(symbol='SYM1', status='CANCELLED')[0]['orderId'] == order['orderId']
+        assert len(store.orders(account_id=client.current_account.id)) == 31
+    finally:
+        store.close()
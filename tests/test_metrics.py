@@ -0,0 +1,75 @@
+import json
+
+from etrader import RateLimiter, RequestMetrics
+
+
+def test_request_metrics_histogram_and_quantiles():
+    metrics = RequestMetrics(latency_buckets_sec=(1.0, 0.1))
+    for round_trips in ([0.05], [0.05, 0.5], [2.0]):
+        sample = RequestMetrics.begin('quote', 'GET')
+        sample.update(attempts=len(round_trips), status=200, round_trips=round_trips, latency_sec=sum(round_trips))
+        metrics.finish(sample)
+    failed = RequestMetrics.begin('quote', 'GET')
+    metrics.finish(failed, ConnectionError('reset'))
+    stats = metrics.snapshot()['quote']
+    assert metrics.latency_buckets_sec == (0.1, 1.0)
+    assert (stats['requests'], stats['errors'], stats['retries'], stats['round_trips']) == (4, 1, 1, 4)
+    assert stats['latency_buckets'] == {0.1: 2, 1.0: 3, '+Inf': 4}
+    assert stats['latency_p50_sec'] == 0.1
+    assert stats['latency_p99_sec'] == stats['latency_max_sec'] == 2.0
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_request_metrics_hooks(client, capsys):
+    client.metrics = RequestMetrics()
+    samples = []
+    client.metrics.add_hook(samples.append)
+    client.metrics.add_hook(lambda sample: 1 / 0)
+    client.get_quote(['SYM1'])
+    assert 'Request metrics hook' in capsys.readouterr().out
+    quotes = [sample for sample in samples if sample['endpoint'] == 'quote']
+    assert len(quotes) == 1
+    assert quotes[0]['method'] == 'GET' and quotes[0]['status'] == 200 and quotes[0]['attempts'] == 1
+    assert quotes[0]['bytes_received'] > 0 and quotes[0]['latency_sec'] <= quotes[0]['total_sec']
+    client.metrics.remove_hook(samples.append)
+    client.get_quote(['SYM2'])
+    assert [sample for sample in samples if sample['endpoint'] == 'quote'] == quotes
+
+
+def test_client_metrics_count_bytes_and_errors(stub, make_client):
+    client = make_client(metrics=True)
+    client.get_quote(['SYM1'])
+    client.place_limit_buy_order('SYM1', 1, 10.0)
+    snapshot = client.metrics.snapshot()
+    assert snapshot['quote']['requests'] == snapshot['quote']['round_trips'] == 1
+    assert snapshot['quote']['errors'] == 0 and snapshot['quote']['bytes_sent'] == 0
+    assert snapshot['order_preview']['bytes_sent'] > 0 and snapshot['order_place']['bytes_sent'] > 0
+    client.metrics.reset()
+    stub.failure_rate = 1.0
+    client.get_quote(['SYM2'])
+    assert client.metrics.snapshot()['quote']['errors'] == 1
+
+
+def test_client_metrics_count_retries(stub, make_client):
+    client = make_client(metrics=True, rate_limits=RateLimiter.DEFAULT_LIMITS)
+    client.rate_limiter = RateLimiter(RateLimiter.DEFAULT_LIMITS, backoff_base_sec=0.01)
+    client.get_quote(['SYM1'])  # connect before the stub starts throttling
+    client.metrics.reset()
+    stub.throttle_rate = 1.0
+    client.get_quote(['SYM2'])
+    stats = client.metrics.snapshot()['quote']
+    assert (stats['requests'], stats['retries'], stats['errors'], stats['round_trips']) == (1, client.max_retries, 1, client.max_retries + 1)
+
+
+def test_request_metrics_export(client):
+    client.metrics = RequestMetrics()
+    client.get_quote(['SYM1'])
+    snapshot = json.loads(client.metrics.to_json())
+    assert snapshot['quote']['requests'] == 1 and snapshot['quote']['latency_buckets']['+Inf'] == 1
+    text = client.metrics.to_prometheus(prefix='et')
+    assert text.endswith('\n')
+    assert '# TYPE et_requests_total counter' in text
+    assert 'et_requests_total{endpoint="quote"} 1' in text
+    assert 'et_request_duration_seconds_bucket{endpoint="quote",le="+Inf"} 1' in text
+    assert 'et_request_duration_seconds_count{endpoint="quote"} 1' in text
@@ -0,0 +1,72 @@
+import math
+import time
+from datetime import date
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from etrader import OptionChain
+
+
+def test_option_chain(stub, client):
+    stub.expiries = 3
+    chain = client.get_option_chain('sym1', no_of_strikes=6)
+    assert chain.underlying == 'SYM1' and len(chain.expiries) == 3 and chain.missing == []
+    assert len(chain) == 3 * 6 * 2
+    assert chain.expiries == sorted(chain.expiries)
+    single = chain.for_expiry(chain.expiries[1])
+    assert len(single) == 12 and single.expiries == [chain.expiries[1]]
+    assert list(single.is_call) == [True] * 6 + [False] * 6
+    assert np.all(np.diff(single.strike[:6]) > 0) and np.all(np.diff(single.strike[6:]) > 0)
+    assert np.all(single.delta[:6] == 0.5) and np.all(single.delta[6:] == -0.5)
+    assert single.near_prices[chain.expiries[1]] == chain.near_prices[chain.expiries[1]]
+    contract = single.row(single.symbols[0])
+    assert contract['is_call'] and contract['iv'] == 0.3 and contract['expiry'] == chain.expiries[1]
+    assert chain.to_structured()['symbol'][0] == chain.symbols[0]
+
+
+def test_option_chain_fetches_expiries_concurrently(stub, client):
+    stub.expiries = 6
+    client.get_option_expiry_dates('SYM1')
+    stub.latency_sec = 0.1
+    start = time.monotonic()
+    chain = client.get_option_chain('SYM1', no_of_strikes=2)
+    assert len(chain.expiries) == 6
+    assert time.monotonic() - start < 0.1 * 6
+
+
+def test_option_chain_lists_failed_expiries(stub, client):
+    stub.expiries = 2
+    expiries = client.get_option_expiry_dates('SYM1')
+    stub.failure_rate = 1.0
+    chain = client.get_option_chain('SYM1', expiries=[expiries[0].isoformat()], max_age_sec=0)
+    assert len(chain) == 0 and chain.missing == [expiries[0]]
+
+
+def test_option_chain_from_response_sorts_contracts():
+    response = {'nearPrice': 10.0, 'OptionPair': [
+        {'Call': {'strikePrice': 12.0, 'osiKey': 'C12', 'bid': 1.0, 'inTheMoney': 'n'}, 'Put': {'strikePrice': 12.0, 'osiKey': 'P12'}},
+        {'Call': {'strikePrice': 8.0, 'osiKey': 'C8', 'bid': '', 'inTheMoney': 'y', 'OptionGreeks': {'delta': 0.9}}}]}
+    chain = OptionChain.from_response('AAA', date(2030, 1, 18), response)
+    assert chain.symbols == ['C8', 'C12', 'P12']
+    assert list(chain.in_the_money) == [True, False, False]
+    assert math.isnan(chain.bid[0]) and chain.delta[0] == 0.9 and math.isnan(chain.delta[1])
+    assert len(OptionChain.concat('AAA', [])) == 0
+
+
+def test_client_option_cache_invalidation(stub, make_client):
+    stub.expiries = 3
+    client = make_client()
+    chain = client.get_option_chain('SYM1', no_of_strikes=4)
+    before = stub.requests
+    client.get_option_chain('SYM1', no_of_strikes=4)
+    assert stub.requests == before
+    client.invalidate_option_chain('SYM1', expiry=chain.expiries[0])
+    client.get_option_chain('SYM1', no_of_strikes=4)
+    assert stub.requests == before + 1  # only the invalidated expiry is fetched again
+    client.invalidate_option_chain()
+    client.get_option_chain('SYM1', no_of_strikes=4)
+    assert stub.requests == before + 1 + 1 + 3  # expiry dates and every chain
+    with pytest.raises(ValueError):
+        client.invalidate_option_chain('SYM1', expiry='not a date')
@@ -0,0 +1,48 @@
+from etrader import OrderWatcher
+
+
+def test_order_watcher_reports_partial_then_fill(stub, client):
+    stub.fill_after_sec = 0.6
+    order = client.place_limit_buy_order('SYM1', 4, 10.0)
+    events = []
+    with OrderWatcher(client, min_interval_sec=0.05, max_interval_sec=0.1) as watcher:
+        future = watcher.watch(order['orderId'], client.current_account.id, lambda event, state: events.append(event))
+        state = future.result(timeout=10)
+    assert state['status'] == 'EXECUTED' and state['filled_quantity'] == 4
+    assert events == ['partial', 'fill']
+    assert watcher.stats()['orders'] == 0
+
+
+def test_order_watcher_reports_cancel(client):
+    order = client.place_limit_buy_order('SYM1', 1, 10.0)
+    events = []
+    future = client.watch_order(order, lambda event, state: events.append(event))
+    client.cancel_order(order['orderId'])
+    assert future.result(timeout=10)['status'] == 'CANCELLED'
+    assert events == ['cancel']
+    assert client.order_watcher.watched() == {}
+
+
+def test_order_watcher_unwatch_cancels_future(client):
+    order = client.place_limit_buy_order('SYM1', 1, 10.0)
+    watcher = OrderWatcher(client)
+    future = watcher.watch(order['orderId'], client.current_account.id)
+    watcher.unwatch(order['orderId'])
+    assert future.cancelled() and watcher.watched() == {}
+
+
+def test_order_watcher_polls_each_account_with_one_request(stub, make_client, monkeypatch):
+    stub.orders = 0
+    client = make_client()
+    monkeypatch.setattr(client, '_Etrader__schedule_reconcile', lambda account: None)
+    handles = client.accounts[:2]
+    orders = [(handle.id, handle.place_limit_buy_order(f'SYM{i}', 1, 10.0)['orderId']) for handle in handles for i in range(3)]
+    watcher = OrderWatcher(client)
+    for account_id, order_id in orders:
+        watcher.watch(order_id, account_id)
+    before = stub.requests
+    watcher.poll()
+    assert stub.requests - before == len(handles)
+    assert watcher.stats()['requests'] == len(handles) and watcher.stats()['orders'] == len(orders)
+    assert watcher.watched() == {handle.id: [order_id for account_id, order_id in orders if account_id == handle.id] for handle in handles}
+    watcher.stop()
@@ -0,0 +1,142 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from etrader import Cassette, OpenOrderBook, ReservationLedger
+
+CLIENT_ORDER_ID = re.compile(rb'<clientOrderId>([^<]*)</clientOrderId>')
+
+
+def listed_order(order_id, symbol, action, quantity):
+    return {'orderId': order_id, 'OrderDetail': [{'Instrument': [{'Product': {'symbol': symbol}, 'orderAction': action,
+                                                                  'orderedQuantity': quantity}]}]}
+
+
+def test_open_order_book_counts_open_sells():
+    book = OpenOrderBook()
+    assert book.is_stale(30)
+    book.load([listed_order(1, 'AAA', 'SELL', 5), listed_order(2, 'AAA', 'BUY', 7), listed_order(3, 'BBB', 'SELL_SHORT', 2)])
+    assert not book.is_stale(30)
+    assert (book.sell_shares('AAA'), book.sell_shares('BBB'), book.sell_shares('CCC')) == (5, 2, 0)
+    book.add_placed_order({'orderId': 4, 'Instrument': [{'Product': {'symbol': 'AAA'}, 'orderAction': 'SELL', 'quantity': 3}]})
+    assert book.sell_shares('AAA') == 8
+    book.remove(1)
+    book.remove(99)
+    assert book.sell_shares('AAA') == 3
+    book.load([])
+    assert book.sell_shares('AAA') == 0
+
+
+def test_open_order_book_normalizes_order_ids():
+    book = OpenOrderBook()
+    book.load([listed_order('10', 'AAA', 'SELL', 5)])
+    book.add_placed_order({'orderId': 10, 'Instrument': [{'Product': {'symbol': 'AAA'}, 'orderAction': 'SELL', 'quantity': 5}]})
+    assert book.sell_shares('AAA') == 5  # the same order, not booked twice
+    book.remove('10')
+    assert book.sell_shares('AAA') == 0
+
+
+def test_open_sells_are_not_available_to_sell_again(client, monkeypatch):
+    monkeypatch.setattr(client, '_Etrader__schedule_reconcile', lambda account: None)  # the stub keeps listing order 1002
+    held = client.account_list[0]['sharesBySymbol']['SYM2']
+    result = client.place_orders([{'symbol': 'SYM2', 'action': 'SELL', 'num_shares': held, 'limit_price': 10.0}])[0]
+    assert result['error'] == 'No existing holdings of: SYM2'  # committed to the stub's open sell order 1002
+    client.cancel_order('1002')
+    result = client.place_orders([{'symbol': 'SYM2', 'action': 'SELL', 'num_shares': held, 'limit_price': 10.0}])[0]
+    assert result['error'] is None and result['num_shares'] == held
+
+
+def test_list_orders_count(stub, client):
+    stub.orders = 250
+    assert len(client.list_orders(count=None)['Order']) == 250
+    assert len(client.list_orders(count=120)['Order']) == 120
+    assert len(client.list_orders()['Order']) == 100
+    assert len(client.list_open_orders(count=None)['Order']) == 50
+    assert {o['OrderDetail'][0]['Instrument'][0]['Product']['symbol'] for o in client.list_ticker_orders('SYM5', count=None)['Order']} == {'SYM5'}
+    stub.orders = 0
+    assert client.list_orders(count=None) == []
+
+
+def test_iter_transactions_follows_markers(stub, client):
+    stub.transactions = 120
+    assert len(list(client.iter_transactions(page_size=50))) == 120
+    assert len(list(client.iter_transactions(page_size=50, prefetch=False))) == 120
+    assert len(client.get_account_transaction_history(count=None)) == 120
+    assert len(client.get_account_transaction_history(count=60)) == 60
+
+
+def test_reservation_ledger_caps_by_cash_and_request():
+    ledger = ReservationLedger()
+    ledger.set_cash('k0', 1000.0)
+    assert ledger.reserve_cash('k0', 100.0, num_shares=5) == 5
+    assert ledger.reserve_cash('k0', 100.0, dollar_amount=250.0) == 2
+    assert ledger.reserve_cash('k0', 100.0, num_shares=10) == 3
+    assert ledger.cash('k0') == 0
+    assert ledger.reserve_cash('k0', 100.0, num_shares=1) == 0
+    assert ledger.reserve_cash('k1', 0.0, num_shares=1) == 0
+
+
+def test_reservation_ledger_never_over_commits_concurrently():
+    ledger = ReservationLedger()
+    ledger.set_shares('k0', 'AAA', 10)
+    with ThreadPoolExecutor(16) as pool:
+        reserved = list(pool.map(lambda _: ledger.reserve_shares('k0', 'AAA', 1), range(50)))
+    assert sum(reserved) == 10
+    assert ledger.shares('k0', 'AAA') == 0
+
+
+def test_place_orders_uses_one_client_order_id_per_order(make_client):
+    cassette = Cassette()
+    client = make_client(record_to=cassette)
+    intents = [{'symbol': 'SYM%d' % i, 'action': 'BUY', 'num_shares': 1, 'limit_price': 10.0} for i in range(4)]
+    results = client.place_orders(intents)
+    assert [r['error'] for r in results] == [None] * 4
+    assert len({r['order']['orderId'] for r in results}) == 4
+    ids = {}
+    for interaction in cassette.interactions:
+        if interaction['method'] == 'POST':
+            kind = interaction['url'].rsplit('/', 1)[-1]
+            ids.setdefault(kind, []).append(CLIENT_ORDER_ID.search(interaction['body']).group(1))
+    assert sorted(ids['preview.json']) == sorted(ids['place.json'])
+    assert len(set(ids['place.json'])) == 4
+    assert all(len(client_order_id) <= 20 for client_order_id in ids['place.json'])
+
+
+def test_stub_rejects_duplicate_client_order_ids(client):
+    intent = {'symbol': 'SYM1', 'action': 'BUY', 'num_shares': 1, 'limit_price': 10.0, 'unique_id': 'order-1'}
+    assert client.place_orders([intent])[0]['error'] is None
+    retried = client.place_orders([intent, dict(intent, unique_id='order-2')])
+    assert '400' in retried[0]['error'] and retried[0]['order'] is None
+    assert retried[1]['error'] is None  # other intents of the batch still go through
+
+
+def test_place_orders_keeps_funds_of_failed_orders_reserved(client):
+    client.place_orders([{'symbol': 'SYM1', 'action': 'BUY', 'num_shares': 1, 'limit_price': 10.0, 'unique_id': 'used'}])
+    cash = client.account_list[0]['cashAvailable']
+    price = cash / 1000
+    results = client.place_orders([{'symbol': 'SYM1', 'action': 'BUY', 'num_shares': 600, 'limit_price': price, 'unique_id': 'used'},
+                                   {'symbol': 'SYM2', 'action': 'BUY', 'num_shares': 600, 'limit_price': price}])
+    assert results[0]['num_shares'] == 600 and results[0]['error'] is not None
+    assert results[1]['num_shares'] == 400 and results[1]['error'] is None
+
+
+def test_place_orders_validates_each_intent(client):
+    intents = [{'symbol': 'SYM0', 'action': 'SELL'},
+               {'action': 'BUY', 'num_shares': 1},
+               {'symbol': 'SYM1', 'action': 'HOLD', 'num_shares': 1},
+               {'symbol': 'SYM1', 'action': 'BUY'},
+               {'symbol': 'SYM1', 'action': 'BUY', 'num_shares': 1, 'account_id': 'nope'},
+               {'symbol': 'SYM1', 'action': 'buy', 'num_shares': 1, 'limit_price': 10.0}]
+    results = client.place_orders(intents)
+    assert results[0]['error'] == 'SELL intents need num_shares'
+    assert results[1]['error'] == "Intent is missing 'symbol'"
+    assert results[2]['error'] == 'Unsupported action: HOLD'
+    assert results[3]['error'] == 'BUY intents need num_shares or dollar_amount'
+    assert results[4]['error'] is not None
+    assert results[5]['error'] is None and results[5]['num_shares'] == 1
+
+
+def test_place_orders_reports_failed_submissions(stub, client):
+    client.place_orders([{'symbol': 'SYM1', 'action': 'BUY', 'num_shares': 1, 'limit_price': 10.0}])  # load accounts and the order book
+    stub.failure_rate = 1.0
+    results = client.place_orders([{'symbol': 'SYM1', 'action': 'BUY', 'num_shares': 1, 'limit_price': 10.0}])
+    assert '500' in results[0]['error'] and results[0]['order'] is None
@@ -0,0 +1,52 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from etrader import PortfolioTable
+
+
+def test_portfolio_table_aggregates_and_revalues():
+    accounts = [{'accountId': 'A', 'positions': [
+                    {'symbolDescription': 'AAA', 'quantity': 10, 'totalCost': 100.0, 'Quick': {'lastTrade': 12.0}},
+                    {'symbolDescription': 'AAA', 'quantity': 5, 'totalCost': 60.0, 'Quick': {'lastTrade': 12.0}},
+                    {'symbolDescription': 'BBB', 'quantity': 4, 'positionType': 'SHORT', 'totalCost': 80.0, 'marketValue': -100.0}]},
+                {'accountId': 'B', 'positions': [{'symbolDescription': 'BBB', 'quantity': 6, 'pricePaid': 20.0}]},
+                {'accountId': 'C', 'positions': []}]
+    table = PortfolioTable(accounts)
+    assert table.symbols == ['AAA', 'BBB'] and len(table) == 4
+    assert list(table.symbol_quantity) == [15.0, 2.0] and list(table.symbol_price) == [12.0, 25.0]
+    assert list(table.cost_basis) == [160.0, -80.0 + 120.0]
+    assert table.totals() == {'exposure': 230.0, 'gross_exposure': 430.0, 'cost_basis': 200.0, 'unrealized_pnl': 30.0}
+    assert table.by_account()['A']['exposure'] == 180.0 - 100.0 and table.by_account()['C']['exposure'] == 0.0
+    table.revalue({'AAA': 10.0, 'BBB': {'error': 'no quote'}})
+    assert list(table.symbol_price) == [10.0, 25.0]  # symbols with no price keep the old one
+    table.revalue(np.array([np.nan, 30.0]))
+    assert table.symbol('BBB') == {'quantity': 2.0, 'price': 30.0, 'exposure': 60.0, 'cost_basis': 40.0, 'unrealized_pnl': 20.0,
+                                   'weight': 60.0 / 450.0}
+    assert list(table.to_structured()['symbol']) == ['AAA', 'BBB']
+
+
+def test_client_portfolio_table(stub, client):
+    stub.accounts, stub.positions = 2, 5
+    table = client.get_portfolio_table(revalue=True)
+    assert table.accounts == ['10000', '10001'] and len(table) == 10
+    snapshot = client.get_quote_snapshot(table.symbols)
+    table.revalue(snapshot, field='bid')
+    assert np.allclose(table.symbol_price, snapshot.bid[[snapshot.index[s] for s in table.symbols]])
+    assert math.isclose(table.totals()['exposure'], float(np.sum(table.market_value)))
+
+
+def test_client_portfolio_table_reads_cached_positions(stub, make_client):
+    stub.accounts, stub.positions = 3, 4
+    client = make_client(lazy_accounts=True)
+    before = stub.requests
+    table = client.get_portfolio_table(account_ids=['10001'])
+    assert table.accounts == ['10001'] and len(table) == 4
+    loaded = stub.requests
+    assert loaded - before == 1 + 2  # the account list, then balance and portfolio of the one account
+    client.get_portfolio_table(account_ids=['10001'])
+    assert stub.requests == loaded  # served from the cached positions
+    client.get_portfolio_table(account_ids=['10001'], refresh=True)
+    assert stub.requests == loaded + 2
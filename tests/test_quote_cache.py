@@ -0,0 +1,83 @@
+import time
+import threading
+
+from etrader import TTLCache
+
+
+def test_ttl_cache_coalesces_concurrent_misses():
+    cache, calls, barrier = TTLCache(), [], threading.Barrier(8)
+
+    def __loader(key):
+        calls.append(key)
+        time.sleep(0.2)
+        return key.upper()
+
+    def __get():
+        barrier.wait()
+        results.append(cache.get('a', __loader, 10))
+
+    results = []
+    threads = [threading.Thread(target=__get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['a']
+    assert results == ['A'] * 8
+    assert cache.stats()['misses'] == 1 and cache.stats()['coalesced'] == 7
+
+
+def test_ttl_cache_loader_error_reaches_every_waiter():
+    cache, barrier = TTLCache(), threading.Barrier(4)
+
+    def __loader(keys):
+        time.sleep(0.2)
+        raise RuntimeError('down')
+
+    def __get():
+        barrier.wait()
+        try:
+            cache.get_many(['a'], __loader, 10)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    errors = []
+    threads = [threading.Thread(target=__get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == ['down'] * 4
+    assert cache.get('a', lambda key: 'up', 10) == 'up'  # the failed load is not left in flight
+
+
+def test_ttl_cache_expiry_lru_and_errors():
+    cache = TTLCache(max_size=2)
+    assert cache.get_many(['a', 'b', 'c'], lambda keys: {k: k for k in keys}, 10) == {'a': 'a', 'b': 'b', 'c': 'c'}
+    assert cache.stats()['size'] == 2  # 'a' was evicted
+    assert cache.get('c', lambda key: 'new', 10) == 'c'
+    assert cache.get('c', lambda key: 'new', 0) == 'new'
+    assert cache.get('e', lambda key: {'error': 'no quote'}, 10) == {'error': 'no quote'}
+    assert cache.get('e', lambda key: 'ok', 10) == 'ok'  # error values are not cached
+
+
+def test_ttl_cache_invalidate_matching():
+    cache = TTLCache()
+    keys = [('chain', 'AAA', 1), ('chain', 'AAA', 2), ('chain', 'BBB', 1), ('expiry', 'AAA')]
+    cache.get_many(keys, lambda missing: {k: k for k in missing}, 10)
+    cache.invalidate_matching(lambda key: key[0] == 'chain' and key[1] == 'AAA')
+    reloaded = []
+    cache.get_many(keys, lambda missing: reloaded.extend(missing) or {k: k for k in missing}, 10)
+    assert reloaded == [('chain', 'AAA', 1), ('chain', 'AAA', 2)]
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
+
+
+def test_client_quote_cache(stub, make_client):
+    client = make_client(quote_cache_size=64, quote_max_age_sec=60)
+    first = client.get_quote(['SYM1', 'SYM2'])
+    before = stub.requests
+    assert client.get_quote(['SYM2', 'SYM1']) == first
+    assert stub.requests == before
+    client.get_quote(['SYM1'], max_age_sec=0)
+    assert stub.requests == before + 1
@@ -0,0 +1,36 @@
+import json
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from etrader import QuoteSnapshot
+
+
+def test_quote_snapshot(client):
+    snapshot = client.get_quote_snapshot(['SYM1', 'sym2', 'BAD1', 'SYM1'])
+    assert snapshot.symbols == ['SYM1', 'sym2'] and snapshot.missing == ['BAD1']
+    assert 'sym2' in snapshot and 'BAD1' not in snapshot and len(snapshot) == 2
+    assert snapshot.last.dtype == np.float64 and snapshot.volume.dtype == np.int64
+    assert np.allclose(snapshot.ask - snapshot.bid, 0.02)
+    row = snapshot.row('sym2')
+    assert row['bid_size'] == 200 and row['timestamp'] > 0
+    table = snapshot.to_structured()
+    assert list(table['symbol']) == ['SYM1', 'sym2'] and table['last'][1] == row['last']
+
+
+def test_quote_snapshot_chunks_match_get_quote(stub, client):
+    symbols = [stub.symbol(i) for i in range(120)]  # three quote requests
+    snapshot = client.get_quote(symbols, columnar=True)
+    assert snapshot.symbols == symbols and snapshot.missing == []
+    assert snapshot.field_names()[-1] == 'timestamp'
+
+
+def test_quote_snapshot_parser_handles_missing_fields():
+    hook, symbols, columns = QuoteSnapshot.parser()
+    json.loads('{"QuoteResponse": {"QuoteData": [{"dateTimeUTC": 7, "Product": {"symbol": "AAA"}, "All": {"bid": 1.5}}]}}',
+               object_pairs_hook=hook)
+    snapshot = QuoteSnapshot(symbols, columns)
+    assert snapshot.symbols == ['AAA'] and snapshot.bid[0] == 1.5 and math.isnan(snapshot.ask[0])
+    assert snapshot.volume[0] == 0 and snapshot.timestamp[0] == 7
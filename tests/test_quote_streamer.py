@@ -0,0 +1,86 @@
+import time
+import asyncio
+import threading
+
+from etrader import QuoteStreamer
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_streamer_delivers_only_changed_fields(client):
+    streamer = QuoteStreamer(client)
+    updates = []
+    subscription = streamer.subscribe(['SYM1', 'SYM2'], lambda symbol, changes, quote: updates.append((symbol, changes, quote)))
+    streamer.poll()
+    assert sorted(symbol for symbol, _, _ in updates) == ['SYM1', 'SYM2']
+    assert all(changes == quote for _, changes, quote in updates)  # everything is new on the first poll
+    updates.clear()
+    streamer.poll()
+    for symbol, changes, quote in updates:
+        assert changes and set(changes) < set(quote)
+        assert 'companyName' not in changes
+    late = []
+    streamer.subscribe('SYM1', lambda *update: late.append(update))
+    assert [symbol for symbol, _, _ in late] == ['SYM1']  # the latest known quote right away
+    subscription.remove_symbols('SYM2')
+    assert streamer.watchlist() == ['SYM1']
+    streamer.stop()
+    assert streamer.watchlist() == [] and streamer.stats()['subscribers'] == 0
+
+
+def test_iteration_ends_when_the_streamer_stops(client):
+    subscription = client.stream_quotes(['SYM1'], interval_sec=0.05)
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(subscription))
+    thread.start()
+    wait_for(lambda: len(received) >= 2)
+    client.quote_streamer.stop()
+    thread.join(5)
+    assert not thread.is_alive() and subscription.closed
+
+
+def test_breaking_out_of_for_unsubscribes(client):
+    kept = []
+    client.stream_quotes(['SYM1'], lambda *update: kept.append(update), interval_sec=0.05)
+    subscription = client.stream_quotes(['SYM2'])
+    for symbol, changes, quote in subscription:
+        assert symbol == 'SYM2'
+        break
+    assert subscription.closed
+    assert client.quote_streamer.watchlist() == ['SYM1']
+    assert client.quote_streamer.stats()['subscribers'] == 1
+
+
+def test_async_subscriber_dropping_out_does_not_stop_the_others(client, capsys):
+    kept = []
+    client.stream_quotes(['SYM1'], lambda *update: kept.append(update), interval_sec=0.05)
+
+    async def __first_update():
+        async for update in client.stream_quotes(['SYM1', 'SYM2']):
+            return update
+
+    assert asyncio.run(__first_update())[0] in ('SYM1', 'SYM2')
+    assert client.quote_streamer.stats()['subscribers'] == 1
+    count = len(kept)
+    wait_for(lambda: len(kept) >= count + 3)
+    client.close()
+    assert 'failed' not in capsys.readouterr().out
+
+
+def test_subscriber_whose_event_loop_closed_is_dropped(client, capsys):
+    kept = []
+    client.stream_quotes(['SYM1'], lambda *update: kept.append(update), interval_sec=0.05)
+    loop = asyncio.new_event_loop()
+    updates = client.stream_quotes(['SYM2']).__aiter__()
+    assert loop.run_until_complete(updates.__anext__())[0] == 'SYM2'
+    loop.close()  # without finishing the iteration
+    wait_for(lambda: client.quote_streamer.stats()['subscribers'] == 1)
+    count = len(kept)
+    wait_for(lambda: len(kept) >= count + 3)
+    client.close()
+    assert 'failed' not in capsys.readouterr().out
@@ -0,0 +1,89 @@
+import time
+import threading
+
+import pytest
+import requests
+
+import etrader
+from etrader import RateLimiter
+
+
+def test_rate_limiter_admits_by_priority():
+    limiter = RateLimiter({'order': (20.0, 1)}, backoff_base_sec=0.01)
+    limiter.throttled('order', retry_after='0.3')  # hold the bucket so every waiter queues
+    admitted, lock = [], threading.Lock()
+
+    def __acquire(priority, name):
+        limiter.acquire('order', priority)
+        with lock:
+            admitted.append(name)
+
+    threads = [threading.Thread(target=__acquire, args=(etrader.Etrader.PRIORITY_BULK, f'bulk{i}')) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    threads += [threading.Thread(target=__acquire, args=(etrader.Etrader.PRIORITY_ORDER, f'order{i}')) for i in range(3)]
+    for thread in threads[3:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [name[:-1] for name in admitted] == ['order'] * 3 + ['bulk'] * 3
+    assert [name for name in admitted if name.startswith('bulk')] == ['bulk0', 'bulk1', 'bulk2']  # FIFO within a priority
+
+
+def test_rate_limiter_backoff_and_recovery():
+    limiter = RateLimiter({'market': (10.0, 5)}, backoff_base_sec=0.01, recovery_fraction=0.5)
+    assert 0.2 <= limiter.throttled('market', retry_after='0.2') <= 0.21
+    assert 0.04 <= limiter.throttled('market', attempt=2) <= 0.05  # no Retry-After: exponential backoff
+    assert limiter.stats()['market']['rate'] == 2.5
+    start = time.monotonic()
+    limiter.acquire('market')
+    assert time.monotonic() - start >= 0.15
+    limiter.succeeded('market')
+    assert limiter.stats()['market']['rate'] == 7.5
+    limiter.succeeded('market')
+    assert limiter.stats()['market']['rate'] == 10.0
+    assert limiter.acquire('unlimited') == 0.0
+
+
+def test_parse_retry_after():
+    assert RateLimiter.parse_retry_after('3') == 3.0
+    assert RateLimiter.parse_retry_after('-1') == 0.0
+    assert RateLimiter.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0  # in the past
+    assert RateLimiter.parse_retry_after(None) is None
+    assert RateLimiter.parse_retry_after('soon') is None
+
+
+def test_client_retries_throttled_responses(stub, make_client):
+    client = make_client(rate_limits=RateLimiter.DEFAULT_LIMITS)
+    client.rate_limiter = RateLimiter(RateLimiter.DEFAULT_LIMITS, backoff_base_sec=0.01)
+    throttled = client.rate_limiter.throttled
+
+    def __throttled(*args, **kwargs):
+        stub.throttle_rate = 0.0  # the retry goes through
+        return throttled(*args, **kwargs)
+
+    client.rate_limiter.throttled = __throttled
+    client.get_quote('SYM1')  # connect first so only quote requests are counted
+    stub.throttle_rate, before = 1.0, stub.requests
+    assert 'All' in client.get_quote('SYM1')['SYM1']
+    assert stub.requests == before + 2
+    assert client.rate_limiter.stats()['market']['rate'] < RateLimiter.DEFAULT_LIMITS['market'][0]
+
+
+def test_client_gives_up_after_max_retries(stub, make_client):
+    client = make_client(rate_limits=RateLimiter.DEFAULT_LIMITS, max_retries=2)
+    client.rate_limiter = RateLimiter(RateLimiter.DEFAULT_LIMITS, backoff_base_sec=0.01)
+    client.get_account_balance()
+    stub.throttle_rate, before = 1.0, stub.requests
+    with pytest.raises(requests.HTTPError):
+        client.get_account_balance()
+    assert stub.requests == before + 3
+
+
+def test_client_without_rate_limiter_does_not_retry(stub, client):
+    client.get_account_balance()
+    stub.throttle_rate, before = 1.0, stub.requests
+    with pytest.raises(requests.HTTPError):
+        client.get_account_balance()
+    assert stub.requests == before + 1
@@ -0,0 +1,112 @@
+import time
+import threading
+from datetime import datetime, timedelta
+
+from etrader import SessionManager
+
+
+class Upkeep(object):
+    '''renew and reauthorize callbacks that record their calls'''
+    def __init__(self, renewed=True):
+        self.renewed = renewed
+        self.calls = []
+        self.manager = SessionManager(self.renew, self.reauthorize, renew_every_sec=60)
+
+    def renew(self):
+        self.calls.append('renew')
+        if isinstance(self.renewed, Exception):
+            raise self.renewed
+        if self.renewed:
+            self.manager.mark_renewed()
+        return self.renewed
+
+    def reauthorize(self):
+        self.calls.append('reauthorize')
+        self.manager.swap(object())
+
+
+def test_check_renews_only_when_due():
+    upkeep = Upkeep()
+    upkeep.manager.swap('session')
+    upkeep.manager.check()
+    assert upkeep.calls == []
+    upkeep.manager.mark_renewed(datetime.now() - timedelta(seconds=61))
+    upkeep.manager.check()
+    upkeep.manager.check(force=True)
+    assert upkeep.calls == ['renew', 'renew']
+    assert upkeep.manager.session == 'session'
+
+
+def test_failed_renewal_reauthorizes():
+    for failure in (False, ConnectionError('reset')):
+        upkeep = Upkeep(renewed=failure)
+        upkeep.manager.swap('expired')
+        upkeep.manager.check(force=True)
+        assert upkeep.calls == ['renew', 'reauthorize']
+        assert upkeep.manager.session != 'expired'
+
+
+def test_concurrent_checks_do_not_pile_up():
+    calls, release = [], threading.Event()
+
+    def __renew():
+        calls.append('renew')
+        return release.wait(5)
+
+    manager = SessionManager(__renew, lambda: calls.append('reauthorize'))
+    thread = threading.Thread(target=manager.check, kwargs={'force': True})
+    thread.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    manager.check(force=True)  # returns at once while the other renewal runs
+    assert time.monotonic() - start < 0.05
+    release.set()
+    thread.join(5)
+    assert calls == ['renew']
+
+
+def test_swap_keeps_the_old_session_usable():
+    manager = SessionManager(lambda: True, lambda: None)
+    manager.swap('old')
+    in_flight = manager.session
+    first_start = manager.session_start_time
+    time.sleep(0.01)
+    manager.swap('new')
+    assert in_flight == 'old' and manager.session == 'new'
+    assert manager.session_start_time > first_start
+
+
+def test_scheduler_renews_ahead_of_expiry_and_stops():
+    upkeep = Upkeep()
+    upkeep.manager.renew_every_sec = 0.1
+    upkeep.manager.swap('session')
+    assert upkeep.manager.seconds_until_due() <= 0.1
+    upkeep.manager.start()
+    upkeep.manager.start()  # already running
+    time.sleep(0.35)
+    upkeep.manager.stop()
+    renewals = len(upkeep.calls)
+    assert 2 <= renewals <= 4 and set(upkeep.calls) == {'renew'}
+    time.sleep(0.2)
+    assert len(upkeep.calls) == renewals
+
+
+def test_client_renews_against_the_stub(stub, client):
+    client.get_quote('SYM1')
+    manager = client._Etrader__session_manager
+    manager.mark_renewed(datetime.now() - timedelta(hours=2))
+    before, session = stub.requests, client.session
+    manager.check()
+    assert stub.requests == before + 1
+    assert (datetime.now() - client.session_start_time).total_seconds() < 5
+    assert client.session is session
+
+
+def test_client_reauthorizes_when_renewal_fails(stub, client):
+    client.get_quote('SYM1')
+    session = client.session
+    stub.failure_rate = 1.0
+    client._Etrader__session_manager.check(force=True)
+    stub.failure_rate = 0.0
+    assert client.session is not session
+    assert 'All' in client.get_quote('SYM1')['SYM1']
@@ -0,0 +1,58 @@
+import time
+import threading
+from datetime import datetime, timedelta
+
+from etrader import SessionStore
+
+
+def test_session_store_lock_is_exclusive_and_reentrant(tmp_path):
+    path = str(tmp_path / 'cache.bin')
+    first, second = SessionStore(path), SessionStore(path)  # separate lock files, as in two processes
+    events = []
+
+    def __second():
+        with second.lock():
+            events.append('second')
+
+    with first.lock():
+        with first.lock():  # re-entrant within a thread
+            thread = threading.Thread(target=__second)
+            thread.start()
+            time.sleep(0.2)
+            events.append('first')
+    thread.join(5)
+    assert events == ['first', 'second']
+
+
+def test_session_store_write_read_and_freshness(tmp_path):
+    store = SessionStore(str(tmp_path / 'cache.bin'), fresh_sec=60)
+    assert store.read() is None
+    written = store.write({'oauth_token': 'token'})
+    assert store.read() == written
+    assert store.is_fresh(written)
+    assert not store.is_fresh({'oauth_token': 'token'})  # written before stamps were kept
+    store.clear()
+    assert store.read() is None
+
+
+def test_client_adopts_session_written_by_another_process(client):
+    client.get_quote('SYM1')  # authorize
+    manager = client._Etrader__session_manager
+    manager.mark_renewed(datetime.now() - timedelta(minutes=5))
+    session = dict(client.session_store.read() or {}, oauth_token='t', oauth_token_secret='s', authorize_url='', verifier='v',
+                   session={'consumer_key': client.consumer_key, 'consumer_secret': 'stub-consumer-secret',
+                            'access_token': 'renewed-token', 'access_token_secret': 'renewed-secret'})
+    written_at = client.session_store.written_at(client.session_store.write(session))
+    assert client._Etrader__adopt_cached_session()
+    assert client.session.access_token == 'renewed-token'
+    assert client.session_start_time == written_at
+    assert not client._Etrader__adopt_cached_session(new_token_only=True)  # nothing newer to take over
+    assert 'All' in client.get_quote('SYM1')['SYM1']
+
+
+def test_client_ignores_stale_cached_session(client):
+    client.get_quote('SYM1')
+    client.session_store.write({'session': {'access_token': 'older-token'}})
+    client._Etrader__session_manager.mark_renewed(datetime.now() + timedelta(seconds=1))
+    assert not client._Etrader__adopt_cached_session()
+    assert client.session.access_token != 'older-token'
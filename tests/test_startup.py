@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+import subprocess
+
+import etrader
+
+
+def upkeep_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'etrader-session-upkeep']
+
+
+def test_import_defers_heavy_modules():
+    code = "import sys, etrader; print(sorted(m for m in ('numpy', 'jxmlease', 'sqlite3', 'aiohttp') if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(etrader.__file__)), capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_deferred_client_does_nothing_until_used(stub, make_client):
+    make_client()
+    assert stub.requests == 0
+    assert upkeep_threads() == []
+
+
+def test_token_upkeep_starts_with_any_first_call(stub, make_client):
+    client = make_client()
+    assert 'All' in client.get_quote('SYM1')['SYM1']
+    assert stub.requests == 1  # authorized without loading accounts
+    assert len(upkeep_threads()) == 1
+    client.close()
+    assert upkeep_threads() == []
+
+
+def test_replay_has_no_token_upkeep(make_client, tmp_path):
+    path = str(tmp_path / 'quotes.cassette')
+    recorder = make_client(record_to=path)
+    recorder.get_quote('SYM1')
+    recorder.close()
+    replayer = make_client(replay_from=path)
+    assert 'All' in replayer.get_quote('SYM1')['SYM1']
+    assert upkeep_threads() == []